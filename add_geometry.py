@@ -1,11 +1,14 @@
 import pandas as pd
-import requests
 import json
 import os
+from shapely.geometry import shape
 from tqdm import tqdm
 
+from apportionment import Apportionment
+from instrumentation import http_get, instrumented, stage, timed_iter
+
 # --- CONFIGURATION ---
-INPUT_DATA = 'resultat_kepler_OPTIMISE.csv'
+INPUT_DATA = 'datacreation/resultat_detail_temporel.csv'  # Sortie de big_one.py (CodePostal, Quantite_kg)
 OUTPUT_FILE = 'datacreation/resultat_kepler_FINAL_POLYGONES.csv'
 
 # 1. Source des formes (GeoJSON simplifié pour être léger)
@@ -50,7 +53,7 @@ def merge_geometry():
 
     if not os.path.exists(INPUT_DATA):
         print(f"Erreur : Fichier {INPUT_DATA} introuvable.")
-        return
+        return False
 
     # 1. Chargement des données d'achats
     print("Lecture de vos données optimisées...")
@@ -58,14 +61,14 @@ def merge_geometry():
         df_data = pd.read_csv(INPUT_DATA, dtype={'CodePostal': str})
     except Exception as e:
         print(f"Erreur de lecture : {e}")
-        return
+        return False
 
     print(f" -> {len(df_data)} lignes à géolocaliser.")
 
     # 2. Chargement du Mapping (CP -> INSEE)
     print("Téléchargement du dictionnaire CP <-> INSEE...")
     try:
-        r_map = requests.get(MAPPING_URL)
+        r_map = http_get(MAPPING_URL)
         mapping_data = r_map.json()
 
         # Dictionnaire : {CodePostal: [Liste de Codes INSEE]}
@@ -80,19 +83,20 @@ def merge_geometry():
                     cp_to_insee[cp].append(insee)
     except Exception as e:
         print(f"Erreur mapping : {e}")
-        return
+        return False
 
     # 3. Chargement des Formes (GeoJSON)
     print("Téléchargement des formes des communes (GeoJSON)... Patience.")
     try:
-        r_geo = requests.get(GEOJSON_URL)
+        r_geo = http_get(GEOJSON_URL)
         geojson = r_geo.json()
 
-        # Dictionnaire : {CodeINSEE: Texte_WKT}
+        # Dictionnaires : {CodeINSEE: Texte_WKT}, {CodeINSEE: {area, nom}} (clé de répartition)
         insee_to_wkt = {}
+        commune_index = {}
         features = geojson['features']
 
-        for f in tqdm(features, desc="Conversion Formes"):
+        for f in timed_iter(tqdm(features, desc="Conversion Formes"), 'conversion_wkt'):
             props = f['properties']
             code_insee = props.get('code')
             geometry = f['geometry']
@@ -101,19 +105,29 @@ def merge_geometry():
             wkt = convert_geojson_to_wkt(geometry)
             if wkt and code_insee:
                 insee_to_wkt[code_insee] = wkt
+                commune_index[code_insee] = {'area': shape(geometry).area, 'nom': props.get('nom')}
 
     except Exception as e:
         print(f"Erreur GeoJSON : {e}")
-        return
+        return False
 
     # 4. FUSION FINALE
     print("Assemblage final (Données + Formes)...")
+    # Part de chaque commune dans son CP (surface) : la valeur du CP reste dupliquée pour colorier
+    # toute la zone, la colonne <kg>_Commune donne la part ventilée sur la commune
+    ventilation = Apportionment(cp_to_insee, commune_index, ['surface'])
+    parts = ventilation.shares('surface').set_index(['CP', 'INSEE'])['Part'].to_dict()
 
     final_rows = []
+    st = stage('geometrie_communes')
+    kg_col = next((c for c in ['Quantite_Kg', 'Total_Kg_An', 'Quantite_kg'] if c in df_data.columns), None)
+    kgs = df_data[kg_col].fillna(0).values if kg_col else [0.0] * len(df_data)
+    st.record_in(len(df_data), sum(kgs))
 
     # Pour chaque ligne de vente (qui est liée à un Code Postal et une Année)
-    for idx, row in tqdm(df_data.iterrows(), total=len(df_data), desc="Jointure"):
+    for (idx, row), kg in timed_iter(tqdm(zip(df_data.iterrows(), kgs), total=len(df_data), desc="Jointure"), 'jointure'):
         cp = str(row['CodePostal']).zfill(5)
+        st.record_out(1, kg)  # Aucune ligne n'est perdue : au pire, elle garde son point GPS
 
         # On cherche les communes associées à ce Code Postal
         target_insees = cp_to_insee.get(cp, [])
@@ -123,6 +137,7 @@ def merge_geometry():
             row_dict = row.to_dict()
             row_dict['Geometry'] = None  # Kepler utilisera Lat/Lon par défaut
             final_rows.append(row_dict)
+            st.degrade('geometrie_nulle_cp_inconnu', 1, kg)
             continue
 
         # Si on trouve des communes, on duplique la donnée pour colorier toute la zone
@@ -133,6 +148,8 @@ def merge_geometry():
                 row_dict = row.to_dict()
                 row_dict['Code_INSEE'] = insee
                 row_dict['Geometry'] = insee_to_wkt[insee]  # LA FORME !
+                row_dict['Part_Surface'] = parts.get((cp, insee), 0.0)
+                if kg_col: row_dict[f'{kg_col}_Commune'] = kg * row_dict['Part_Surface']
                 final_rows.append(row_dict)
                 found_polygon = True
 
@@ -141,6 +158,7 @@ def merge_geometry():
             row_dict = row.to_dict()
             row_dict['Geometry'] = None
             final_rows.append(row_dict)
+            st.degrade('geometrie_nulle_forme_absente', 1, kg)
 
     # 5. Export
     df_final = pd.DataFrame(final_rows)
@@ -156,4 +174,5 @@ def merge_geometry():
 
 
 if __name__ == "__main__":
-    merge_geometry()
\ No newline at end of file
+    import sys
+    sys.exit(1 if instrumented('add_geometry', merge_geometry) is False else 0)
@@ -0,0 +1,382 @@
+import numpy as np
+import pandas as pd
+import os
+import glob
+import hashlib
+import json
+from shapely.geometry import shape
+
+from apportionment import SCHEMES, Apportionment, dept_of_insee, load_commune_attributes
+from cas import align_on_cas, canonical_cas
+from duckstore import detect_columns
+from instrumentation import http_get, instrumented, stage, timed
+from outofcore import duckdb_connect, purchases_sql, spill_purchases
+from parquet_layout import write_sorted
+
+# --- CONFIGURATION ---
+ANNEE_CIBLE = '2023'
+INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
+AGG_DIR = 'datacreation/agregats'
+TOP_N = 5  # Taille du classement affiché avant "Lire la suite"
+PARTITIONS_DIR = 'partitions'  # Détail commune x substance, un fichier par (année, département du CP)
+MANIFEST_FILE = 'manifest.json'  # Empreinte du contenu source de chaque partition
+PARTITIONS_VERSION = 2  # À incrémenter quand le calcul ou le format des partitions change : tout est recalculé
+PARTITIONS_SCHEME = 'surface'  # Clé de répartition des partitions (les autres clés repartent du CSV)
+RANKINGS_FILE = 'classements.parquet'  # Classements de substances triés, relus par le tableau de bord
+RANKING_LEVELS = {'communes': 'INSEE', 'depts': 'Dept'}  # Niveau de classement -> colonne clé
+STAGING_FILE = 'achats_agreges.parquet'  # Achats agrégés (Annee, CP, CAS, qty), réécrits à chaque construction
+
+# URLs Géo
+# Niveau 1 : Départements (Léger pour la vue France)
+GEOJSON_DEPTS = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson"
+# Niveau 2 : Communes (Lourd, on filtrera)
+GEOJSON_COMMUNES = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/communes-version-simplifiee.geojson"
+MAPPING_URL = "https://unpkg.com/codes-postaux@4.0.0/codes-postaux.json"
+
+# Tables persistées : {nom: colonnes de tri (clé de lecture)}
+TABLES = {
+    'national': ['Annee'],
+    'departements': ['Annee', 'Dept'],
+    'communes': ['Annee', 'Dept', 'INSEE'],
+    'communes_substances': ['Annee', 'INSEE', 'CAS'],
+    'substances': ['Annee', 'CAS'],
+}
+
+
+@timed('referentiels_geo')
+def load_geo_references():
+    """Télécharge les référentiels géo : {Dept: feature}, {INSEE: infos commune}, {CP: [INSEE]}"""
+    geo_depts = http_get(GEOJSON_DEPTS).json()
+    geo_communes = http_get(GEOJSON_COMMUNES).json()
+
+    # Indexation spatiale
+    dept_index = {f['properties']['code']: f for f in geo_depts['features']}
+
+    commune_index = {}  # {INSEE: {area, nom, geometry, dept_code}}
+    for f in geo_communes['features']:
+        code = f['properties']['code']
+        if f.get('geometry'):
+            commune_index[code] = {
+                'area': shape(f['geometry']).area,
+                'nom': f['properties']['nom'],
+                'geom': f,
+                'dept': dept_of_insee(code)  # 2 premiers caractères (01, 2A), 3 outre-mer (971)
+            }
+
+    # Mapping CP
+    raw_map = http_get(MAPPING_URL).json()
+    cp_map = {}
+    for item in raw_map:
+        cp, insee = item.get('codePostal'), item.get('codeCommune')
+        if cp and insee and insee in commune_index:
+            if cp not in cp_map: cp_map[cp] = []
+            if insee not in cp_map[cp]: cp_map[cp].append(insee)
+
+    return dept_index, commune_index, cp_map
+
+
+def read_purchases(csv_path=INPUT_CSV, annee=ANNEE_CIBLE):
+    """Volumes (CP, CAS, qty) de l'année demandée, agrégés par CP et CAS (DuckDB borné en mémoire)"""
+    cols = detect_columns(csv_path)
+    con = duckdb_connect()
+    try:
+        df = con.execute(f"SELECT CP, CAS, qty FROM ({purchases_sql(csv_path, cols)}) WHERE Annee = ?",
+                         [int(annee)]).df()
+    finally:
+        con.close()
+    # Variantes d'écriture d'un même CAS regroupées sous sa forme canonique (cas.py)
+    return df.assign(CAS=canonical_cas(df['CAS'])).groupby(['CP', 'CAS'], as_index=False)['qty'].sum()
+
+
+@timed('ventilation_cp_communes')
+def apportion(gb, cp_map, commune_index, scheme='surface', ventilation=None):
+    """
+    Ventile les volumes par CP sur les communes du CP, au prorata de leur surface par défaut
+    (autres clés : apportionment.SCHEMES). `ventilation` évite de reconstruire les matrices à chaque appel.
+    """
+    ventilation = ventilation or Apportionment(cp_map, commune_index, [scheme])
+    rows = ventilation.rows_of(gb['CP'])
+    df = ventilation.apportion(gb, [scheme], rows).rename(columns={f"Volume_{scheme}": 'Volume'})
+    df_communes = df.loc[df['Volume'] > 0, ['INSEE', 'Commune', 'Dept', 'CAS', 'Volume']].reset_index(drop=True)
+    df_depts = df_communes.groupby('Dept', as_index=False)['Volume'].sum()
+
+    # Volumes non ventilés : CP sans commune connue, ou communes du CP toutes de poids nul
+    qty = gb['qty'].to_numpy(dtype=float)
+    unknown = rows < 0
+    null = ~unknown & ~ventilation.covered(scheme)[rows]
+    st = stage('ventilation_cp_communes')
+    st.record_in(len(gb), qty.sum())
+    st.drop('cp_inconnu', int(unknown.sum()), qty[unknown].sum())
+    st.drop(f"{scheme}_nulle", int(null.sum()), qty[null].sum())
+    st.record_out(int((~unknown & ~null).sum()), df_communes['Volume'].sum())
+    return df_depts, df_communes
+
+
+def build_aggregates(annee=ANNEE_CIBLE, csv_path=INPUT_CSV, agg_dir=AGG_DIR, scheme='surface'):
+    """
+    Charge et agrège les données pour toute la France (depuis les partitions si l'année y est déjà).
+    Les partitions sont ventilées selon PARTITIONS_SCHEME : une autre clé de répartition repart du CSV.
+    """
+    dept_index, commune_index, cp_map = load_geo_references()
+
+    df_communes = load_partitions(agg_dir, annee) if scheme == PARTITIONS_SCHEME else pd.DataFrame()
+    if df_communes.empty:
+        if SCHEMES[scheme] not in (None, 'area'): load_commune_attributes(commune_index)
+        gb = read_purchases(csv_path, annee)
+        _, df_communes = apportion(gb, cp_map, commune_index, scheme)
+
+    df_depts = df_communes.groupby('Dept', as_index=False)['Volume'].sum()
+    return df_depts, df_communes, dept_index, commune_index
+
+
+class Rankings:
+    """
+    Classements de substances précalculés par clé (INSEE ou Dept).
+    Une seule table triée (clé, Volume décroissant) + un index {clé: (début, fin)} :
+    chaque lecture est un découpage positionnel, sans groupby ni tri au moment du clic.
+    """
+
+    COLUMNS = ['CAS', 'Nom', 'Danger', 'Score', 'Volume']
+
+    def __init__(self, df_communes, key, df_subst=None, top_n=TOP_N):
+        self.key = key
+        self.top_n = top_n
+        self._index(ranking_table(df_communes, key), df_subst)
+
+    @classmethod
+    def from_table(cls, table, key, df_subst=None, top_n=TOP_N):
+        """Classements depuis une table (clé, CAS, Volume) déjà triée comme ranking_table (relue du disque)"""
+        self = cls.__new__(cls)
+        self.key = key
+        self.top_n = top_n
+        self._index(table.reset_index(drop=True), df_subst)
+        return self
+
+    def _index(self, df, df_subst):
+        key, top_n = self.key, self.top_n
+        # Libellés joints une fois pour toutes
+        labels = ['Nom', 'Danger', 'Score']
+        if df_subst is not None:
+            df[labels] = align_on_cas(df['CAS'], df_subst[labels]).to_numpy()
+        for col in labels:
+            if col not in df.columns: df[col] = np.nan
+        df['Nom'] = df['Nom'].fillna('CAS ' + df['CAS'].astype(str))
+        df['Danger'] = df['Danger'].fillna('NON CLASSE')
+        df['Score'] = df['Score'].fillna(0).astype(int)
+        self.table = df[[key] + self.COLUMNS]
+
+        keys, starts, counts = np.unique(df[key].values, return_index=True, return_counts=True)
+        self.bounds = dict(zip(keys, zip(starts, starts + counts)))
+
+        rang = df.groupby(key).cumcount()
+        totals = df.groupby(key)['Volume'].sum()
+        tails = df[rang >= top_n].groupby(key)['Volume'].sum().reindex(totals.index, fill_value=0)
+        self.summaries = {
+            k: {'Total': float(t), 'Nb_Substances': int(counts[i]), 'Volume_Autres': float(tails[k])}
+            for i, (k, t) in enumerate(totals.items())
+        }
+
+    def summary(self, k):
+        """{'Total', 'Nb_Substances', 'Volume_Autres'} ou None si la clé n'a aucun achat"""
+        return self.summaries.get(k)
+
+    def ranking(self, k):
+        start, stop = self.bounds.get(k, (0, 0))
+        return self.table.iloc[start:stop][self.COLUMNS]
+
+    def top(self, k):
+        return self.ranking(k).iloc[:self.top_n]
+
+    def tail(self, k):
+        return self.ranking(k).iloc[self.top_n:]
+
+
+def ranking_table(df_communes, key):
+    """Volumes (clé, CAS) triés par clé puis volume décroissant : la table d'un classement, avant libellés"""
+    df = df_communes.groupby([key, 'CAS'], as_index=False)['Volume'].sum()
+    return df.sort_values([key, 'Volume'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+def build_rankings(df_communes, df_subst=None, top_n=TOP_N):
+    """Classements par commune et par département : {'communes': Rankings, 'depts': Rankings}"""
+    return {level: Rankings(df_communes, key, df_subst, top_n) for level, key in RANKING_LEVELS.items()}
+
+
+def save_rankings(df_communes, agg_dir=AGG_DIR):
+    """
+    Tables de classement de toutes les années (communes et départements), précalculées avec les agrégats :
+    (Annee, Niveau, Cle, Rang, CAS, Volume), Rang suivant le volume décroissant dans (Annee, Niveau, Cle).
+    """
+    parts = []
+    for level, key in RANKING_LEVELS.items():
+        df = df_communes.groupby(['Annee', key, 'CAS'], as_index=False)['Volume'].sum()
+        df = df.sort_values(['Annee', key, 'Volume'], ascending=[True, True, False], kind='stable')
+        parts.append(df.rename(columns={key: 'Cle'}).assign(Niveau=level, Rang=df.groupby(['Annee', key]).cumcount()))
+    columns = ['Annee', 'Niveau', 'Cle', 'Rang', 'CAS', 'Volume']
+    write_sorted(pd.concat(parts, ignore_index=True)[columns], os.path.join(agg_dir, RANKINGS_FILE), columns[:4])
+
+
+def read_rankings(annee, df_subst=None, agg_dir=AGG_DIR, top_n=TOP_N):
+    """Classements d'une année relus de RANKINGS_FILE (déjà triés : ni groupby ni tri), None s'ils sont absents"""
+    path = os.path.join(agg_dir, RANKINGS_FILE)
+    if not os.path.exists(path): return None
+    df = pd.read_parquet(path, columns=['Niveau', 'Cle', 'Rang', 'CAS', 'Volume'], filters=[('Annee', '==', int(annee))])
+    if df.empty: return None
+    return {
+        level: Rankings.from_table(df.loc[df['Niveau'] == level, ['Cle', 'CAS', 'Volume']].rename(columns={'Cle': key}),
+                                   key, df_subst, top_n)
+        for level, key in RANKING_LEVELS.items()
+    }
+
+
+def summarize(df_communes):
+    """Dérive les tables persistées (national, départements, communes, substances) du détail communal multi-années"""
+    df = df_communes
+    national = df.groupby('Annee').agg(
+        Volume=('Volume', 'sum'), Nb_Communes=('INSEE', 'nunique'), Nb_Substances=('CAS', 'nunique'))
+    substances = df.groupby(['Annee', 'CAS']).agg(Volume=('Volume', 'sum'), Nb_Communes=('INSEE', 'nunique'))
+
+    return {
+        'national': national.reset_index(),
+        'departements': df.groupby(['Annee', 'Dept'], as_index=False)['Volume'].sum(),
+        'communes': df.groupby(['Annee', 'Dept', 'INSEE', 'Commune'], as_index=False)['Volume'].sum(),
+        'communes_substances': df.groupby(['Annee', 'INSEE', 'Dept', 'CAS'], as_index=False)['Volume'].sum(),
+        'substances': substances.reset_index(),
+    }
+
+
+@timed('tables_de_synthese')
+def save_aggregates(tables, agg_dir=AGG_DIR):
+    """Écrit chaque table en Parquet, triée sur sa clé de lecture (statistiques min/max par groupe de lignes)"""
+    os.makedirs(agg_dir, exist_ok=True)
+    for name, df in tables.items():
+        write_sorted(df, os.path.join(agg_dir, f"{name}.parquet"), TABLES[name])
+
+
+def load_aggregates(agg_dir=AGG_DIR):
+    """Relit les tables précalculées : {nom: DataFrame}"""
+    return {name: pd.read_parquet(os.path.join(agg_dir, f"{name}.parquet")) for name in TABLES}
+
+
+def _partition_path(agg_dir, annee, part):
+    return os.path.join(agg_dir, PARTITIONS_DIR, f"annee={annee}", f"dept={part}.parquet")
+
+
+def load_partitions(agg_dir=AGG_DIR, annee=None):
+    """Détail commune x substance relu depuis les partitions (toutes les années, ou une seule)"""
+    pattern = f"annee={annee}" if annee is not None else "annee=*"
+    files = sorted(glob.glob(os.path.join(agg_dir, PARTITIONS_DIR, pattern, "dept=*.parquet")))
+    if not files:
+        return pd.DataFrame(columns=['Annee', 'INSEE', 'Commune', 'Dept', 'CAS', 'Volume'])
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+
+def available_years(agg_dir=AGG_DIR):
+    """Années présentes dans le magasin de partitions, de la plus récente à la plus ancienne"""
+    dirs = glob.glob(os.path.join(agg_dir, PARTITIONS_DIR, "annee=*"))
+    return sorted((d.rsplit('=', 1)[1] for d in dirs), reverse=True)
+
+
+@timed('empreintes_partitions')
+def partition_hashes(purchases_parquet):
+    """Empreinte du contenu source de chaque partition (année, département du CP) : {'2023/01': empreinte}"""
+    con = duckdb_connect()
+    try:
+        # XOR des hash de lignes : indépendant de l'ordre, calculé sans charger la table en mémoire Python
+        df = con.execute(f"""
+        SELECT Annee, part, bit_xor(hash(CP, CAS, qty)) AS h, count(*) AS n
+        FROM read_parquet('{purchases_parquet}') GROUP BY 1, 2
+        """).df()
+    finally:
+        con.close()
+    return {f"{a}/{p}": f"{int(h):016x}-{n}" for a, p, h, n in df.itertuples(index=False)}
+
+
+def geo_fingerprint(commune_index, cp_map, scheme='surface'):
+    """Empreinte des référentiels qui entrent dans la ventilation : liens CP -> communes, noms et poids de la clé"""
+    attr = SCHEMES[scheme]
+    h = hashlib.sha256()
+    for cp in sorted(cp_map):
+        h.update(f"{cp}:{','.join(sorted(cp_map[cp]))};".encode())
+    for insee in sorted(commune_index):
+        info = commune_index[insee]
+        h.update(f"{insee}:{info['nom']}:{info.get(attr) if attr else ''};".encode())
+    return h.hexdigest()[:16]
+
+
+def build_incremental(csv_path=INPUT_CSV, agg_dir=AGG_DIR, force=False, scheme=PARTITIONS_SCHEME):
+    """
+    Agrégation incrémentale : seules les partitions (année, département) dont le contenu source a changé
+    depuis la dernière construction sont ventilées et réécrites ; les tables de synthèse sont ensuite
+    recalculées à partir de l'ensemble des partitions.
+    Le manifeste garde aussi le contexte de calcul (version du code des partitions, clé de répartition,
+    empreinte des référentiels géo) : s'il change, toutes les partitions sont recalculées.
+    """
+    manifest_path = os.path.join(agg_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    _, commune_index, cp_map = load_geo_references()
+    if SCHEMES[scheme] not in (None, 'area'): load_commune_attributes(commune_index)
+    context = {'version': PARTITIONS_VERSION, 'cle': scheme, 'geo': geo_fingerprint(commune_index, cp_map, scheme)}
+    previous = manifest.get('partitions', {}) if manifest.get('contexte') == context else {}
+
+    # Agrégation du CSV hors mémoire (débordement disque au-delà du budget), puis empreintes par partition
+    os.makedirs(agg_dir, exist_ok=True)
+    staging = spill_purchases(csv_path, detect_columns(csv_path), os.path.join(agg_dir, STAGING_FILE))
+    hashes = partition_hashes(staging)
+    changed = sorted(k for k, h in hashes.items() if force or previous.get(k) != h)
+    removed = sorted(k for k in manifest.get('partitions', {}) if k not in hashes)
+    print(f"Partitions : {len(hashes)} au total, {len(changed)} à recalculer, {len(removed)} supprimées.")
+
+    for key in removed:
+        path = _partition_path(agg_dir, *key.split('/'))
+        if os.path.exists(path): os.remove(path)
+
+    if changed:
+        ventilation = Apportionment(cp_map, commune_index, [scheme])  # Matrice construite une seule fois
+        # Fichier intermédiaire lu une seule fois ; toutes les partitions à recalculer sont ventilées en un seul
+        # produit creux, la partition étant portée par la colonne substance ('2023/01|50-00-0'), puis redécoupées
+        rows = pd.read_parquet(staging, columns=['Annee', 'part', 'CP', 'CAS', 'qty'])
+        keys = rows['Annee'].astype(str) + '/' + rows['part']
+        todo = keys.isin(pd.Index(changed)).to_numpy()
+        gb = pd.DataFrame({'CP': rows['CP'][todo], 'CAS': keys[todo] + '|' + rows['CAS'][todo], 'qty': rows['qty'][todo]})
+        del rows
+        _, df_all = apportion(gb, cp_map, commune_index, scheme, ventilation=ventilation)
+        tag = df_all['CAS'].str.split('|', n=1)
+        df_all['CAS'] = tag.str[1]
+        parts = dict(tuple(df_all.groupby(tag.str[0], sort=False)))
+
+        for key in changed:
+            annee, part = key.split('/')
+            df_communes = parts.get(key, df_all.iloc[:0]).reset_index(drop=True)
+            path = _partition_path(agg_dir, annee, part)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            df_communes.assign(Annee=int(annee)).to_parquet(path, index=False)
+
+    if changed or removed or not all(os.path.exists(os.path.join(agg_dir, f))
+                                     for f in ('national.parquet', RANKINGS_FILE)):
+        df_communes = load_partitions(agg_dir)
+        save_aggregates(summarize(df_communes), agg_dir)
+        save_rankings(df_communes, agg_dir)  # Classements du tableau de bord, triés une fois ici
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'contexte': context, 'partitions': hashes}, f, indent=1, sort_keys=True)
+    return changed
+
+
+def run(force=False):
+    print("--- PRÉCALCUL DES AGRÉGATS (INCRÉMENTAL) ---")
+    if not os.path.exists(INPUT_CSV):
+        print(f"Erreur : Fichier {INPUT_CSV} introuvable.")
+        return False
+
+    changed = build_incremental(INPUT_CSV, AGG_DIR, force=force)
+    print(f"✅ Agrégats à jour dans {AGG_DIR} ({len(changed)} partitions recalculées).")
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(1 if instrumented('aggregates', run, force='--full' in sys.argv) is False else 0)
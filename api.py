@@ -0,0 +1,176 @@
+"""
+API HTTP de consultation des agrégats précalculés (sans Streamlit).
+
+Lancement : uvicorn api:app --port 8000
+Test local : fastapi.testclient.TestClient(create_app('chemin/agregats'))
+
+Chaque route accepte ?format=json|arrow|parquet, ?offset= et ?limit=.
+Les réponses portent un ETag dérivé de la version des fichiers Parquet :
+un client qui renvoie If-None-Match reçoit un 304 tant que les agrégats ne changent pas.
+"""
+import hashlib
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from aggregates import AGG_DIR, TABLES
+from cas import canonical_cas
+
+# --- CONFIGURATION ---
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 100000
+ARROW_BATCH_ROWS = 65536
+MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class AggregateStore:
+    """Tables Parquet gardées en mémoire, rechargées quand un fichier change sur disque"""
+
+    def __init__(self, agg_dir=AGG_DIR):
+        self.agg_dir = agg_dir
+        self.version = None
+        self.tables = {}
+
+    def _fingerprint(self):
+        h = hashlib.sha1()
+        for name in TABLES:
+            st = os.stat(os.path.join(self.agg_dir, f"{name}.parquet"))
+            h.update(f"{name}:{st.st_mtime_ns}:{st.st_size};".encode())
+        return h.hexdigest()[:16]
+
+    def refresh(self):
+        try:
+            version = self._fingerprint()
+        except FileNotFoundError:
+            raise HTTPException(status_code=503, detail=f"Agrégats absents de {self.agg_dir} (lancer aggregates.py)")
+
+        if version != self.version:
+            # Index trié sur la clé de lecture : chaque tranche est une recherche dichotomique
+            self.tables = {
+                name: pd.read_parquet(os.path.join(self.agg_dir, f"{name}.parquet")).set_index(keys).sort_index()
+                for name, keys in TABLES.items()
+            }
+            self.version = version
+        return self.tables
+
+    def slice(self, name, annee, *key):
+        """Lignes de la table pour (annee, *key), ou None si la clé est inconnue"""
+        df = self.refresh()[name]
+        if annee is None:
+            annee = int(df.index.get_level_values('Annee').max())
+        try:
+            if df.index.nlevels == 1:
+                part = df.loc[[annee]]  # Table indexée sur l'année seule (national)
+            else:
+                part = df.xs((annee,) + key, level=list(range(1 + len(key))), drop_level=False)
+        except KeyError:
+            return None
+        return part.reset_index()
+
+
+def _etag(store, request):
+    raw = f"{store.version}|{request.url.path}|{request.url.query}"
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def _arrow_stream(table):
+    """Sérialise la table en flux IPC Arrow, un lot d'enregistrements à la fois"""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=ARROW_BATCH_ROWS):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def _respond(store, request, df, fmt, offset, limit):
+    etag = _etag(store, request)
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=300', 'X-Total-Count': str(len(df))}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    page = df.iloc[offset:offset + limit]
+    if offset + limit < len(df):
+        headers['Link'] = f'<{request.url.include_query_params(offset=offset + limit)}>; rel="next"'
+
+    if fmt == 'json':
+        body = {'total': len(df), 'offset': offset, 'limit': limit, 'data': page.to_dict(orient='records')}
+        return JSONResponse(body, headers=headers)
+
+    table = pa.Table.from_pandas(page, preserve_index=False)
+    if fmt == 'arrow':
+        return StreamingResponse(_arrow_stream(table), media_type=MEDIA_TYPES['arrow'], headers=headers)
+
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression='zstd')
+    return Response(buf.getvalue(), media_type=MEDIA_TYPES['parquet'], headers=headers)
+
+
+def create_app(agg_dir=AGG_DIR):
+    api = FastAPI(title="Observatoire National Pesticides - API")
+    store = AggregateStore(agg_dir)
+
+    fmt_q = Query('json', pattern='^(json|arrow|parquet)$')
+    offset_q = Query(0, ge=0)
+    limit_q = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT)
+
+    def found(df, what):
+        if df is None:
+            raise HTTPException(status_code=404, detail=f"{what} introuvable")
+        return df
+
+    @api.get("/national")
+    def national(request: Request, annee: int = None, format: str = fmt_q):
+        df = store.refresh()['national'].reset_index()
+        if annee is not None:
+            df = found(store.slice('national', annee), f"Année {annee}")
+        return _respond(store, request, df, format, 0, MAX_LIMIT)
+
+    @api.get("/departements")
+    def departements(request: Request, annee: int = None, format: str = fmt_q,
+                     offset: int = offset_q, limit: int = limit_q):
+        df = found(store.slice('departements', annee), f"Année {annee}")
+        df = df.sort_values('Volume', ascending=False)
+        return _respond(store, request, df, format, offset, limit)
+
+    @api.get("/departements/{dept}/communes")
+    def communes_du_departement(request: Request, dept: str, annee: int = None, format: str = fmt_q,
+                                offset: int = offset_q, limit: int = limit_q):
+        df = found(store.slice('communes', annee, dept), f"Département {dept}")
+        df = df.sort_values('Volume', ascending=False)
+        return _respond(store, request, df, format, offset, limit)
+
+    @api.get("/communes/{insee}/substances")
+    def substances_de_la_commune(request: Request, insee: str, annee: int = None, format: str = fmt_q,
+                                 offset: int = offset_q, limit: int = limit_q):
+        df = found(store.slice('communes_substances', annee, insee), f"Commune {insee}")
+        df = df.sort_values('Volume', ascending=False)
+        return _respond(store, request, df, format, offset, limit)
+
+    @api.get("/substances")
+    def substances(request: Request, annee: int = None, format: str = fmt_q,
+                   offset: int = offset_q, limit: int = limit_q):
+        df = found(store.slice('substances', annee), f"Année {annee}")
+        df = df.sort_values('Volume', ascending=False)
+        return _respond(store, request, df, format, offset, limit)
+
+    @api.get("/substances/{cas}")
+    def substance(request: Request, cas: str, annee: int = None, format: str = fmt_q):
+        # Même forme canonique que les agrégats ('0050-00-0' -> '50-00-0')
+        df = found(store.slice('substances', annee, canonical_cas([cas])[0]), f"Substance {cas}")
+        return _respond(store, request, df, format, 0, MAX_LIMIT)
+
+    return api
+
+
+app = create_app(os.environ.get('PHYTO_AGG_DIR', AGG_DIR))
@@ -2,36 +2,17 @@ import streamlit as st
 import pandas as pd
 import folium
 from streamlit_folium import st_folium
-import requests
-from shapely.geometry import shape
+import os
+
+from aggregates import (AGG_DIR, ANNEE_CIBLE, PARTITIONS_SCHEME, RANKINGS_FILE, TOP_N, available_years,
+                        build_aggregates, build_rankings, read_rankings)
+from apportionment import SCHEMES
+from spatial import load_indexes
+from substances import DB_FILE, load_substance_dimension
 
 # --- CONFIGURATION ---
 st.set_page_config(layout="wide", page_title="Observatoire National Pesticides")
 
-# Constantes
-ANNEE_CIBLE = '2023'
-INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
-
-# URLs Géo
-# Niveau 1 : Départements (Léger pour la vue France)
-GEOJSON_DEPTS = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson"
-# Niveau 2 : Communes (Lourd, on filtrera)
-GEOJSON_COMMUNES = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/communes-version-simplifiee.geojson"
-MAPPING_URL = "https://unpkg.com/codes-postaux@4.0.0/codes-postaux.json"
-
-# Base Toxico (Version Pro - Sans Emojis)
-TOX_DB = {
-    '1071-83-6': {'Nom': 'GLYPHOSATE', 'Danger': 'CMR SUSPECTE', 'Score': 90},
-    '52888-80-9': {'Nom': 'PROSULFOCARBE', 'Danger': 'POLLUANT EAU', 'Score': 60},
-    '133-07-3': {'Nom': 'FOLPEL', 'Danger': 'CMR SUSPECTE', 'Score': 90},
-    '133-06-2': {'Nom': 'CAPTANE', 'Danger': 'CMR SUSPECTE', 'Score': 90},
-    '203313-25-1': {'Nom': 'SPIROTETRAMAT', 'Danger': 'REPROTOXIQUE', 'Score': 100},
-    'NON_TROUVE': {'Nom': 'AUTRE', 'Danger': 'NON CLASSE', 'Score': 0}
-}
-
-def resolve_tox(cas):
-    return TOX_DB.get(cas, {'Nom': f'CAS {cas}', 'Danger': 'NON CLASSE', 'Score': 0})
-
 # --- GESTION DE L'ÉTAT (SESSION STATE) ---
 if 'selected_dept' not in st.session_state:
     st.session_state['selected_dept'] = None
@@ -41,96 +22,58 @@ def reset_view():
 
 # --- CHARGEMENT DES DONNÉES ---
 @st.cache_data
-def load_national_data():
+def load_national_data(annee, scheme='surface'):
     """Charge et agrège les données pour toute la France"""
-    
-    # 1. Chargement Référentiels Géo
-    geo_depts = requests.get(GEOJSON_DEPTS).json()
-    geo_communes = requests.get(GEOJSON_COMMUNES).json()
-    
-    # Indexation spatiale
-    dept_index = {f['properties']['code']: f for f in geo_depts['features']}
-    
-    commune_index = {} # {INSEE: {area, nom, geometry, dept_code}}
-    for f in geo_communes['features']:
-        code = f['properties']['code']
-        if f.get('geometry'):
-            commune_index[code] = {
-                'area': shape(f['geometry']).area,
-                'nom': f['properties']['nom'],
-                'geom': f,
-                'dept': code[:2] # Les 2 premiers chiffres = Dept
-            }
+    return build_aggregates(annee, scheme=scheme)
 
-    # 2. Mapping CP
-    raw_map = requests.get(MAPPING_URL).json()
-    cp_map = {}
-    for item in raw_map:
-        cp, insee = item.get('codePostal'), item.get('codeCommune')
-        if cp and insee and insee in commune_index:
-            if cp not in cp_map: cp_map[cp] = []
-            if insee not in cp_map[cp]: cp_map[cp].append(insee)
 
-    # 3. Lecture CSV
-    cols = pd.read_csv(INPUT_CSV, sep=';', nrows=1, encoding='latin-1').columns
-    c_cp = next(c for c in cols if 'postal' in c.lower())
-    c_qty = next(c for c in cols if 'quantit' in c.lower())
-    c_annee = next(c for c in cols if 'annee' in c.lower())
-    c_cas = next(c for c in cols if 'cas' in c.lower())
+@st.cache_resource
+def load_spatial_indexes(_dept_index, _commune_index):
+    """Index spatiaux communes / départements (STRtree), relus du disque tant que les référentiels n'ont pas changé.
+    Référentiels préfixés par _ : non hachés par Streamlit (ce sont ceux de load_national_data)."""
+    return load_indexes(geo_references=(_dept_index, _commune_index))
 
-    df = pd.read_csv(INPUT_CSV, sep=';', encoding='latin-1', 
-                     usecols=[c_cp, c_qty, c_annee, c_cas], dtype={c_cp: str})
-    
-    df = df[df[c_annee].astype(str) == ANNEE_CIBLE]
-    df['qty'] = pd.to_numeric(df[c_qty].astype(str).str.replace(',', '.'), errors='coerce').fillna(0)
-    df = df[df['qty'] > 0]
 
-    # 4. Ventilation & Agrégation
-    # On prépare deux datasets : un par Dept (pour la vue nationale) et un détaillé
-    
-    # Agrégation brute par CP
-    gb = df.groupby([c_cp, c_cas])['qty'].sum().reset_index()
-    
-    data_by_dept = {}     # {DeptCode: TotalVolume}
-    data_by_commune = []  # Liste détaillée
-    
-    for row in gb.itertuples():
-        cp = getattr(row, c_cp).split('.')[0].strip().zfill(5)
-        cas = getattr(row, c_cas)
-        qty = getattr(row, 'qty')
-        
-        targets = cp_map.get(cp, [])
-        if not targets: continue
-        
-        total_area = sum([commune_index[i]['area'] for i in targets])
-        if total_area == 0: continue
-        
-        for insee in targets:
-            ratio = commune_index[insee]['area'] / total_area
-            val = qty * ratio
-            dept_code = insee[:2]
-            
-            # Ajout au total départemental
-            data_by_dept[dept_code] = data_by_dept.get(dept_code, 0) + val
-            
-            # Ajout au détail communal
-            data_by_commune.append({
-                'INSEE': insee,
-                'Commune': commune_index[insee]['nom'],
-                'Dept': dept_code,
-                'CAS': cas,
-                'Volume': val
-            })
-            
-    df_communes = pd.DataFrame(data_by_commune)
-    df_depts = pd.DataFrame(list(data_by_dept.items()), columns=['Dept', 'Volume'])
-    
-    return df_depts, df_communes, dept_index, commune_index
+def clicked_code(map_output, index):
+    """Code du polygone cliqué : feature renvoyée par folium, sinon point du clic localisé dans l'index"""
+    if map_output.get('last_active_drawing'):
+        return map_output['last_active_drawing']['properties']['code']
+    click = map_output.get('last_clicked')
+    if click:
+        return index.locate([click['lng']], [click['lat']])[0]
+    return None
+
+
+@st.cache_data
+def load_substances(db_mtime):
+    """Dimension toxicologique (Nom, Danger, Score) lue une seule fois depuis la base enrichie.
+    db_mtime ne sert que de clé de cache : une base régénérée invalide le cache."""
+    if db_mtime is None:
+        return pd.DataFrame(columns=['Nom', 'Danger', 'Score'], index=pd.Index([], name='CAS'))
+    return load_substance_dimension(DB_FILE)
+
+
+@st.cache_resource
+def load_rankings(annee, db_mtime, scheme='surface', rankings_mtime=None):
+    """Classements de substances par commune et par département, précalculés par aggregates.py.
+    Recalculés depuis le détail communal seulement pour une autre clé de ventilation ou sans fichier de classements.
+    cache_resource : l'objet est partagé tel quel (lecture seule), sans copie picklée à chaque réexécution ;
+    la clé (annee, db_mtime, scheme, rankings_mtime) change avec l'année, la base, la ventilation ou les agrégats."""
+    df_subst = load_substances(db_mtime)
+    rankings = read_rankings(annee, df_subst) if scheme == PARTITIONS_SCHEME else None
+    if rankings is None:
+        _, df_communes, _, _ = load_national_data(annee, scheme)
+        rankings = build_rankings(df_communes, df_subst)
+    return rankings
 
 # --- INTERFACE ---
 
 def main():
-    st.title(f"OBSERVATOIRE NATIONAL DES PESTICIDES {ANNEE_CIBLE}")
+    # Années disponibles dans le magasin d'agrégats (sinon l'année par défaut, calculée depuis le CSV)
+    annee = st.sidebar.selectbox("Année", available_years() or [ANNEE_CIBLE], on_change=reset_view)
+    # Clé de ventilation des volumes d'un code postal sur ses communes (cf. apportionment.py)
+    scheme = st.sidebar.selectbox("Ventilation CP -> communes", list(SCHEMES), on_change=reset_view)
+    st.title(f"OBSERVATOIRE NATIONAL DES PESTICIDES {annee}")
     st.markdown(
         """
         <div style='background-color:#fff3cd;padding:10px;border-radius:6px;border:1px solid #ffeeba;margin-bottom:15px;'>
@@ -142,7 +85,11 @@ def main():
     )
     
     with st.spinner("Chargement des données nationales (cela peut prendre quelques secondes)..."):
-        df_depts, df_communes, geo_depts, geo_communes = load_national_data()
+        df_depts, df_communes, geo_depts, geo_communes = load_national_data(annee, scheme)
+        rankings_file = os.path.join(AGG_DIR, RANKINGS_FILE)
+        rankings = load_rankings(annee, os.path.getmtime(DB_FILE) if os.path.exists(DB_FILE) else None, scheme,
+                                 os.path.getmtime(rankings_file) if os.path.exists(rankings_file) else None)
+        spatial = load_spatial_indexes(geo_depts, geo_communes)
 
     # --- ÉCRAN 1 : VUE NATIONALE (Si aucun département sélectionné) ---
     if st.session_state['selected_dept'] is None:
@@ -186,8 +133,8 @@ def main():
                     clicked_text = map_output['last_object_clicked_tooltip']
                     # On suppose que le code est la dernière partie ou on le récupère via l'objet properties
                     # Méthode plus robuste : si on clique, st_folium renvoie l'objet feature
-                    if map_output['last_active_drawing']:
-                        code_dept = map_output['last_active_drawing']['properties']['code']
+                    code_dept = clicked_code(map_output, spatial['departements'])
+                    if code_dept:
                         st.session_state['selected_dept'] = code_dept
                         st.rerun() # On recharge la page pour passer à l'écran 2
                 except:
@@ -237,11 +184,9 @@ def main():
             if not features_local:
                 st.warning("Pas de géométries disponibles pour ce département.")
             else:
-                # Centrage de la carte
-                # On prend la première commune comme centre approx
-                centroid = shape(features_local[0]['geometry']).centroid
-                
-                m_local = folium.Map(location=[centroid.y, centroid.x], zoom_start=9, tiles="CartoDB positron")
+                # Centrage de la carte sur l'emprise du département
+                minx, miny, maxx, maxy = spatial['departements'].bounds([dept_code])
+                m_local = folium.Map(location=[(miny + maxy) / 2, (minx + maxx) / 2], zoom_start=9, tiles="CartoDB positron")
                 
                 folium.Choropleth(
                     geo_data={"type": "FeatureCollection", "features": features_local},
@@ -268,47 +213,52 @@ def main():
             
             selected_commune = None
             # Détection clic commune
-            if local_map_output['last_active_drawing']:
-                clicked_insee = local_map_output['last_active_drawing']['properties']['code']
+            clicked_insee = clicked_code(local_map_output, spatial['communes'])
+            if clicked_insee in geo_communes:
                 selected_commune = clicked_insee
             
             if selected_commune:
                 commune_name = geo_communes[selected_commune]['nom']
                 st.markdown(f"### 📍 {commune_name}")
                 
-                # Données de la commune
-                data_ville = df_local[df_local['INSEE'] == selected_commune]
-                total_vol = data_ville['Volume'].sum()
-                st.metric("Volume Total", f"{total_vol:,.1f} kg")
+                # Classement précalculé de la commune
+                ranking = rankings['communes']
+                resume = ranking.summary(selected_commune) or {'Total': 0, 'Nb_Substances': 0, 'Volume_Autres': 0}
+                st.metric("Volume Total", f"{resume['Total']:,.1f} kg")
                 
                 st.markdown("#### Substances Achetées")
                 
-                # Agrégation par CAS
-                prods = data_ville.groupby('CAS')['Volume'].sum().reset_index()
-                prods['Nom'] = prods['CAS'].apply(lambda x: resolve_tox(x)['Nom'])
-                prods['Danger'] = prods['CAS'].apply(lambda x: resolve_tox(x)['Danger'])
-                prods = prods.sort_values('Volume', ascending=False)
-                
                 # Top 5
                 st.dataframe(
-                    prods.head(5)[['Nom', 'Danger', 'Volume']],
+                    ranking.top(selected_commune)[['Nom', 'Danger', 'Score', 'Volume']],
                     hide_index=True,
                     use_container_width=True
                 )
                 
                 # Lire la suite
-                if len(prods) > 5:
-                    with st.expander(f"Lire la suite ({len(prods)-5} autres)"):
+                if resume['Nb_Substances'] > TOP_N:
+                    n_autres = resume['Nb_Substances'] - TOP_N
+                    with st.expander(f"Lire la suite ({n_autres} autres, {resume['Volume_Autres']:,.1f} kg)"):
                         st.dataframe(
-                            prods.iloc[5:][['Nom', 'Danger', 'Volume']],
+                            ranking.tail(selected_commune)[['Nom', 'Danger', 'Score', 'Volume']],
                             hide_index=True,
                             use_container_width=True
                         )
                         
-                        csv = prods.to_csv(index=False).encode('utf-8')
+                        csv = ranking.ranking(selected_commune).to_csv(index=False).encode('utf-8')
                         st.download_button("Télécharger CSV", csv, f"Data_{commune_name}.csv")
             else:
                 st.info("Cliquez sur une commune de la carte pour voir son bilan toxicologique.")
+                
+                # Classement départemental en attendant le clic
+                resume_dept = rankings['depts'].summary(dept_code)
+                if resume_dept:
+                    st.metric("Volume Départemental", f"{resume_dept['Total']:,.1f} kg")
+                    st.dataframe(
+                        rankings['depts'].top(dept_code)[['Nom', 'Danger', 'Score', 'Volume']],
+                        hide_index=True,
+                        use_container_width=True
+                    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Ventilation des volumes achetés par code postal sur les communes du CP, sous forme de matrices creuses.
+
+Le lien CP -> communes est construit une fois : une matrice (n_cp x n_communes) par clé de répartition,
+dont chaque ligne somme à 1. Ventiler une matrice de volumes (CP x substance) revient alors à un produit
+matriciel creux ; toutes les clés sont empilées et calculées en un seul produit.
+
+Clés de répartition :
+    surface     au prorata de la surface des communes (comportement historique)
+    population  au prorata de la population municipale (geo.api.gouv.fr)
+    sau         au prorata de la surface agricole utile (fichier Agreste local, facultatif)
+    egal        parts égales entre les communes du CP
+
+Un CP dont toutes les communes ont un poids nul pour une clé n'est pas ventilé pour cette clé.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from instrumentation import http_get, timed
+
+# --- CONFIGURATION ---
+SCHEMES = {'surface': 'area', 'population': 'population', 'sau': 'sau', 'egal': None}  # Clé -> attribut commune
+POPULATION_URL = "https://geo.api.gouv.fr/communes?fields=code,population&format=json"
+SAU_FILE = 'data/sau_communes.csv'  # Recensement agricole (Agreste) : colonnes INSEE;SAU (ha)
+
+
+def _clean_cp(cp):
+    """Même normalisation des CP que la ventilation historique ('1000.0' -> '01000')"""
+    return pd.Series(cp, dtype=str).str.split('.').str[0].str.strip().str.zfill(5)
+
+
+@timed('attributs_communes')
+def load_commune_attributes(commune_index, sau_file=SAU_FILE):
+    """Complète commune_index avec la population (API géo) et, si le fichier existe, la SAU des communes"""
+    for item in http_get(POPULATION_URL).json():
+        info = commune_index.get(item.get('code'))
+        if info is not None and item.get('population') is not None:
+            info['population'] = float(item['population'])
+
+    if os.path.exists(sau_file):
+        sau = pd.read_csv(sau_file, sep=';', dtype={'INSEE': str})
+        for insee, ha in zip(sau['INSEE'].str.zfill(5), pd.to_numeric(sau['SAU'], errors='coerce')):
+            if insee in commune_index and pd.notna(ha):
+                commune_index[insee]['sau'] = float(ha)
+    return commune_index
+
+
+def dept_of_insee(insee):
+    """Département d'un code INSEE : 3 caractères outre-mer (97101 -> 971), 2 sinon (01001 -> 01, 2A004 -> 2A)"""
+    return insee[:3] if insee[:2] in ('97', '98') else insee[:2]
+
+
+class Apportionment:
+    """Matrices de ventilation CP -> communes (scipy.sparse CSR), une par clé de répartition disponible"""
+
+    def __init__(self, cp_map, commune_index, schemes=None):
+        links = pd.DataFrame([(cp, insee) for cp, insees in cp_map.items() for insee in insees
+                              if insee in commune_index], columns=['CP', 'INSEE']).drop_duplicates()
+        self.cps = pd.Index(sorted(links['CP'].unique()))
+        self.communes = pd.Index(sorted(links['INSEE'].unique()))
+        self.noms = np.array([commune_index[i]['nom'] for i in self.communes], dtype=object)
+        self.depts = np.array([dept_of_insee(i) for i in self.communes], dtype=object)
+        rows = self.cps.get_indexer(links['CP'])
+        cols = self.communes.get_indexer(links['INSEE'])
+
+        # Une clé n'est disponible que si l'attribut est connu pour au moins une commune
+        if schemes is None:
+            schemes = [s for s, attr in SCHEMES.items()
+                       if attr is None or any(attr in commune_index[i] for i in self.communes)]
+        self.matrices = {}
+        for scheme in schemes:
+            attr = SCHEMES[scheme]
+            poids = np.ones(len(self.communes)) if attr is None else \
+                np.array([commune_index[i].get(attr, 0.0) for i in self.communes], dtype=float)
+            w = sparse.csr_matrix((poids[cols], (rows, cols)), shape=(len(self.cps), len(self.communes)))
+            totals = np.asarray(w.sum(axis=1)).ravel()
+            scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+            self.matrices[scheme] = sparse.diags(scale) @ w
+
+    @property
+    def schemes(self):
+        return list(self.matrices)
+
+    def rows_of(self, cp):
+        """Ligne de chaque CP dans les matrices (-1 si le CP n'a aucune commune connue)"""
+        codes, uniques = pd.factorize(np.asarray(cp, dtype=object))  # Nettoyage une fois par CP distinct
+        return np.append(self.cps.get_indexer(_clean_cp(uniques)), -1)[codes]
+
+    def covered(self, scheme):
+        """Booléen par CP : au moins une commune de poids non nul pour cette clé"""
+        return np.asarray(self.matrices[scheme].sum(axis=1)).ravel() > 0
+
+    def shares(self, scheme='surface'):
+        """Table longue (CP, INSEE, Part) des parts de chaque commune dans son CP"""
+        w = self.matrices[scheme].tocoo()
+        return pd.DataFrame({'CP': self.cps[w.row], 'INSEE': self.communes[w.col], 'Part': w.data})
+
+    def apportion(self, gb, schemes=None, cp_rows=None):
+        """
+        Ventile des volumes (CP, CAS, qty) : une ligne par (commune, substance) de volume non nul pour au
+        moins une clé, une colonne Volume_<clé> par clé. Un seul produit creux pour toutes les clés.
+        """
+        schemes = list(schemes or self.schemes)
+        cp_rows = self.rows_of(gb['CP']) if cp_rows is None else cp_rows
+        known = cp_rows >= 0
+        cas_codes, cas_values = pd.factorize(gb['CAS'].to_numpy()[known])
+        volumes = sparse.csr_matrix((gb['qty'].to_numpy(dtype=float)[known], (cp_rows[known], cas_codes)),
+                                    shape=(len(self.cps), len(cas_values)))  # Doublons (CP, CAS) sommés
+
+        n = len(self.communes)
+        stacked = sparse.vstack([self.matrices[s].T for s in schemes]).tocsr() @ volumes
+        cells = stacked.tocoo()
+        scheme_of, commune = np.divmod(cells.row, n)
+        # Une ligne par (commune, substance), une colonne par clé
+        wide = pd.DataFrame({'c': commune, 'k': cells.col, 's': scheme_of, 'v': cells.data}) \
+            .set_index(['c', 'k', 's'])['v'].unstack('s', fill_value=0.0) \
+            .reindex(columns=range(len(schemes)), fill_value=0.0)
+        c, k = wide.index.get_level_values(0).to_numpy(), wide.index.get_level_values(1).to_numpy()
+        df = pd.DataFrame({'INSEE': self.communes[c], 'Commune': self.noms[c], 'Dept': self.depts[c],
+                           'CAS': np.asarray(cas_values, dtype=object)[k]})
+        for i, scheme in enumerate(schemes):
+            df[f"Volume_{scheme}"] = wide[i].to_numpy()
+        return df
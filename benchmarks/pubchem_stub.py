@@ -0,0 +1,80 @@
+"""
+Bouchon local de l'API PubChem (PUG REST / PUG View), pour mesurer l'enrichissement sans réseau.
+
+Répond aux trois routes utilisées par connectors.pubchem.PubChemConnector, avec des réponses
+déterministes dérivées de synthetic.ghs_codes_for ; un CAS inconnu renvoie 404 comme l'API réelle.
+"""
+import json
+import re
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import ghs_codes_for
+
+ROUTES = [
+    (re.compile(r'^/rest/pug/compound/name/([^/]+)/cids/JSON$'), 'cid'),
+    (re.compile(r'^/rest/pug/compound/cid/(\d+)/property/[^/]+/JSON$'), 'properties'),
+    (re.compile(r'^/rest/pug_view/data/compound/(\d+)/JSON$'), 'view'),
+]
+
+
+class PubChemStub:
+    """Serveur HTTP local (thread en arrière-plan) ; url_base à substituer aux URL du connecteur"""
+
+    def __init__(self, cas_list, seed=0, port=0):
+        self.cid_by_cas = {cas: zlib.crc32(cas.encode()) % 10 ** 7 + 1 for cas in cas_list}
+        self.cas_by_cid = {cid: cas for cas, cid in self.cid_by_cas.items()}
+        self.seed = seed
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url_base(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _respond(self, kind, key):
+        if kind == 'cid':
+            cid = self.cid_by_cas.get(key)
+            return cid and {'IdentifierList': {'CID': [cid]}}
+        cas = self.cas_by_cid.get(int(key))
+        if cas is None: return None
+        if kind == 'properties':
+            return {'PropertyTable': {'Properties': [
+                {'CID': int(key), 'MolecularFormula': 'C10H12N2O', 'MolecularWeight': str(100 + int(key) % 400)}]}}
+        # PUG View : le connecteur cherche les mentions "String": "Hxxx" dans le texte brut
+        codes = [c for combo in ghs_codes_for(cas, self.seed) for c in combo.split('+')]
+        return {'Record': {'RecordNumber': int(key), 'Section': [
+            {'TOCHeading': 'GHS Classification', 'Information': [
+                {'Value': {'StringWithMarkup': [{'String': f"{c}: mention de danger"} for c in codes]}}]}]}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = None
+                for pattern, kind in ROUTES:
+                    m = pattern.match(self.path)
+                    if m:
+                        body = stub._respond(kind, m.group(1))
+                        break
+                payload = json.dumps(body or {'Fault': {'Code': 'PUGREST.NotFound'}}).encode()
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
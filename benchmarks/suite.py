@@ -0,0 +1,304 @@
+"""
+Banc de mesure reproductible des pipelines, entièrement hors ligne.
+
+Les jeux de données sont synthétiques (synthetic.py) et mis en cache par (lignes, graine) : achats BNVD,
+référentiel E-Phy, fichiers EFSA, référentiel CP -> communes, base toxicologique ; PubChem est servi
+par un bouchon local. Chaque mesure renvoie le nombre d'éléments traités : le rapport donne la durée
+(meilleure de `repeat` exécutions) et le débit.
+
+    python -m benchmarks.suite --rows 1000000                  # compare aux références (code 1 si régression)
+    python -m benchmarks.suite --rows 1000000 --save-baseline  # enregistre les références
+    python -m benchmarks.suite --rows 100000000 --only ingestion_csv
+
+Une régression est une durée supérieure à la référence de plus de `tolerance` (25 % par défaut).
+Les références dépendent de la machine : à réenregistrer quand la machine de mesure change.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+import aggregates
+import synthetic
+from apportionment import Apportionment
+from connectors.efsa import EfsaConnector
+from connectors.pubchem import PubChemConnector
+from duckstore import detect_columns, load_achats
+from outofcore import duckdb_connect, spill_purchases
+from substances import load_substance_dimension
+
+from benchmarks.pubchem_stub import PubChemStub
+
+# --- CONFIGURATION ---
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('PHYTO_BENCH_DIR', os.path.join(BENCH_DIR, '.cache'))
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines.json')
+DEFAULT_ROWS = 1_000_000
+N_CP = 6000
+N_CAS = 500
+N_ENRICH = 200  # Substances enrichies par mesure (appels PubChem + recherche EFSA)
+TOLERANCE = 0.25
+
+BENCHMARKS = {}
+
+
+def benchmark(name, unit='lignes'):
+    """Enregistre une mesure : fonction(workspace) -> nombre d'éléments traités"""
+    def register(func):
+        BENCHMARKS[name] = (func, unit)
+        return func
+    return register
+
+
+class Workspace:
+    """Jeux de données synthétiques d'une échelle donnée, générés à la première demande puis réutilisés"""
+
+    def __init__(self, rows, seed=0, cache_dir=CACHE_DIR):
+        self.rows, self.seed = rows, seed
+        self.root = os.path.join(cache_dir, f"{rows}_{seed}")
+        os.makedirs(self.root, exist_ok=True)
+        self._geo = None
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def _cached(self, name, build):
+        path = self.path(name)
+        if not os.path.exists(path):
+            print(f"  (génération de {name}...)")
+            build(path)
+        return path
+
+    @property
+    def csv(self):
+        return self._cached('achats.csv', lambda p: synthetic.write_bnvd_csv(
+            p, n_rows=self.rows, n_cp=N_CP, n_cas=N_CAS, seed=self.seed))
+
+    @property
+    def staging(self):
+        return self._cached('achats_agreges.parquet', lambda p: spill_purchases(self.csv, detect_columns(self.csv), p))
+
+    @property
+    def substance_db(self):
+        return self._cached('phyto_data.db', lambda p: synthetic.write_substance_db(p, N_CAS, self.seed))
+
+    @property
+    def ephy_csv(self):
+        return self._cached('substance_active.csv', lambda p: synthetic.write_ephy_csv(p, N_CAS, self.seed))
+
+    @property
+    def efsa_files(self):
+        char, ref = self.path('efsa_char.xlsx'), self.path('efsa_ref.xlsx')
+        if not (os.path.exists(char) and os.path.exists(ref)):
+            print("  (génération des fichiers EFSA...)")
+            synthetic.write_efsa_xlsx(char, ref, N_CAS, self.seed)
+        return char, ref
+
+    @property
+    def geo(self):
+        if self._geo is None:
+            self._geo = synthetic.make_geo_references(N_CP, self.seed)
+        return self._geo
+
+    def scratch(self, name):
+        """Répertoire de travail vidé avant chaque mesure"""
+        path = self.path(name)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+
+class offline_geo:
+    """Remplace le téléchargement des référentiels géographiques par le référentiel synthétique"""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def __enter__(self):
+        self.saved = aggregates.load_geo_references
+        aggregates.load_geo_references = lambda: self.ws.geo
+
+    def __exit__(self, *exc):
+        aggregates.load_geo_references = self.saved
+
+
+# --- MESURES ---
+
+@benchmark('ingestion_csv')
+def bench_ingestion_csv(ws):
+    """CSV brut -> Parquet agrégé (Annee, CP, CAS) trié, en mémoire bornée"""
+    csv = ws.csv
+    spill_purchases(csv, detect_columns(csv), os.path.join(ws.scratch('ingestion'), 'achats.parquet'))
+    return ws.rows
+
+
+@benchmark('ingestion_duckstore')
+def bench_ingestion_duckstore(ws):
+    """CSV brut -> table typée `achats` de l'entrepôt DuckDB"""
+    csv = ws.csv
+    con = duckdb_connect(os.path.join(ws.scratch('store'), 'store.duckdb'))
+    try:
+        load_achats(con, csv, detect_columns(csv), force=True)
+    finally:
+        con.close()
+    return ws.rows
+
+
+@benchmark('ventilation')
+def bench_apportion(ws):
+    """Ventilation CP -> communes au prorata des surfaces, sur toutes les années"""
+    gb = pd.read_parquet(ws.staging, columns=['CP', 'CAS', 'qty'])
+    _, commune_index, cp_map = ws.geo
+    aggregates.apportion(gb, cp_map, commune_index)
+    return len(gb)
+
+
+@benchmark('ventilation_toutes_cles')
+def bench_apportion_schemes(ws):
+    """Ventilation CP -> communes selon toutes les clés (surface, population, parts égales) en un produit creux"""
+    gb = pd.read_parquet(ws.staging, columns=['CP', 'CAS', 'qty'])
+    _, commune_index, cp_map = ws.geo
+    Apportionment(cp_map, commune_index).apportion(gb)
+    return len(gb)
+
+
+@benchmark('agregation_incrementale')
+def bench_incremental(ws):
+    """Construction complète des partitions et tables de synthèse (force=True)"""
+    csv = ws.csv
+    with offline_geo(ws):
+        aggregates.build_incremental(csv, ws.scratch('agregats'), force=True)
+    return ws.rows
+
+
+@benchmark('enrichissement', unit='substances')
+def bench_enrichment(ws):
+    """Enrichissement E-Phy -> PubChem (bouchon local) + EFSA, comme main.py"""
+    ephy = pd.read_csv(ws.ephy_csv, sep=';', encoding='cp1252', dtype=str)
+    cas_list = [c for c in ephy['Numero CAS'] if c not in ('NC', '')][:N_ENRICH]
+    efsa = EfsaConnector(*ws.efsa_files)
+    efsa.load_data()
+
+    with PubChemStub(synthetic.make_cas(N_CAS, ws.seed), ws.seed) as stub:
+        pubchem = PubChemConnector()
+        pubchem.delay = 0  # Pas de politesse envers un serveur local
+        pubchem.BASE_URL = f"{stub.url_base}/rest/pug"
+        pubchem.VIEW_URL = f"{stub.url_base}/rest/pug_view/data/compound"
+        for cas in cas_list:
+            pc = pubchem.get_details_from_cas(cas)
+            if pc: pubchem.get_ghs_classification(pc['cid'])
+            efsa.get_tox_values(cas)
+    return len(cas_list)
+
+
+@benchmark('chargement_dashboard', unit='lignes commune x substance')
+def bench_dashboard(ws):
+    """Données du tableau de bord pour une année : partitions + dimension substances + classements"""
+    agg_dir = ws.path('agregats_dashboard')
+    if not os.path.exists(os.path.join(agg_dir, aggregates.RANKINGS_FILE)):
+        with offline_geo(ws):
+            aggregates.build_incremental(ws.csv, agg_dir)
+    annee = aggregates.available_years(agg_dir)[0]
+    with offline_geo(ws):
+        _, df_communes, _, _ = aggregates.build_aggregates(annee, ws.csv, agg_dir)
+    # Classements précalculés relus comme dans app.py (plus de groupby ni de tri au chargement)
+    aggregates.read_rankings(annee, load_substance_dimension(ws.substance_db), agg_dir)
+    return len(df_communes)
+
+
+# --- EXÉCUTION ---
+
+def run_benchmark(name, ws, repeat=3):
+    """Meilleure durée sur `repeat` exécutions (après une exécution de préparation des données)"""
+    func, unit = BENCHMARKS[name]
+    times, n = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = func(ws)
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    return {'secondes': round(best, 4), 'elements': n, 'unite': unit,
+            'debit_par_s': round(n / best, 1) if best else None,
+            'toutes_secondes': [round(t, 4) for t in times]}
+
+
+def machine_info():
+    return {'python': platform.python_version(), 'plateforme': platform.platform(),
+            'processeur': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+
+def load_baselines(path=BASELINE_FILE):
+    if not os.path.exists(path): return {'machine': None, 'mesures': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results, baselines, tolerance=TOLERANCE):
+    """Liste des régressions : (clé, durée, référence) pour chaque mesure plus lente que la référence + tolérance"""
+    regressions = []
+    for key, res in results.items():
+        ref = baselines['mesures'].get(key)
+        if ref and res['secondes'] > ref['secondes'] * (1 + tolerance):
+            regressions.append((key, res['secondes'], ref['secondes']))
+    return regressions
+
+
+def missing_baselines(results, baselines):
+    """Mesures sans référence enregistrée (nouvelle mesure ou autre taille) : non couvertes par compare"""
+    return sorted(k for k in results if k not in baselines['mesures'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de mesure hors ligne des pipelines")
+    parser.add_argument('--rows', type=float, default=DEFAULT_ROWS, help="Lignes du CSV synthétique (1e6 à 1e8)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help="Sous-ensemble de mesures")
+    parser.add_argument('--save-baseline', action='store_true', help="Enregistre les résultats comme références")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--output', help="Fichier JSON des résultats")
+    args = parser.parse_args(argv)
+
+    ws = Workspace(int(args.rows), args.seed)
+    names = args.only or list(BENCHMARKS)
+    print(f"--- BANC DE MESURE ({ws.rows} lignes, graine {ws.seed}) ---")
+
+    results = {}
+    for name in names:
+        key = f"{name}@{ws.rows}"
+        print(f"{name}...")
+        BENCHMARKS[name][0](ws)  # Préparation : génération des données et caches disque
+        results[key] = res = run_benchmark(name, ws, args.repeat)
+        print(f" -> {res['secondes']:.3f} s, {res['debit_par_s']:,.0f} {res['unite']}/s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'mesures': results}, f, indent=1, ensure_ascii=False)
+
+    baselines = load_baselines()
+    if args.save_baseline:
+        baselines['machine'] = machine_info()
+        baselines['mesures'].update(results)
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=1, ensure_ascii=False, sort_keys=True)
+        print(f"✅ Références enregistrées dans {BASELINE_FILE}")
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance)
+    missing = missing_baselines(results, baselines)
+    for key in missing:
+        print(f"⚠️ Pas de référence pour {key} : mesure non comparée (--save-baseline pour l'enregistrer)")
+    for key, t, ref in regressions:
+        print(f"❌ Régression {key} : {t:.3f} s contre {ref:.3f} s de référence (+{t / ref - 1:.0%})")
+    if not regressions:
+        print(f"✅ Aucune régression par rapport aux références ({len(results) - len(missing)} mesures comparées).")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
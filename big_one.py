@@ -1,79 +1,58 @@
 import pandas as pd
 from sqlalchemy import create_engine
 import os
-import requests
 from tqdm import tqdm
 
+from cas import INVALID, cas_key
+from instrumentation import http_session, instrumented, stage, timed, timed_iter
+from outofcore import TableWriter, iter_csv_chunks
+from substances import DB_FILE, GHS_DESC  # Traduction des codes H pour lecture facile
+
 # --- CONFIGURATION ---
-DB_PATH = 'sqlite:///phyto_data.db'
+DB_PATH = f'sqlite:///{DB_FILE}'
 INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
-OUTPUT_CSV = 'resultat_detail_temporel.csv'
-
-# Dictionnaire de traduction des codes pour lecture facile
-GHS_DESC = {
-    'H350': 'Cancer', 'H351': 'Cancer suspecté',
-    'H360': 'Reprotoxique', 'H361': 'Reprotoxique suspecté',
-    'H340': 'Mutagène', 'H341': 'Mutagène suspecté',
-    'H300': 'Mortel', 'H330': 'Mortel (Inhalation)', 'H310': 'Mortel (Peau)',
-    'H370': 'Dommages organes', 'H372': 'Dommages organes (long terme)',
-    'H400': 'Ecotoxique', 'H410': 'Ecotoxique (long terme)',
-    'H318': 'Lésions oculaires', 'H314': 'Brûlures'
-}
+OUTPUT_CSV = 'datacreation/resultat_detail_temporel.csv'  # .parquet : même table en Parquet zstd
+OUTPUT_COLUMNS = ['Annee', 'CodePostal', 'Ville', 'Latitude', 'Longitude', 'Produit', 'Effets_Secondaires',
+                  'Quantite_kg']
+COMPACT_EVERY = 32  # Lots agrégés cumulés avant fusion : borne la mémoire des agrégats partiels
 
 
+@timed('chargement_produits')
 def load_product_details():
-    """Charge un dictionnaire complet {CAS: {'Nom': '...', 'Dangers': '...'}}"""
+    """Table des produits indexée par clé CAS : Produit (nom E-Phy), Effets_Secondaires (dangers lisibles)"""
     print("Chargement des définitions toxicologiques...")
-    if not os.path.exists("datacreation/phyto_data.db"):
+    if not os.path.exists(DB_FILE):
         print("ERREUR : Base phyto_data.db introuvable.")
-        return {}
+        return pd.DataFrame()
 
     engine = create_engine(DB_PATH)
 
     # 1. Récupérer les Noms
     df_subst = pd.read_sql("SELECT id, cas_number, nom_ephy FROM substance", engine)
 
-    # 2. Récupérer les Dangers (GHS)
+    # 2. Récupérer les Dangers (GHS), traduits quand le code est connu (sinon le code est gardé)
     df_tox = pd.read_sql("SELECT substance_id, valeur FROM toxicite WHERE categorie='GHS'", engine)
+    code = df_tox['valeur'].str.split('+').str[0].str.strip()
+    df_tox['danger'] = code.map(GHS_DESC).fillna(code)
+    dangers = df_tox.drop_duplicates(['substance_id', 'danger']).groupby('substance_id')['danger'].agg(", ".join)
 
-    # Création du dictionnaire
-    details = {}
-
-    # On groupe les dangers par substance ID
-    tox_grouped = df_tox.groupby('substance_id')['valeur'].apply(list)
-
-    for idx, row in df_subst.iterrows():
-        sid = row['id']
-        cas = str(row['cas_number']).strip()
-        nom = row['nom_ephy']
-
-        # Récupération et traduction des dangers
-        dangers_bruts = tox_grouped.get(sid, [])
-        dangers_clairs = set()
-
-        for d in dangers_bruts:
-            code = d.split('+')[0].strip()
-            if code in GHS_DESC:
-                dangers_clairs.add(GHS_DESC[code])
-            else:
-                dangers_clairs.add(code)  # On garde le code si pas de traduction
-
-        dangers_str = ", ".join(list(dangers_clairs))
-
-        details[cas] = {
-            'Nom': nom,
-            'Dangers': dangers_str
-        }
+    # 3. Une ligne par clé entière canonique (cas.py) : même clé que les achats
+    df_subst['cas'] = cas_key(df_subst['cas_number'])
+    df_subst = df_subst[df_subst['cas'] != INVALID].drop_duplicates('cas', keep='last')
+    details = pd.DataFrame({'Produit': df_subst['nom_ephy'].to_numpy(),
+                            'Effets_Secondaires': df_subst['id'].map(dangers).fillna('').to_numpy()},
+                           index=pd.Index(df_subst['cas'], name='cas'))
 
     print(f"Base chargée : {len(details)} substances documentées.")
     return details
 
 
+@timed('geolocalisation')
 def get_gps_for_cp(cp_list):
     """Récupère Lat/Lon via API Géo (Optimisé)"""
     print(f"Géolocalisation de {len(cp_list)} communes...")
     mapping = {}
-    session = requests.Session()
+    session = http_session()
 
     for cp in tqdm(cp_list):
         try:
@@ -97,11 +76,11 @@ def process_time_series():
 
     # 1. Charger les infos produits
     prod_db = load_product_details()
-    if not prod_db: return
+    if prod_db.empty: return False  # Base absente ou illisible
 
     if not os.path.exists(INPUT_CSV):
         print(f"ERREUR : Fichier {INPUT_CSV} introuvable.")
-        return
+        return False
 
     # 2. Lecture du fichier pour détecter les colonnes
     try:
@@ -117,71 +96,82 @@ def process_time_series():
 
     if not all([col_cas, col_cp, col_qty, col_year]):
         print(f"Colonnes manquantes (CAS, CP, Qty ou Année). Trouvé : {cols}")
-        return
+        return False
 
     # 3. Lecture et Agrégation par (Année + CP + CAS)
     # On ne peut pas garder chaque ligne de vente individuelle (trop gros),
     # on somme par année pour chaque produit dans chaque ville.
 
     print("Lecture et agrégation des données...")
-    chunk_size = 100000
-    aggregated_data = {}  # Clé = (Annee, CP, CAS), Valeur = Quantité
+    parts = []  # Agrégats partiels (Annee, CP, CAS) -> quantité, fusionnés régulièrement
 
-    reader = pd.read_csv(INPUT_CSV, sep=';', encoding='latin-1', chunksize=chunk_size, on_bad_lines='skip',
-                         dtype={col_cp: str, col_year: int})
+    # Lecture en continu (lots Arrow bornés par le budget mémoire, cf. outofcore.py)
+    reader = iter_csv_chunks(INPUT_CSV)
+    st_read = stage('lecture_csv')
 
-    for chunk in tqdm(reader, desc="Traitement"):
+    for chunk in timed_iter(tqdm(reader, desc="Traitement"), 'lecture_csv'):
         chunk.columns = [c.lower() for c in chunk.columns]
+        chunk[col_year] = pd.to_numeric(chunk[col_year], errors='coerce').astype('Int64')
 
         # Nettoyage
         chunk['qty'] = pd.to_numeric(chunk[col_qty].astype(str).str.replace(',', '.').str.replace(' ', ''),
                                      errors='coerce').fillna(0)
-        chunk['cas'] = chunk[col_cas].astype(str).str.strip()
+        chunk['cas'] = cas_key(chunk[col_cas])
         chunk['cp'] = chunk[col_cp].astype(str).str.strip().str.zfill(5)
 
-        # On ne garde que les lignes avec quantité > 0
+        # On ne garde que les lignes avec quantité > 0 (et une année lisible : le groupby ignore les NA)
+        st_read.record_in(len(chunk), chunk['qty'].clip(lower=0).sum())
+        st_read.drop('quantite_nulle_ou_invalide', (chunk['qty'] <= 0).sum())
         chunk = chunk[chunk['qty'] > 0]
-
-        # Groupby local pour réduire la taille du dictionnaire
-        grouped = chunk.groupby([col_year, 'cp', 'cas'])['qty'].sum()
-
-        for (year, cp, cas), qty in grouped.items():
-            key = (year, cp, cas)
-            aggregated_data[key] = aggregated_data.get(key, 0) + qty
+        no_year = chunk[col_year].isna()
+        st_read.drop('annee_invalide', no_year.sum(), chunk.loc[no_year, 'qty'].sum())
+        chunk = chunk[~no_year]
+        st_read.record_out(len(chunk), chunk['qty'].sum())
+
+        # Groupby local, puis cumul compact (un seul DataFrame au lieu d'un dictionnaire de tuples)
+        parts.append(chunk.groupby([col_year, 'cp', 'cas'])['qty'].sum())
+        if len(parts) >= COMPACT_EVERY:
+            parts = [pd.concat(parts).groupby(level=[0, 1, 2]).sum()]
+
+    if not parts:
+        print("Aucune ligne exploitable.")
+        return False
+    aggregated = pd.concat(parts).groupby(level=[0, 1, 2]).sum()
+    aggregated.index.names = ['Annee', 'CodePostal', 'cas']
+    aggregated = aggregated.reset_index()
+    del parts
 
     # 4. Géolocalisation
-    unique_cps = list(set([k[1] for k in aggregated_data.keys()]))
-    gps_map = get_gps_for_cp(unique_cps)
+    gps_map = get_gps_for_cp(aggregated['CodePostal'].unique().tolist())
+    gps = pd.DataFrame.from_dict(gps_map, orient='index', columns=['Ville', 'Lat', 'Lon'])
+    gps = gps.rename(columns={'Lat': 'Latitude', 'Lon': 'Longitude'}).rename_axis('CodePostal')
 
-    # 5. Construction du fichier final
+    # 5. Construction du fichier final : jointures vectorisées, écrites année par année
     print("Construction du fichier final...")
-    final_rows = []
-
-    for (year, cp, cas), qty in aggregated_data.items():
-        if cp in gps_map and cas in prod_db:
-            info_gps = gps_map[cp]
-            info_prod = prod_db[cas]
-
-            final_rows.append({
-                'Annee': year,
-                'CodePostal': cp,
-                'Ville': info_gps['Ville'],
-                'Latitude': info_gps['Lat'],
-                'Longitude': info_gps['Lon'],
-                'Produit': info_prod['Nom'],
-                'Effets_Secondaires': info_prod['Dangers'],
-                'Quantite_kg': round(qty, 2)
-            })
-
-    df_final = pd.DataFrame(final_rows)
-    df_final.to_csv(OUTPUT_CSV, index=False)
+    st_join = stage('jointure_gps_produits')
+    st_join.record_in(len(aggregated), aggregated['qty'].sum())
+    no_gps = ~aggregated['CodePostal'].isin(gps.index)
+    st_join.drop('cp_non_geolocalise', no_gps.sum(), aggregated.loc[no_gps, 'qty'].sum())
+    no_prod = ~no_gps & ~aggregated['cas'].isin(prod_db.index)
+    st_join.drop('cas_inconnu', no_prod.sum(), aggregated.loc[no_prod, 'qty'].sum())
+    aggregated = aggregated[~no_gps & ~no_prod]
+    st_join.record_out(len(aggregated), aggregated['qty'].sum())
+
+    with TableWriter(OUTPUT_CSV) as out:
+        # Le détail (villes, noms, dangers répétés) n'est matérialisé qu'une année à la fois
+        for _, part in aggregated.groupby('Annee', sort=True):
+            part = part.join(gps, on='CodePostal').join(prod_db, on='cas')
+            part['Quantite_kg'] = part['qty'].round(2)
+            out.write(part[OUTPUT_COLUMNS])
+    n_rows = out.rows
 
     print(f"\nSUCCÈS ! Fichier généré : {OUTPUT_CSV}")
-    print(f"Contient {len(df_final)} lignes.")
+    print(f"Contient {n_rows} lignes.")
     print("Dans Kepler.gl :")
     print("1. Ajoutez un filtre sur le champ 'Annee' pour avoir la barre de lecture.")
     print("2. Ajoutez un Tooltip sur 'Produit', 'Quantite_kg' et 'Effets_Secondaires'.")
 
 
 if __name__ == "__main__":
-    process_time_series()
\ No newline at end of file
+    import sys
+    sys.exit(1 if instrumented('big_one', process_time_series) is False else 0)
@@ -1,50 +1,36 @@
 import pandas as pd
-from sqlalchemy import create_engine
 import os
-import requests
 from tqdm import tqdm
 import time
 
+from instrumentation import http_session, instrumented, stage, timed, timed_iter
+from outofcore import TableWriter, iter_csv_chunks
+from scoring import load_profiles, score_columns, substance_defaults, weight_table
+from substances import DB_FILE, load_ghs_codes
+
 # --- CONFIGURATION ---
-DB_PATH = 'sqlite:///phyto_data.db'
 # Nom EXACT de votre fichier
 INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
-OUTPUT_CSV = 'resultat_carte_kepler.csv'
-
-# Sévérité
-SEVERITE_MAP = {
-    'H300': 100, 'H310': 100, 'H330': 100,
-    'H350': 50, 'H340': 50, 'H360': 50,
-    'H351': 10, 'H361': 10,
-    'H301': 5, 'H311': 5, 'H331': 5,
-    'H372': 5, 'H410': 5,
-    'H314': 2, 'H318': 2,
-}
+OUTPUT_CSV = 'datacreation/resultat_carte_kepler.csv'  # .parquet : même table en Parquet zstd
+WRITE_ROWS = 50_000  # Lignes écrites à la fois
+COMPACT_EVERY = 32  # Lots agrégés cumulés avant fusion
 
 
-def load_severity_index():
-    if not os.path.exists("datacreation/phyto_data.db"):
+@timed('chargement_poids')
+def load_weights(profiles):
+    """Poids par substance (une colonne par profil de pondération)"""
+    if not os.path.exists(DB_FILE):
         print("ERREUR : Base phyto_data.db introuvable.")
-        return {}
-    engine = create_engine(DB_PATH)
+        return pd.DataFrame()
     try:
-        df = pd.read_sql(
-            "SELECT s.cas_number, t.valeur FROM substance s JOIN toxicite t ON s.id = t.substance_id WHERE t.categorie = 'GHS'",
-            engine)
+        weights = weight_table(load_ghs_codes(DB_FILE), profiles)
     except:
-        return {}
-
-    cas_score = {}
-    for idx, row in df.iterrows():
-        cas = str(row['cas_number']).strip()
-        code = str(row['valeur']).split('+')[0].strip()
-        score = SEVERITE_MAP.get(code, 1)
-        if cas not in cas_score or score > cas_score[cas]:
-            cas_score[cas] = score
-    print(f"Index Toxicité chargé : {len(cas_score)} substances.")
-    return cas_score
+        return pd.DataFrame()
+    print(f"Index Toxicité chargé : {len(weights)} substances, profils {list(profiles)}.")
+    return weights
 
 
+@timed('geolocalisation')
 def get_gps_for_cp(cp_list):
     """Récupère Lat/Lon pour une liste de codes postaux via API Géo"""
     print(f"Récupération GPS pour {len(cp_list)} codes postaux...")
@@ -52,7 +38,7 @@ def get_gps_for_cp(cp_list):
 
     # On fait des requêtes par lot si possible, ou boucle simple
     # Boucle simple avec session pour aller vite
-    session = requests.Session()
+    session = http_session()
 
     for cp in tqdm(cp_list, desc="Géolocalisation"):
         try:
@@ -70,14 +56,17 @@ def get_gps_for_cp(cp_list):
 def process():
     print("--- TRAITEMENT DU FICHIER CSV LOCAL ---")
 
-    # 1. Charger Risques
-    risk_index = load_severity_index()
-    if not risk_index: return
+    # 1. Charger Risques (tous les profils, évalués dans la même passe)
+    profiles = load_profiles()
+    weights = load_weights(profiles)
+    if weights.empty: return False  # Base absente ou illisible
+    defaults = substance_defaults(profiles)
+    score_cols = [f"Score_{name}" for name in profiles]
 
     if not os.path.exists(INPUT_CSV):
         print(f"ERREUR CRITIQUE: Fichier {INPUT_CSV} introuvable.")
         print("Vérifiez le nom et l'emplacement (dossier data/)")
-        return
+        return False
 
     # 2. Détection des colonnes (Lecture des 5 premières lignes)
     print("Analyse du fichier...")
@@ -98,20 +87,19 @@ def process():
 
     if not all([col_cas, col_cp, col_qty]):
         print("Erreur: Colonnes clés manquantes (CAS, Code Postal ou Quantité).")
-        return
+        return False
 
     # 3. Lecture par morceaux (Streaming)
     print(f"Lecture et calcul en cours (Fichier: {INPUT_CSV})...")
 
-    chunk_size = 100000
-    aggregated_risk = {}  # Stockage {CodePostal: Score}
-    total_lines = 0
+    parts = []  # Agrégats partiels par CP : scores de chaque profil, kg (bilan des pertes), nombre de lignes
 
     # On relance la lecture complète
-    reader = pd.read_csv(INPUT_CSV, sep=';', encoding='latin-1', chunksize=chunk_size, on_bad_lines='skip',
-                         dtype={col_cp: str})
+    # Lecture en continu (lots Arrow bornés par le budget mémoire, cf. outofcore.py)
+    reader = iter_csv_chunks(INPUT_CSV)
+    st_score = stage('scores_par_cp')
 
-    for chunk in tqdm(reader, desc="Traitement des blocs"):
+    for chunk in timed_iter(tqdm(reader, desc="Traitement des blocs"), 'lecture_scores'):
         # Normalisation
         chunk.columns = [c.lower() for c in chunk.columns]
 
@@ -123,60 +111,77 @@ def process():
             errors='coerce'
         ).fillna(0)
 
-        # Mapping Sévérité
-        chunk['severity'] = chunk['cas_clean'].map(risk_index).fillna(0)  # 0 si inconnu (prudence) ou 1
-
-        # Calcul Risque
-        chunk['risk_score'] = chunk['qty_clean'] * chunk['severity']
+        # Calcul Risque : un score par profil (poids par défaut si substance inconnue)
+        chunk = score_columns(chunk, 'qty_clean', 'cas_clean', weights, defaults)
 
         # On ne garde que ce qui a du sens
-        chunk = chunk[chunk['risk_score'] > 0]
+        st_score.record_in(len(chunk), chunk['qty_clean'].clip(lower=0).sum())
+        no_qty = chunk['qty_clean'] <= 0
+        st_score.drop('quantite_nulle_ou_invalide', no_qty.sum())
+        # Filtre historique sur le score de sévérité (RiskScore) : kepler donne 1 aux substances inconnues,
+        # un filtre sur l'ensemble des profils ne retirerait presque rien
+        no_score = ~no_qty & ~(chunk['Score_severite'] > 0)
+        st_score.drop('score_nul', no_score.sum(), chunk.loc[no_score, 'qty_clean'].sum())
+        chunk = chunk[~no_qty & ~no_score]
 
         if chunk.empty: continue
 
         # Agrégation locale
-        grouped = chunk.groupby(col_cp)['risk_score'].sum()
-
-        # Fusion avec le total global
-        for cp, score in grouped.items():
-            # Nettoyage CP (5 chiffres)
-            cp_clean = str(cp).split('.')[0].strip().zfill(5)
-            if len(cp_clean) == 5:
-                aggregated_risk[cp_clean] = aggregated_risk.get(cp_clean, 0) + score
-
-        total_lines += len(chunk)
-
+        grouped = chunk.groupby(col_cp).agg(**{c: (c, 'sum') for c in score_cols + ['qty_clean']},
+                                            n=('qty_clean', 'size'))
+
+        # Nettoyage CP (5 chiffres), une fois par CP du lot
+        cp_clean = grouped.index.astype(str).str.split('.').str[0].str.strip().str.zfill(5)
+        bad = cp_clean.str.len() != 5
+        st_score.drop('cp_invalide', grouped.loc[bad, 'n'].sum(), grouped.loc[bad, 'qty_clean'].sum())
+        grouped = grouped[~bad]
+        st_score.record_out(grouped['n'].sum(), grouped['qty_clean'].sum())
+
+        # Cumul compact (un DataFrame au lieu d'un dictionnaire de Series)
+        parts.append(grouped.set_axis(cp_clean[~bad], axis=0))
+        if len(parts) >= COMPACT_EVERY:
+            parts = [pd.concat(parts).groupby(level=0).sum()]
+
+    aggregated_risk = pd.concat(parts).groupby(level=0).sum() if parts else pd.DataFrame()
+    del parts
     print(f"\nTerminé. {len(aggregated_risk)} codes postaux analysés.")
 
-    if not aggregated_risk:
+    if aggregated_risk.empty:
         print(
             "ATTENTION: Aucun risque calculé. Vérifiez la correspondance des CAS entre votre base et le fichier BNVD.")
-        return
+        return False
 
     # 4. Ajout GPS
-    unique_cps = list(aggregated_risk.keys())
-    gps_map = get_gps_for_cp(unique_cps)
-
-    # 5. Export Final
-    final_data = []
-    for cp, score in aggregated_risk.items():
-        if cp in gps_map:
-            final_data.append({
-                'CodePostal': cp,
-                'RiskScore': round(score, 2),
-                'Lat': gps_map[cp]['lat'],
-                'Lon': gps_map[cp]['lon']
-            })
-
-    if final_data:
-        df_final = pd.DataFrame(final_data)
-        df_final.to_csv(OUTPUT_CSV, index=False)
-        print(f"\n✅ SUCCESS ! Fichier généré : {OUTPUT_CSV}")
-        print(f"Contient {len(df_final)} points géolocalisés.")
-        print("👉 Importez ce fichier dans Kepler.gl")
-    else:
+    gps_map = get_gps_for_cp(aggregated_risk.index.tolist())
+    gps = pd.DataFrame.from_dict(gps_map, orient='index', columns=['lat', 'lon'])
+
+    # 5. Export Final : jointure vectorisée, écriture par lots
+    st_geo = stage('geolocalisation')
+    st_geo.record_in(len(aggregated_risk), aggregated_risk['qty_clean'].sum())
+    located = aggregated_risk.index.isin(gps.index)
+    st_geo.drop('cp_non_geolocalise', (~located).sum(), aggregated_risk.loc[~located, 'qty_clean'].sum())
+    aggregated_risk = aggregated_risk[located]
+    st_geo.record_out(len(aggregated_risk), aggregated_risk['qty_clean'].sum())
+
+    if aggregated_risk.empty:
         print("Echec lors de la géolocalisation.")
+        return False
+
+    with TableWriter(OUTPUT_CSV) as out:
+        for start in range(0, len(aggregated_risk), WRITE_ROWS):
+            part = aggregated_risk.iloc[start:start + WRITE_ROWS]
+            rows = pd.DataFrame({'CodePostal': part.index,
+                                 'RiskScore': part['Score_severite'].round(2).to_numpy(),
+                                 'Lat': gps['lat'].reindex(part.index).to_numpy(),
+                                 'Lon': gps['lon'].reindex(part.index).to_numpy()})
+            for c in score_cols:
+                rows[c] = part[c].round(2).to_numpy()
+            out.write(rows)
+    print(f"\n✅ SUCCESS ! Fichier généré : {OUTPUT_CSV}")
+    print(f"Contient {out.rows} points géolocalisés.")
+    print("👉 Importez ce fichier dans Kepler.gl")
 
 
 if __name__ == "__main__":
-    process()
\ No newline at end of file
+    import sys
+    sys.exit(1 if instrumented('carto_api_hubeau', process) is False else 0)
@@ -0,0 +1,114 @@
+"""
+Clé canonique des numéros CAS, partagée par toutes les jointures (achats BNVD, E-Phy, EFSA, PubChem).
+
+Un CAS ('1071-83-6', ' 0001071-83-6 ', '1071836', '1071-83-6.0' issu d'Excel, '1071–83–6'...) est réduit à
+ses chiffres et encodé en entier int64 : 1071836 si la clé de contrôle est juste, -1071836 si elle est
+fausse (CAS bien formé mais sans doute mal saisi : il reste joignable à lui-même), INVALID s'il est
+illisible. Un champ qui cite plusieurs CAS ('24307-26-4 (mepiquat chloride) - 15302-91-7 (mepiquat)',
+fréquent dans E-Phy) prend le premier CAS valide cité.
+
+Les jointures se font sur ces entiers ; la forme texte canonique ('1071-83-6') se déduit de l'entier.
+La normalisation est faite sur les valeurs distinctes d'une colonne puis redistribuée ; côté DuckDB,
+cas_map() fournit la table de correspondance (brut, canon, cle) à joindre.
+"""
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURATION ---
+INVALID = -1  # Clé d'un CAS illisible : ne correspond à aucune autre clé
+
+# Zéros de tête ignorés ; tirets facultatifs (CAS saisis comme nombres) ; 2 à 7 + 2 + 1 chiffres
+CAS_REGEX = r'^0*(\d{2,7})-?(\d{2})-?(\d)$'
+# CAS cité au milieu d'un texte : tirets obligatoires
+CAS_TOKEN_REGEX = r'(?<!\d)0*(\d{2,7})-(\d{2})-(\d)(?!\d)'
+DASHES = {ord(d): '-' for d in '‐‑‒–—−'}  # Tirets typographiques (copier-coller Word / PDF)
+MAX_BODY_DIGITS = 9
+
+
+def _encode(parts):
+    """Clés signées des CAS extraits (colonnes tête, milieu, clé) : négatives si la clé de contrôle est fausse"""
+    body = (parts[0] + parts[1]).astype(np.int64).to_numpy()
+    check = parts[2].astype(np.int64).to_numpy()
+    # Clé de contrôle : chiffres du corps pondérés 1, 2, 3... depuis la droite, modulo 10
+    total = np.zeros(len(body), dtype=np.int64)
+    rest = body.copy()
+    for weight in range(1, MAX_BODY_DIGITS + 1):
+        total += weight * (rest % 10)
+        rest //= 10
+    key = body * 10 + check
+    return np.where(total % 10 == check, key, -key)
+
+
+def _keys_of_unique(values):
+    """Clés int64 d'un tableau de chaînes sans doublons (le travail coûteux n'est fait qu'une fois par valeur)"""
+    raw = pd.Series(values, dtype=object).astype(str).str.translate(DASHES)
+    keys = np.full(len(raw), INVALID, dtype=np.int64)
+
+    # Cas courant : la valeur entière est un CAS
+    compact = raw.str.replace(r'\s+', '', regex=True).str.replace(r'\.0+$', '', regex=True)
+    parts = compact.str.extract(CAS_REGEX)
+    whole = parts[0].notna().to_numpy()
+    if whole.any():
+        keys[whole] = _encode(parts[whole])
+
+    # Sinon : premier CAS valide cité dans le texte, à défaut le premier CAS bien formé
+    cited = raw[~whole].str.extractall(CAS_TOKEN_REGEX)
+    if len(cited):
+        cited['key'] = _encode(cited)
+        cited = cited.sort_values('key', key=lambda k: k < 0, kind='stable')
+        first = cited.groupby(level=0)['key'].first()
+        keys[first.index.to_numpy()] = first.to_numpy()
+    return keys
+
+
+def cas_key(values):
+    """
+    Clés int64 d'une colonne de CAS (Series, Index, tableau ou liste). Calcul sur les valeurs distinctes
+    puis redistribution : une colonne de millions d'achats ne compte que quelques centaines de CAS.
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    keys = np.append(_keys_of_unique(np.asarray(uniques, dtype=object)), INVALID)[codes]
+    return pd.Series(keys, index=index, dtype=np.int64) if index is not None else keys
+
+
+def cas_key_one(value):
+    """Clé d'un seul CAS (int)"""
+    return int(_keys_of_unique([value])[0])
+
+
+def cas_text(keys):
+    """Forme texte canonique ('1071-83-6') de clés int64, clé de contrôle fausse comprise ; None pour INVALID"""
+    keys = np.asarray(keys, dtype=np.int64)
+    k = np.abs(keys)
+    head, mid, check = k // 1000, (k // 10) % 100, k % 10
+    text = (pd.Series(head).astype(str) + '-' + pd.Series(mid).astype(str).str.zfill(2) + '-'
+            + pd.Series(check).astype(str))
+    return np.where(keys != INVALID, text.to_numpy(dtype=object), None)
+
+
+def canonical_cas(values):
+    """CAS sous forme canonique ; une valeur illisible est gardée telle quelle (sans espaces autour)"""
+    raw = pd.Series(values, dtype=object)
+    text = pd.Series(cas_text(cas_key(raw.to_numpy())), index=raw.index)
+    return text.where(text.notna(), raw.str.strip())
+
+
+def cas_map(values):
+    """Correspondance (brut, canon, cle) des valeurs distinctes d'une colonne de CAS, à joindre côté SQL"""
+    brut = pd.Series(pd.unique(pd.Series(values, dtype=object)), dtype=object)
+    return pd.DataFrame({'brut': brut, 'canon': canonical_cas(brut), 'cle': cas_key(brut)})
+
+
+def align_on_cas(values, table):
+    """
+    Lignes de `table` (indexée par clés CAS, ou par CAS texte) alignées sur une colonne de CAS, par jointure
+    sur les clés entières : NaN pour un CAS absent ou illisible (deux CAS illisibles ne se correspondent jamais).
+    """
+    keys = table.index.to_numpy() if table.index.dtype == np.int64 else cas_key(table.index)
+    right = table.set_axis(keys)
+    right = right[(right.index != INVALID) & ~right.index.duplicated()]
+    return right.reindex(cas_key(values))
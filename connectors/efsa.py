@@ -2,6 +2,8 @@ import pandas as pd
 import logging
 import re
 
+from cas import INVALID, cas_key, cas_key_one
+
 logger = logging.getLogger("EFSA")
 
 
@@ -25,8 +27,8 @@ class EfsaConnector:
         return val_str.strip()
 
     def _normalize_cas(self, cas):
-        cas = self._universal_decode(cas)
-        return cas.lstrip('0')
+        # Clé entière canonique (cas.py) : zéros de tête, espaces et clé de contrôle traités comme partout
+        return cas_key_one(self._universal_decode(cas))
 
     def load_data(self):
         logger.info("Chargement et Décodage Intégral EFSA...")
@@ -43,7 +45,7 @@ class EfsaConnector:
             col_name = next((c for c in ['substance', 'name'] if c in self.df_subst.columns), None)
 
             if col_cas:
-                self.df_subst['cas_key'] = self.df_subst[col_cas].apply(self._normalize_cas)
+                self.df_subst['cas_key'] = cas_key(self.df_subst[col_cas].map(self._universal_decode))
             if col_name:
                 self.df_subst['substance_key'] = self.df_subst[col_name].apply(self._universal_decode)
 
@@ -58,6 +60,7 @@ class EfsaConnector:
         if self.df_subst is None or 'cas_key' not in self.df_subst.columns: return []
 
         cas_clean = self._normalize_cas(cas_input)
+        if cas_clean == INVALID: return []
         match = self.df_subst[self.df_subst['cas_key'] == cas_clean]
 
         if match.empty: return []
@@ -0,0 +1,161 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+
+import pandas as pd
+
+from cas import INVALID, cas_key, cas_key_one
+
+logger = logging.getLogger("GHS")
+
+# Mentions de danger retenues (H3xx santé, H4xx environnement), codes combinés compris ("H300+H310")
+H_CODE = r'H[34]\d{2}[A-Za-z]{0,2}(?:\s*\+\s*H[34]\d{2}[A-Za-z]{0,2})*'
+STATEMENTS = 'GHS Hazard Statements'
+HEADER_ROWS = 10  # Lignes explorées pour trouver l'en-tête (multi-lignes) du tableau annexe VI
+
+
+def _codes(text):
+    """Codes H d'une cellule ou d'une phrase ('H350\\nH360Df ***' -> ['H350', 'H360Df'])"""
+    return [re.sub(r'\s+', '', c) for c in re.findall(H_CODE, str(text))]
+
+
+def _open(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+class GhsBulkImporter:
+    """
+    Table CAS / CID -> mentions H construite en une passe depuis des classifications téléchargées :
+      - tableau de l'annexe VI du règlement CLP (classification harmonisée UE, .xlsx ECHA), clé CAS ;
+      - pages JSON des annotations PubChem "GHS Classification"
+        (pug_view/annotations/heading/JSON?heading=GHS+Classification&page=N, .json ou .json.gz), clé CID.
+    Les appels PubChem par composé ne restent nécessaires que pour les substances absentes des deux tables.
+    """
+
+    def __init__(self, clp_file=None, pubchem_dir=None):
+        self.clp_file = clp_file
+        self.pubchem_dir = pubchem_dir
+        self.df_cas = pd.DataFrame(columns=['cas_key', 'code'])
+        self.df_cid = pd.DataFrame(columns=['cid', 'code'])
+        self.by_cas = {}
+        self.by_cid = {}
+
+    def _iter_clp(self):
+        """
+        (CAS, code) du tableau annexe VI, lu ligne à ligne (openpyxl en lecture seule).
+        L'en-tête ECHA tient sur plusieurs lignes : "Hazard Statement Code(s)" est dans la sous-ligne du groupe
+        fusionné "Classification". Chaque colonne est donc cherchée dans les HEADER_ROWS premières lignes ;
+        les données commencent après la dernière ligne d'en-tête utilisée.
+        """
+        from openpyxl import load_workbook
+        wb = load_workbook(self.clp_file, read_only=True)
+        found = False
+        try:
+            for ws in wb.worksheets:
+                col_cas = col_codes = None
+                for n, row in enumerate(ws.iter_rows(values_only=True)):
+                    if col_cas is None or col_codes is None:
+                        if n >= HEADER_ROWS: break  # Feuille sans tableau CLP (notes, légende...)
+                        labels = [str(c or '').lower() for c in row]
+                        # Première occurrence : la colonne "Classification", avant celle de l'étiquetage
+                        if col_cas is None:
+                            col_cas = next((i for i, c in enumerate(labels) if 'cas no' in c), None)
+                        if col_codes is None:
+                            col_codes = next((i for i, c in enumerate(labels) if 'hazard statement' in c), None)
+                        continue
+                    found = True
+                    if len(row) <= max(col_cas, col_codes) or not row[col_cas]: continue
+                    codes = _codes(row[col_codes])
+                    # Une entrée peut couvrir plusieurs CAS (un par ligne de la cellule)
+                    for cas in re.split(r'[\n;,]+', str(row[col_cas])):
+                        for code in codes:
+                            yield cas, code
+        finally:
+            wb.close()
+        if not found:
+            raise ValueError(f"{self.clp_file} : colonnes 'CAS No' et 'Hazard Statement Code(s)' introuvables "
+                             f"dans les {HEADER_ROWS} premières lignes")
+
+    def _iter_pubchem(self):
+        """(CID, code) des pages d'annotations PubChem, une page en mémoire à la fois"""
+        for path in sorted(glob.glob(os.path.join(self.pubchem_dir, '*.json*'))):
+            with _open(path) as f:
+                page = json.load(f)
+            for annotation in page.get('Annotations', {}).get('Annotation', []):
+                linked = annotation.get('LinkedRecords', {})
+                cids = linked.get('CID', []) if isinstance(linked, dict) else \
+                    [c for rec in linked for c in rec.get('CID', [])]
+                codes = {code for item in annotation.get('Data', []) if item.get('Name') == STATEMENTS
+                         for s in item.get('Value', {}).get('StringWithMarkup', [])
+                         for code in _codes(s.get('String', '').split(':')[0])}
+                for cid in cids:
+                    for code in codes:
+                        yield int(cid), code
+
+    def load_data(self):
+        logger.info("Chargement des classifications GHS locales...")
+        # Fichiers fournis mais illisibles : erreur, plutôt que des tables vides qui renverraient tout vers l'API
+        if self.clp_file and os.path.exists(self.clp_file):
+            df = pd.DataFrame(list(self._iter_clp()), columns=['cas', 'code'])
+            df['cas_key'] = cas_key(df['cas'])
+            self.df_cas = df.loc[df['cas_key'] != INVALID, ['cas_key', 'code']].drop_duplicates()
+            if self.df_cas.empty:
+                logger.warning(f"Aucun CAS lu dans {self.clp_file} : format du tableau annexe VI à vérifier.")
+        if self.pubchem_dir and os.path.isdir(self.pubchem_dir):
+            self.df_cid = pd.DataFrame(list(self._iter_pubchem()), columns=['cid', 'code']).drop_duplicates()
+
+        self.by_cas = self.df_cas.groupby('cas_key')['code'].agg(sorted).to_dict()
+        self.by_cid = self.df_cid.groupby('cid')['code'].agg(sorted).to_dict()
+        logger.info(f"GHS locaux : {len(self.by_cas)} CAS (CLP), {len(self.by_cid)} CID (PubChem).")
+
+    def get_ghs_codes(self, cas=None, cid=None):
+        """[(source, code)] connus localement, None si la substance n'y figure pas (appel API nécessaire)"""
+        found = [('CLP', c) for c in self.by_cas.get(cas_key_one(cas), [])] if cas else []
+        found += [('PubChem', c) for c in self.by_cid.get(int(cid), [])] if cid else []
+        return found or None
+
+    def import_into_db(self, engine):
+        """
+        Ajoute en une passe les mentions des tables locales aux substances de la base (jointure sur la clé CAS
+        et sur le CID PubChem), sans doublonner les lignes GHS existantes. Renvoie le nombre de lignes ajoutées.
+        """
+        from sqlalchemy import text
+        from models import Toxicite
+
+        with engine.begin() as con:
+            subst = pd.read_sql(text("SELECT id AS substance_id, cas_number, cid_pubchem FROM substance"), con)
+            subst['cas_key'] = cas_key(subst['cas_number'])
+            rows = pd.concat([
+                subst.merge(self.df_cas, on='cas_key').assign(source_db='CLP'),
+                subst.dropna(subset=['cid_pubchem']).astype({'cid_pubchem': int})
+                     .merge(self.df_cid, left_on='cid_pubchem', right_on='cid').assign(source_db='PubChem'),
+            ])[['substance_id', 'source_db', 'code']].drop_duplicates()
+
+            existing = pd.read_sql(text("SELECT substance_id, source_db, valeur AS code FROM toxicite "
+                                        "WHERE categorie = 'GHS'"), con)
+            rows = rows.merge(existing, how='left', indicator=True)
+            rows = rows[rows['_merge'] == 'left_only']
+            if len(rows):
+                con.execute(Toxicite.__table__.insert(), [
+                    {'substance_id': int(s), 'source_db': src, 'categorie': 'GHS', 'parametre': 'Hazard', 'valeur': c}
+                    for s, src, c in zip(rows['substance_id'], rows['source_db'], rows['code'])])
+        return len(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    from sqlalchemy import create_engine
+    from models import migrate, sync_hazards
+
+    # python -m connectors.ghs_bulk annexe_vi.xlsx [dossier_pages_pubchem] [base.db]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    args = sys.argv[1:] + [None] * 3
+    importer = GhsBulkImporter(args[0], args[1])
+    importer.load_data()
+    engine = migrate(create_engine(f"sqlite:///{args[2] or 'datacreation/phyto_data.db'}"))
+    n = importer.import_into_db(engine)
+    sync_hazards(engine)
+    print(f"✅ {n} mentions GHS importées.")
@@ -1,7 +1,8 @@
-import requests
 import time
 import re
 
+from instrumentation import http_session
+
 
 class PubChemConnector:
     BASE_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
@@ -10,6 +11,7 @@ class PubChemConnector:
     def __init__(self):
         self.last_call = 0
         self.delay = 0.35
+        self.session = http_session()  # Appels et latences comptés dans le rapport d'exécution
 
     def _wait(self):
         elapsed = time.time() - self.last_call
@@ -21,13 +23,13 @@ class PubChemConnector:
         self._wait()
         url_cid = f"{self.BASE_URL}/compound/name/{cas}/cids/JSON"
         try:
-            r = requests.get(url_cid, timeout=10)
+            r = self.session.get(url_cid, timeout=10)
             if r.status_code != 200: return None
             cid = r.json()['IdentifierList']['CID'][0]
 
             self._wait()
             url_props = f"{self.BASE_URL}/compound/cid/{cid}/property/MolecularFormula,MolecularWeight/JSON"
-            r_props = requests.get(url_props, timeout=10)
+            r_props = self.session.get(url_props, timeout=10)
             props = r_props.json()['PropertyTable']['Properties'][0]
             return {'cid': cid, 'formula': props.get('MolecularFormula'), 'weight': props.get('MolecularWeight')}
         except:
@@ -40,7 +42,7 @@ class PubChemConnector:
         ghs_codes = set()
 
         try:
-            r = requests.get(url, timeout=15)
+            r = self.session.get(url, timeout=15)
             if r.status_code == 200:
                 # CONVERTIR TOUT LE JSON EN TEXTE SIMPLE
                 full_text = r.text
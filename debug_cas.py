@@ -1,86 +1,170 @@
-import pandas as pd
-import os
-
-# --- CONFIGURATION ---
-INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
-
-
-def diagnose_loss():
-    print("--- DIAGNOSTIC DE PERTE DE DONNÉES ---")
-
-    if not os.path.exists(INPUT_CSV):
-        print(f"Erreur : {INPUT_CSV} introuvable.")
-        return
-
-    print("Lecture d'un échantillon (500 000 lignes)...")
-
-    # On lit en mode 'low_memory=False' pour bien voir les types
-    # On essaie de tout lire en string pour voir le format brut
-    try:
-        df = pd.read_csv(INPUT_CSV, sep=';', nrows=500000, encoding='latin-1', dtype=str)
-    except:
-        df = pd.read_csv(INPUT_CSV, sep=',', nrows=500000, encoding='latin-1', dtype=str)
-
-    # Normalisation noms colonnes
-    df.columns = [c.lower() for c in df.columns]
+"""
+Profil de qualité du CSV BNVD, en une seule passe sur tout le fichier et en mémoire constante.
 
-    print(f"Lignes lues : {len(df)}")
+Pour chaque colonne : valeurs vides, valeurs invalides (colonnes clés) et nombre approximatif de valeurs
+distinctes (HyperLogLog). Pour les quantités : quantiles approximatifs (t-digest). Pour chaque année :
+lignes restantes après chaque étape de nettoyage du pipeline, donc la perte étape par étape.
 
-    # 1. ANALYSE DES ANNÉES
-    col_annee = next((c for c in df.columns if 'annee' in c or 'year' in c), None)
-    if col_annee:
-        print(f"\n1. ANALYSE COLONNE ANNÉE ('{col_annee}')")
-        print("Valeurs uniques trouvées (Top 10) :")
-        print(df[col_annee].value_counts().head(10))
-
-        nb_2023_brut = len(df[df[col_annee] == '2023'])
-        nb_2023_float = len(df[df[col_annee] == '2023.0'])
-
-        print(f" -> Lignes exactes '2023'   : {nb_2023_brut}")
-        print(f" -> Lignes format '2023.0' : {nb_2023_float}")
-
-        if nb_2023_brut == 0 and nb_2023_float > 0:
-            print("⚠️ PROBLÈME DÉTECTÉ : L'année est stockée comme un nombre à virgule (2023.0).")
-            print("   Le script précédent cherchait '2023' et a donc tout ignoré !")
-    else:
-        print("❌ Colonne Année introuvable !")
-
-    # 2. ANALYSE DES QUANTITÉS
-    col_qty = next((c for c in df.columns if 'quantit' in c), None)
-    if col_qty:
-        print(f"\n2. ANALYSE QUANTITÉS ('{col_qty}')")
-        # Test de conversion
-        sample_qty = df[col_qty].head(5).tolist()
-        print(f"Exemples bruts : {sample_qty}")
-
-        # Simulation nettoyage
-        clean_qty = pd.to_numeric(
-            df[col_qty].str.replace(',', '.').str.replace(' ', ''),
-            errors='coerce'
-        ).fillna(0)
-
-        nb_sup_0 = len(clean_qty[clean_qty > 0])
-        print(f" -> Lignes avec Quantité > 0 après nettoyage : {nb_sup_0} / {len(df)}")
+Rapport JSON écrit dans REPORT_FILE. Usage en production : python debug_cas.py --max-perte 0.05
+(code de sortie 1 si plus de 5 % des lignes sont perdues).
+"""
+import json
+import os
+import sys
+import time
 
-        if nb_sup_0 < len(df) * 0.1:
-            print("⚠️ ALERTE : Moins de 10% des lignes ont une quantité valide. Problème de conversion ?")
+import pandas as pd
 
-    # 3. ANALYSE DES CODES POSTAUX
-    col_cp = next((c for c in df.columns if 'postal' in c), None)
-    if col_cp:
-        print(f"\n3. ANALYSE CODES POSTAUX ('{col_cp}')")
-        # On regarde si les codes ont bien 5 chiffres
-        sample_cp = df[col_cp].head(5).tolist()
-        print(f"Exemples bruts : {sample_cp}")
+from cas import INVALID, cas_key
+from duckstore import detect_columns
+from outofcore import iter_csv_chunks
+from sketches import HyperLogLog, TDigest
 
-        # Test format
-        valid_cp = df[col_cp].str.len() == 5
-        print(f" -> Codes postaux de 5 caractères : {valid_cp.sum()} / {len(df)}")
+# --- CONFIGURATION ---
+INPUT_CSV = 'data/Achats-de-produits-phytosanitaires-a-lechelle-du-code-postal-.2025-06.csv'
+REPORT_FILE = 'datacreation/qualite_donnees.json'
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+
+# Étapes de nettoyage, dans l'ordre où le pipeline les applique (chaque étape garde un sous-ensemble de la précédente)
+STAGES = ['lues', 'annee_valide', 'quantite_positive', 'cp_valide', 'cas_valide']
+WRONG_CHECK_DIGIT = 'cas_cle_fausse'  # Compteur à part : CAS gardés par le pipeline malgré une clé de contrôle fausse
+CP_PATTERN = r'^\d{5}$'
+
+
+def _year_format(raw):
+    """Forme brute de l'année : '2023', '2023.0' (nombre à virgule), vide ou autre"""
+    s = raw.fillna('').str.strip()
+    return pd.Series('autre', index=s.index) \
+        .mask(s.str.fullmatch(r'\d{4}\.0+'), 'AAAA.0') \
+        .mask(s.str.fullmatch(r'\d{4}'), 'AAAA') \
+        .mask(s == '', 'vide')
+
+
+class Profiler:
+    """Accumulateurs du profil, mis à jour bloc par bloc"""
+
+    def __init__(self, cols):
+        self.cols = cols
+        self.rows = 0
+        self.nulls, self.invalid, self.distinct = {}, {}, {}
+        self.year_formats = {}
+        self.stages = {}  # {annee: {etape: lignes}}
+        self.qty = TDigest()
+
+    def _count(self, counter, key, n):
+        counter[key] = counter.get(key, 0) + int(n)
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            values = chunk[col].str.strip()
+            self._count(self.nulls, col, (values.isna() | (values == '')).sum())
+            self.distinct.setdefault(col, HyperLogLog()).add(values[values != ''])
+
+        c = self.cols
+        year = pd.to_numeric(chunk[c['year']], errors='coerce')
+        qty = pd.to_numeric(chunk[c['qty']].str.replace(',', '.').str.replace(' ', ''), errors='coerce')
+        cp = chunk[c['cp']].fillna('').str.replace(' ', '').str.strip().str.split('.').str[0].str.zfill(5)
+        cas = cas_key(chunk[c['cas']])  # Format et clé de contrôle (cas.py)
+
+        valid = {
+            'annee_valide': year.notna(),
+            'quantite_positive': qty > 0,
+            'cp_valide': cp.str.match(CP_PATTERN),
+            'cas_valide': cas != INVALID,  # Lisible : une clé de contrôle fausse (clé négative) reste joignable
+        }
+        self._count(self.invalid, c['year'], year.isna().sum())
+        self._count(self.invalid, c['qty'], qty.isna().sum())
+        self._count(self.invalid, c['cp'], (~valid['cp_valide']).sum())
+        self._count(self.invalid, c['cas'], (~valid['cas_valide']).sum())
+        self._count(self.invalid, WRONG_CHECK_DIGIT, ((cas < 0) & (cas != INVALID)).sum())
+        for fmt, n in _year_format(chunk[c['year']]).value_counts().items():
+            self._count(self.year_formats, fmt, n)
+        self.qty.add(qty[qty > 0].values)
+
+        # Survivants de chaque étape, par année (les années illisibles sont regroupées sous 'invalide')
+        label = year.round().astype('Int64').astype('string').fillna('invalide')
+        keep = pd.Series(True, index=chunk.index)
+        steps = {'lues': keep}
+        for stage in STAGES[1:]:
+            keep = keep & valid[stage]
+            steps[stage] = keep
+        counts = pd.DataFrame(steps).groupby(label).sum()
+        for annee, row in counts.iterrows():
+            per_year = self.stages.setdefault(annee, {})
+            for stage in STAGES:
+                self._count(per_year, stage, row[stage])
+
+    def report(self):
+        total = {s: sum(y.get(s, 0) for y in self.stages.values()) for s in STAGES}
+        kept = total['cas_valide']
+        quantiles = self.qty.quantile(QUANTILES) if self.qty.count else [None] * len(QUANTILES)
+        return {
+            'lignes': self.rows,
+            'colonnes': {
+                col: {'vides': self.nulls[col], 'invalides': self.invalid.get(col),
+                      'distinctes_approx': self.distinct[col].count()}
+                for col in self.nulls
+            },
+            'formats_annee': self.year_formats,
+            WRONG_CHECK_DIGIT: self.invalid.get(WRONG_CHECK_DIGIT, 0),  # Non comptés dans les pertes
+            'quantite': {
+                'n': int(self.qty.count),
+                'min': float(self.qty.min) if self.qty.count else None,
+                'max': float(self.qty.max) if self.qty.count else None,
+                'quantiles': {f"p{q * 100:g}": (float(v) if v is not None else None) for q, v in zip(QUANTILES, quantiles)},
+            },
+            'pertes': {
+                'etapes': STAGES,
+                'total': total,
+                'par_annee': dict(sorted(self.stages.items())),
+                'taux_perte': 1 - kept / total['lues'] if total['lues'] else 0.0,
+            },
+        }
+
+
+def profile_csv(csv_path=INPUT_CSV):
+    """Profil complet du fichier (dict sérialisable en JSON)"""
+    cols = detect_columns(csv_path)
+    t0 = time.time()
+    prof = Profiler(cols)
+    for chunk in iter_csv_chunks(csv_path):
+        prof.update(chunk)
+    report = {'fichier': csv_path, 'colonnes_cles': cols, **prof.report()}
+    report['duree_s'] = round(time.time() - t0, 1)
+    return report
+
+
+def diagnose_loss(csv_path=INPUT_CSV, report_file=REPORT_FILE, max_loss=None):
+    print("--- DIAGNOSTIC DE PERTE DE DONNÉES ---")
 
-        # Test code 'manquant' ou 'NC'
-        nb_nc = len(df[df[col_cp].astype(str).str.contains('NC|nan', case=False, na=True)])
-        print(f" -> Codes Postaux invalides/manquants : {nb_nc}")
+    if not os.path.exists(csv_path):
+        print(f"Erreur : {csv_path} introuvable.")
+        return None
+
+    report = profile_csv(csv_path)
+    os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+
+    print(f"Lignes lues : {report['lignes']} ({report['duree_s']} s)")
+    print(f"Formats de l'année : {report['formats_annee']}")
+    pertes = report['pertes']
+    prev = None
+    for stage in STAGES:
+        n = pertes['total'][stage]
+        print(f" -> {stage:<18} {n:>12}" + (f"  (-{prev - n})" if prev is not None else ""))
+        prev = n
+    print(f"Taux de perte : {pertes['taux_perte']:.2%}")
+    print(f"CAS à clé de contrôle fausse (conservés) : {report[WRONG_CHECK_DIGIT]}")
+    print(f"✅ Rapport écrit dans {report_file}")
+
+    if max_loss is not None and pertes['taux_perte'] > max_loss:
+        print(f"❌ Perte supérieure au seuil de {max_loss:.2%}.")
+        return False
+    return report
 
 
 if __name__ == "__main__":
-    diagnose_loss()
\ No newline at end of file
+    seuil = float(sys.argv[sys.argv.index('--max-perte') + 1]) if '--max-perte' in sys.argv else None
+    sys.exit(1 if diagnose_loss(max_loss=seuil) is False else 0)
@@ -0,0 +1,151 @@
+"""
+Entrepôt analytique DuckDB persistant.
+
+La table `achats` (cp, annee, cas, cas_key, qty) est chargée une seule fois depuis le CSV BNVD, typée et triée
+par (annee, cp) : les zone maps DuckDB (min/max par groupe de lignes) élaguent alors les requêtes
+filtrées par année ou code postal. Elle n'est rechargée que si le CSV source change (taille / mtime).
+La base SQLite enrichie est attachée telle quelle via l'extension sqlite (pas de copie pandas).
+Les CAS sont canoniques et doublés d'une clé entière `cas_key` (cas.py) sur laquelle se font les jointures.
+"""
+import os
+
+import pandas as pd
+
+from cas import canonical_cas
+from outofcore import duckdb_connect, register_cas_map
+from substances import flag_first_codes
+
+# --- CONFIGURATION ---
+STORE_FILE = 'datacreation/phyto_store.duckdb'
+RISK_DB = 'datacreation/phyto_data.db'
+
+
+def detect_columns(csv_path):
+    """Trouve les vrais noms des colonnes dans votre fichier CSV"""
+    print(f"Inspection des colonnes de {csv_path}...")
+    try:
+        # On lit juste la première ligne pour voir les en-têtes
+        # Essai avec séparateur ; (fréquent)
+        df = pd.read_csv(csv_path, sep=';', nrows=1, encoding='latin-1')
+        if len(df.columns) < 2:
+            # Si échec, essai virgule
+            df = pd.read_csv(csv_path, sep=',', nrows=1, encoding='latin-1')
+
+        cols = [c.lower() for c in df.columns]
+        real_cols = list(df.columns)  # On garde les vrais noms (avec majuscules) pour SQL
+
+        # Mapping intelligent
+        mapping = {}
+
+        # 1. CAS
+        idx = next((i for i, c in enumerate(cols) if 'cas' in c), None)
+        if idx is not None: mapping['cas'] = real_cols[idx]
+
+        # 2. Code Postal
+        idx = next((i for i, c in enumerate(cols) if 'postal' in c or 'insee' in c), None)
+        if idx is not None: mapping['cp'] = real_cols[idx]
+
+        # 3. Quantité
+        idx = next((i for i, c in enumerate(cols) if 'quantit' in c), None)
+        if idx is not None: mapping['qty'] = real_cols[idx]
+
+        # 4. Année
+        idx = next((i for i, c in enumerate(cols) if 'annee' in c or 'year' in c), None)
+        if idx is not None: mapping['year'] = real_cols[idx]
+
+        print(f"Colonnes identifiées : {mapping}")
+        return mapping
+    except Exception as e:
+        print(f"Erreur detection colonnes : {e}")
+        return {}
+
+
+def connect(store_file=STORE_FILE, risk_db=RISK_DB, read_only=False):
+    """Ouvre l'entrepôt et attache la base de risques SQLite (schéma `risk`) si elle existe"""
+    os.makedirs(os.path.dirname(store_file) or '.', exist_ok=True)
+    con = duckdb_connect(store_file, read_only=read_only)  # Budget mémoire + débordement disque
+    if risk_db and os.path.exists(risk_db):
+        con.execute("INSTALL sqlite; LOAD sqlite;")
+        con.execute(f"ATTACH '{risk_db}' AS risk (TYPE sqlite, READ_ONLY)")
+    return con
+
+
+def _source_signature(csv_path):
+    st = os.stat(csv_path)
+    return os.path.abspath(csv_path), int(st.st_size), int(st.st_mtime)
+
+
+def achats_is_fresh(con, csv_path):
+    """Vrai si `achats` a déjà été chargée depuis ce fichier, dans cette version"""
+    con.execute("CREATE TABLE IF NOT EXISTS _sources (path VARCHAR PRIMARY KEY, size BIGINT, mtime BIGINT)")
+    path, size, mtime = _source_signature(csv_path)
+    row = con.execute("SELECT size, mtime FROM _sources WHERE path = ?", [path]).fetchone()
+    has_table = con.execute(
+        "SELECT count(*) FROM duckdb_columns() WHERE database_name = current_database() "
+        "AND table_name = 'achats' AND column_name = 'cas_key'"  # Tables antérieures aux clés CAS : rechargées
+    ).fetchone()[0]
+    return bool(has_table) and row == (size, mtime)
+
+
+def load_achats(con, csv_path, cols, force=False):
+    """(Re)charge le CSV brut dans la table typée `achats`, triée par (annee, cp)"""
+    if not force and achats_is_fresh(con, csv_path):
+        print("Table 'achats' à jour, pas de rechargement.")
+        return
+
+    print(f"Chargement de {csv_path} dans l'entrepôt DuckDB...")
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE achats_bruts AS
+    SELECT
+        lpad(split_part(replace(CAST("{cols['cp']}" AS VARCHAR), ' ', ''), '.', 1), 5, '0') AS cp,
+        TRY_CAST("{cols['year']}" AS SMALLINT) AS annee,
+        trim(CAST("{cols['cas']}" AS VARCHAR)) AS cas,
+        TRY_CAST(replace(replace(CAST("{cols['qty']}" AS VARCHAR), ',', '.'), ' ', '') AS DOUBLE) AS qty
+    FROM read_csv_auto('{csv_path}', normalize_names=False, all_varchar=True)
+    WHERE qty > 0
+    """)
+    # CAS canonique + clé entière de jointure (cas.py), calculés une fois par CAS brut distinct
+    register_cas_map(con, "SELECT cas FROM achats_bruts", column='cas')
+    con.execute("""
+    CREATE OR REPLACE TABLE achats AS
+    SELECT a.cp, a.annee, m.canon AS cas, m.cle AS cas_key, a.qty
+    FROM achats_bruts a JOIN cas_map m ON a.cas IS NOT DISTINCT FROM m.brut
+    ORDER BY annee, cp
+    """)
+    con.execute("DROP TABLE achats_bruts")
+    con.unregister('cas_map')
+
+    path, size, mtime = _source_signature(csv_path)
+    con.execute("CREATE TABLE IF NOT EXISTS _sources (path VARCHAR PRIMARY KEY, size BIGINT, mtime BIGINT)")
+    con.execute("INSERT OR REPLACE INTO _sources VALUES (?, ?, ?)", [path, size, mtime])
+    n = con.execute("SELECT count(*) FROM achats").fetchone()[0]
+    print(f"Table 'achats' : {n} lignes.")
+
+
+def load_ghs_codes(con):
+    """Table longue (CAS, Code, Premier) des mentions GHS (cf. substances.load_ghs_codes), lue dans la base SQLite attachée"""
+    migrated = con.execute("SELECT count(*) FROM duckdb_tables() "
+                           "WHERE database_name = 'risk' AND table_name = 'substance_hazard'").fetchone()[0]
+    if migrated:
+        ghs = con.execute("""
+        SELECT DISTINCT s.cas_number AS "CAS", h.code AS "Code"
+        FROM risk.substance_hazard sh
+        JOIN risk.substance s ON s.id = sh.substance_id
+        JOIN risk.hazard_code h ON h.id = sh.hazard_id
+        """).df()
+    else:
+        ghs = con.execute("""
+        SELECT DISTINCT s.cas_number AS "CAS", trim(u.code) AS "Code"
+        FROM risk.substance s
+        JOIN risk.toxicite t ON s.id = t.substance_id,
+        unnest(string_split(t.valeur, '+')) AS u(code)
+        WHERE t.categorie = 'GHS' AND trim(u.code) <> ''
+        """).df()
+    first = con.execute("""
+    SELECT DISTINCT s.cas_number AS "CAS", trim(split_part(t.valeur, '+', 1)) AS "Code"
+    FROM risk.substance s
+    JOIN risk.toxicite t ON s.id = t.substance_id
+    WHERE t.categorie = 'GHS'
+    """).df()
+    ghs = ghs.assign(CAS=canonical_cas(ghs['CAS'])).drop_duplicates()
+    return flag_first_codes(ghs, first).reset_index(drop=True)
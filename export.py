@@ -1,60 +1,35 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
 from sqlalchemy import create_engine
 import os
 
+from substances import DB_FILE, GHS_MAP
+
 # Configuration
-DB_PATH = 'sqlite:///phyto_data.db'
+DB_PATH = f'sqlite:///{DB_FILE}'
 OUTPUT_FILE = 'datacreation/Resultats_Phyto_AVEC_DESCRIPTION.xlsx'
-
-# --- DICTIONNAIRE DE TRADUCTION (CODES H -> FRANÇAIS) ---
-GHS_MAP = {
-    # Toxicité aiguë
-    'H300': 'Mortel en cas d\'ingestion',
-    'H301': 'Toxique en cas d\'ingestion',
-    'H302': 'Nocif en cas d\'ingestion',
-    'H304': 'Peut être mortel en cas d\'ingestion et de pénétration dans les voies respiratoires',
-    'H310': 'Mortel par contact cutané',
-    'H311': 'Toxique par contact cutané',
-    'H312': 'Nocif par contact cutané',
-    'H330': 'Mortel par inhalation',
-    'H331': 'Toxique par inhalation',
-    'H332': 'Nocif par inhalation',
-
-    # Corrosion / Irritation
-    'H314': 'Provoque des brûlures de la peau et des lésions oculaires graves',
-    'H315': 'Provoque une irritation cutanée',
-    'H317': 'Peut provoquer une allergie cutanée',
-    'H318': 'Provoque des lésions oculaires graves',
-    'H319': 'Provoque une sévère irritation des yeux',
-
-    # Cancérogénicité / Mutagénicité / Reprotoxicité (CMR)
-    'H340': 'Peut induire des anomalies génétiques',
-    'H341': 'Susceptible d\'induire des anomalies génétiques',
-    'H350': 'Peut provoquer le cancer',
-    'H351': 'Susceptible de provoquer le cancer',
-    'H360': 'Peut nuire à la fertilité ou au fœtus',
-    'H360D': 'Peut nuire au fœtus',
-    'H360F': 'Peut nuire à la fertilité',
-    'H361': 'Susceptible de nuire à la fertilité ou au fœtus',
-    'H361d': 'Susceptible de nuire au fœtus',
-
-    # Organes cibles
-    'H370': 'Risque avéré d\'effets graves pour les organes',
-    'H371': 'Risque présumé d\'effets graves pour les organes',
-    'H372': 'Risque avéré d\'effets graves pour les organes (exposition répétée)',
-    'H373': 'Risque présumé d\'effets graves pour les organes (exposition répétée)',
-
-    # Environnement (Écotoxicité)
-    'H400': 'Très toxique pour les organismes aquatiques',
-    'H410': 'Très toxique pour les organismes aquatiques, entraîne des effets néfastes à long terme',
-    'H411': 'Toxique pour les organismes aquatiques, entraîne des effets néfastes à long terme',
-    'H412': 'Nocif pour les organismes aquatiques, entraîne des effets néfastes à long terme',
-    'H413': 'Peut être nocif à long terme pour les organismes aquatiques',
-
-    # Abeilles / Ozone (EUH codes)
-    'EUH401': 'Respectez les instructions d\'utilisation pour éviter les risques pour la santé humaine et l\'environnement',
-}
-
+CHUNK_ROWS = 50_000  # Lignes lues et écrites à la fois : la mémoire ne dépend pas de la taille de la table toxicite
+ALL_SHEET = 'Toutes sources'
+COLUMNS = ['Substance', 'Description_Claire', 'Code_Valeur', 'Paramètre', 'CAS', 'Fonction', 'Source']
+
+QUERY = """
+SELECT 
+    s.cas_number as 'CAS',
+    s.nom_ephy as 'Substance',
+    s.fonction as 'Fonction',
+    t.source_db as 'Source',
+    t.categorie as 'Type',
+    t.parametre as 'Paramètre',
+    t.valeur as 'Code_Valeur',
+    t.unite as 'Unité'
+FROM substance s
+LEFT JOIN toxicite t ON s.id = t.substance_id
+WHERE t.valeur IS NOT NULL  -- On ne veut que ce qui a des effets
+ORDER BY s.nom_ephy
+"""
 
 def translate_ghs(code):
     """Traduit un code H ou retourne le code si inconnu"""
@@ -64,64 +39,126 @@ def translate_ghs(code):
     return GHS_MAP.get(code_clean, code)
 
 
-def export_data():
+def describe(df):
+    """Colonne 'Description_Claire' d'un bloc, sans appel Python par ligne (même règles que translate_ghs)"""
+    val = df['Code_Valeur'].astype(str)
+    # Code danger : traduction du premier code d'une combinaison ("H300+H310"), sinon le code tel quel
+    ghs = val.str.split('+').str[0].str.strip().map(GHS_MAP).fillna(val).where(val.ne(''), "")
+    tox = "Limite toxique: " + val + " " + df['Unité'].astype(str)
+    described = np.select([df['Paramètre'].eq('Hazard'), df['Type'].eq('Tox')], [ghs, tox], default=val)
+    return pd.Series(described, index=df.index)
+
+
+def iter_enriched(engine, chunksize=CHUNK_ROWS):
+    """Blocs successifs de l'export (colonnes COLUMNS), dans l'ordre des substances"""
+    for chunk in pd.read_sql(QUERY, engine, chunksize=chunksize):
+        chunk['Description_Claire'] = describe(chunk)
+        yield chunk[COLUMNS]
+
+
+def _sheet_title(source):
+    """Nom de feuille Excel valide (31 caractères, sans []:*?/\\)"""
+    title = ''.join('_' if c in '[]:*?/\\' else c for c in str(source))[:31]
+    return title or 'Sans source'
+
+
+class ExcelStream:
+    """Classeur openpyxl en écriture seule : les lignes partent sur disque au fil de l'eau.
+    Une feuille pour tout l'export, plus une par source (EFSA, PubChem...) si by_source."""
+
+    def __init__(self, path, by_source=False):
+        self.path = path
+        self.by_source = by_source
+        self.wb = Workbook(write_only=True)
+        self.sheets = {}
+
+    def _sheet(self, title):
+        if title not in self.sheets:
+            ws = self.wb.create_sheet(title)
+            ws.append(COLUMNS)
+            self.sheets[title] = ws
+        return self.sheets[title]
+
+    def write(self, chunk):
+        rows = chunk.astype(object).where(chunk.notna(), None)
+        sheet_all = self._sheet(ALL_SHEET)
+        for row in rows.itertuples(index=False, name=None):
+            sheet_all.append(row)
+        if self.by_source:
+            for source, part in rows.groupby(chunk['Source'].fillna('Sans source'), sort=False):
+                ws = self._sheet(_sheet_title(source))
+                for row in part.itertuples(index=False, name=None):
+                    ws.append(row)
+
+    def close(self):
+        self._sheet(ALL_SHEET)  # Classeur valide même sans aucune ligne
+        self.wb.save(self.path)
+
+
+class ParquetStream:
+    def __init__(self, path):
+        self.path = path
+        self.schema = pa.schema([(c, pa.string()) for c in COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, chunk):
+        self.writer.write_table(pa.Table.from_pandas(chunk.astype('string'), schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvStream:
+    def __init__(self, path):
+        self.path = path
+        pd.DataFrame(columns=COLUMNS).to_csv(path, index=False)
+
+    def write(self, chunk):
+        chunk.to_csv(self.path, mode='a', header=False, index=False)
+
+    def close(self):
+        pass
+
+
+def export_data(output_file=OUTPUT_FILE, formats=('xlsx',), by_source=False, chunksize=CHUNK_ROWS):
+    """Export enrichi, bloc par bloc : xlsx (une feuille par source si by_source), parquet et/ou csv
+    à côté de output_file (même nom, extension du format)."""
     print("--- Exportation Enrichie ---")
 
-    if not os.path.exists("datacreation/phyto_data.db"):
+    if not os.path.exists(DB_FILE):
         print("Erreur : Base de données introuvable.")
-        return
+        return False
 
     engine = create_engine(DB_PATH)
-
-    query = """
-    SELECT 
-        s.cas_number as 'CAS',
-        s.nom_ephy as 'Substance',
-        s.fonction as 'Fonction',
-        t.source_db as 'Source',
-        t.categorie as 'Type',
-        t.parametre as 'Paramètre',
-        t.valeur as 'Code_Valeur',
-        t.unite as 'Unité'
-    FROM substance s
-    LEFT JOIN toxicite t ON s.id = t.substance_id
-    WHERE t.valeur IS NOT NULL  -- On ne veut que ce qui a des effets
-    ORDER BY s.nom_ephy
-    """
-
-    print("Lecture de la base...")
-    df = pd.read_sql(query, engine)
-
-    print(f"{len(df)} lignes trouvées avec des effets.")
-
-    # --- APPLICATION DE LA TRADUCTION ---
-    print("Traduction des codes dangers...")
-
-    # On crée une nouvelle colonne 'Description_Claire'
-    def decrypter(row):
-        val = row['Code_Valeur']
-        param = row['Paramètre']
-
-        # Si c'est un code Danger (GHS)
-        if param == 'Hazard':
-            return translate_ghs(val)
-
-        # Si c'est une valeur tox (ADI, ARfD)
-        if row['Type'] == 'Tox':
-            return f"Limite toxique: {val} {row['Unité']}"
-
-        return val
-
-    df['Description_Claire'] = df.apply(decrypter, axis=1)
-
-    # Réorganisation des colonnes pour mettre la description en premier
-    cols = ['Substance', 'Description_Claire', 'Code_Valeur', 'Paramètre', 'CAS', 'Fonction', 'Source']
-    df = df[cols]
-
-    print(f"Écriture Excel : {OUTPUT_FILE}...")
-    df.to_excel(OUTPUT_FILE, index=False, engine='openpyxl')
+    base = os.path.splitext(output_file)[0]
+    writers = []
+    for fmt in formats:
+        if fmt == 'xlsx': writers.append(ExcelStream(f"{base}.xlsx", by_source))
+        elif fmt == 'parquet': writers.append(ParquetStream(f"{base}.parquet"))
+        elif fmt == 'csv': writers.append(CsvStream(f"{base}.csv"))
+        else: raise ValueError(f"Format d'export inconnu : {fmt}")
+
+    # --- LECTURE, TRADUCTION ET ÉCRITURE PAR BLOCS ---
+    print("Lecture de la base, traduction des codes dangers et écriture...")
+    n = 0
+    try:
+        for chunk in iter_enriched(engine, chunksize):
+            for w in writers:
+                w.write(chunk)
+            n += len(chunk)
+    finally:
+        for w in writers:
+            w.close()
+
+    print(f"{n} lignes trouvées avec des effets.")
+    for w in writers:
+        print(f" -> {w.path}")
     print("Terminé ! Ouvrez le nouveau fichier Excel.")
 
 
 if __name__ == "__main__":
-    export_data()
\ No newline at end of file
+    import sys
+    # python export.py [--parquet] [--csv] [--sans-xlsx] [--par-source]
+    formats = [] if '--sans-xlsx' in sys.argv else ['xlsx']
+    formats += [f for f in ('parquet', 'csv') if f"--{f}" in sys.argv]
+    sys.exit(1 if export_data(formats=formats, by_source='--par-source' in sys.argv) is False else 0)
@@ -0,0 +1,96 @@
+"""
+Cube danger x géographie x année.
+
+Les volumes commune x substance sont croisés avec les mentions GHS de chaque substance (relation
+plusieurs-à-plusieurs CAS -> codes H). Une substance compte pour tout son volume dans chacun de
+ses codes / classes, mais une seule fois par classe même si elle porte plusieurs codes de la classe
+(H350 + H351 -> un seul volume "Cancérogène"). Les volumes de différents dangers ne s'additionnent
+donc pas en volume total.
+
+Stockage creux : seules les cellules non nulles sont écrites, en Parquet avec colonnes catégorielles,
+triées par (Annee, Danger, Geo) pour qu'un filtre sur un danger ne lise que ses groupes de lignes.
+"""
+import os
+
+import pandas as pd
+
+from aggregates import AGG_DIR, load_aggregates
+from cas import INVALID, cas_key
+from substances import DB_FILE, load_ghs_codes
+
+# --- CONFIGURATION ---
+# Classe de danger par préfixe de code (4 premiers caractères)
+HAZARD_CLASSES = {
+    'H300': 'Mortel', 'H310': 'Mortel', 'H330': 'Mortel',
+    'H301': 'Toxique aigu', 'H311': 'Toxique aigu', 'H331': 'Toxique aigu',
+    'H302': 'Nocif aigu', 'H312': 'Nocif aigu', 'H332': 'Nocif aigu',
+    'H340': 'Mutagène', 'H341': 'Mutagène',
+    'H350': 'Cancérogène', 'H351': 'Cancérogène',
+    'H360': 'Reprotoxique', 'H361': 'Reprotoxique', 'H362': 'Reprotoxique',
+    'H370': 'Organes cibles', 'H371': 'Organes cibles', 'H372': 'Organes cibles', 'H373': 'Organes cibles',
+    'H400': 'Aquatique', 'H410': 'Aquatique', 'H411': 'Aquatique', 'H412': 'Aquatique', 'H413': 'Aquatique',
+}
+
+# Niveau géographique -> colonne de la table commune x substance
+GEO_LEVELS = {'communes': 'INSEE', 'departements': 'Dept', 'national': None}
+
+
+def hazard_bridge(ghs):
+    """Table de pont (CAS_Key, Axe, Danger) : une ligne par code H et une ligne par classe de danger"""
+    codes = ghs[['CAS', 'Code']].assign(CAS_Key=cas_key(ghs['CAS']))
+    codes = codes[codes['CAS_Key'] != INVALID][['CAS_Key', 'Code']].drop_duplicates()
+    classes = codes.assign(Classe=codes['Code'].str[:4].map(HAZARD_CLASSES)).dropna(subset=['Classe'])
+
+    return pd.concat([
+        codes.rename(columns={'Code': 'Danger'}).assign(Axe='code'),
+        classes[['CAS_Key', 'Classe']].drop_duplicates().rename(columns={'Classe': 'Danger'}).assign(Axe='classe'),
+    ], ignore_index=True)[['CAS_Key', 'Axe', 'Danger']]
+
+
+def build_cube(communes_substances, bridge, level):
+    """Cellules non nulles (Annee, Geo, Axe, Danger) -> Volume, Nb_Substances pour un niveau géographique"""
+    geo = GEO_LEVELS[level]
+    keys = ['Annee'] + ([geo] if geo else [])
+
+    parts = []
+    # Une année à la fois : l'explosion CAS -> codes reste bornée à une année de détail
+    for _, df_year in communes_substances.groupby('Annee'):
+        vol = df_year.groupby(keys + ['CAS'], as_index=False, observed=True)['Volume'].sum()
+        cells = vol.assign(CAS_Key=cas_key(vol['CAS'])).merge(bridge, on='CAS_Key', how='inner')
+        parts.append(cells.groupby(keys + ['Axe', 'Danger'], as_index=False, observed=True).agg(
+            Volume=('Volume', 'sum'), Nb_Substances=('CAS_Key', 'nunique')))
+
+    cube = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=keys + ['Axe', 'Danger', 'Volume', 'Nb_Substances'])
+    cube = cube.rename(columns={geo: 'Geo'}) if geo else cube.assign(Geo='FR')
+    cube = cube.sort_values(['Annee', 'Axe', 'Danger', 'Geo']).reset_index(drop=True)
+    for col in ['Geo', 'Axe', 'Danger']:
+        cube[col] = cube[col].astype('category')
+    return cube[['Annee', 'Axe', 'Danger', 'Geo', 'Volume', 'Nb_Substances']]
+
+
+def cube_path(level, agg_dir=AGG_DIR):
+    return os.path.join(agg_dir, f"cube_dangers_{level}.parquet")
+
+
+def load_cube(level='departements', agg_dir=AGG_DIR, danger=None, annee=None):
+    """Relit un cube, en ne lisant que les groupes de lignes du danger / de l'année demandés"""
+    filters = []
+    if danger is not None: filters.append(('Danger', '==', danger))
+    if annee is not None: filters.append(('Annee', '==', int(annee)))
+    return pd.read_parquet(cube_path(level, agg_dir), filters=filters or None)
+
+
+def run(agg_dir=AGG_DIR, db_file=DB_FILE):
+    print("--- CUBE DANGERS x GÉOGRAPHIE x ANNÉE ---")
+    bridge = hazard_bridge(load_ghs_codes(db_file))
+    detail = load_aggregates(agg_dir)['communes_substances']
+
+    for level in GEO_LEVELS:
+        cube = build_cube(detail, bridge, level)
+        cube.to_parquet(cube_path(level, agg_dir), index=False, row_group_size=100000)
+        print(f" -> {level} : {len(cube)} cellules non nulles.")
+    print(f"✅ Cubes écrits dans {agg_dir}.")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,139 @@
+"""
+Masques de bits des dangers GHS par substance, pour filtrer et pondérer des millions de lignes d'achat
+par opérations bit à bit vectorisées au lieu de jointures sur la table longue (CAS, Code).
+
+Bit i = code de hazard_code d'id i + 1 (ids stables : un nouveau code prend le bit suivant, les masques
+existants restent valides). Un masque fait `width` mots uint64 ; il est stocké dans substance.hazard_mask
+par models.sync_hazards.
+
+    masks = load_hazard_masks()
+    cmr_aquatique = masks.all_of(['H410'], cas) & masks.any_of(CMR_CODES, cas)   # un booléen par ligne
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+
+from cas import INVALID, cas_key
+from scoring import CMR
+from substances import DB_FILE, load_ghs_codes
+
+# --- CONFIGURATION ---
+CMR_CODES = sorted(CMR)
+
+
+class HazardMasks:
+    """Masques (n_substances, width) uint64 indexés par clé CAS entière (cas.py), et correspondance bit -> code"""
+
+    def __init__(self, keys, masks, codes):
+        self.keys = pd.Index(keys, dtype=np.int64)
+        self.masks = np.ascontiguousarray(masks, dtype=np.uint64).reshape(len(self.keys), -1)
+        self.codes = list(codes)  # codes[bit], None pour un bit sans code
+        self.bit_of = {c: b for b, c in enumerate(self.codes) if c is not None}
+
+    @property
+    def width(self):
+        return self.masks.shape[1]
+
+    @classmethod
+    def from_codes(cls, ghs):
+        """Construit les masques à partir de la table longue (CAS, Code) (base non migrée, entrepôt DuckDB)"""
+        ghs = ghs.assign(CAS_Key=cas_key(ghs['CAS']))
+        ghs = ghs[ghs['CAS_Key'] != INVALID]
+        codes = sorted(ghs['Code'].unique())
+        keys = pd.Index(np.unique(ghs['CAS_Key']))
+        masks = np.zeros((len(keys), max(1, (len(codes) + 63) // 64)), dtype=np.uint64)
+        bits = pd.Index(codes).get_indexer(ghs['Code']).astype(np.int64)
+        np.bitwise_or.at(masks, (keys.get_indexer(ghs['CAS_Key']), bits // 64),
+                         np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+        return cls(keys, masks, codes)
+
+    def query(self, codes):
+        """Masque (width,) des codes demandés ; un code inconnu n'a aucun bit et ne correspond à rien"""
+        q = np.zeros(self.width, dtype=np.uint64)
+        for code in codes:
+            b = self.bit_of.get(code)
+            if b is not None:
+                q[b // 64] |= np.uint64(1) << np.uint64(b % 64)
+        return q
+
+    def rows(self, cas=None):
+        """Masques alignés sur une colonne CAS (une ligne par achat) ; CAS inconnu ou invalide = aucun danger"""
+        if cas is None: return self.masks
+        padded = np.vstack([self.masks, np.zeros((1, self.width), dtype=np.uint64)])
+        return padded[self.keys.get_indexer(cas_key(cas))]
+
+    def any_of(self, codes, cas=None):
+        """Booléen par substance (ou par ligne de `cas`) : porte au moins un des codes"""
+        return ((self.rows(cas) & self.query(codes)) != 0).any(axis=1)
+
+    def all_of(self, codes, cas=None):
+        """Booléen par substance (ou par ligne de `cas`) : porte tous les codes (faux si un code est inconnu)"""
+        if any(c not in self.bit_of for c in codes):
+            return np.zeros(len(self.masks) if cas is None else len(cas), dtype=bool)
+        q = self.query(codes)
+        return ((self.rows(cas) & q) == q).all(axis=1)
+
+    def bits(self):
+        """Matrice booléenne (n_substances, n_bits) substance x code"""
+        as_bytes = self.masks.astype('<u8').view(np.uint8)
+        return np.unpackbits(as_bytes, axis=1, bitorder='little')[:, :len(self.codes)].astype(bool)
+
+    def codes_of(self, cas):
+        row = self.keys.get_loc(cas_key([cas])[0])
+        return [self.codes[b] for b in np.flatnonzero(self.bits()[row])]
+
+    def weights(self, poids, defaut_code=0, defaut_substance=0):
+        """Poids par clé CAS = maximum des poids de ses codes (mêmes règles que scoring.weight_table)"""
+        w = np.array([poids.get(c, defaut_code) if c is not None else -np.inf for c in self.codes], dtype=float)
+        bits = self.bits()
+        best = np.where(bits, w, -np.inf).max(axis=1, initial=-np.inf)
+        return pd.Series(np.where(bits.any(axis=1), best, defaut_substance), index=self.keys)
+
+
+def load_hazard_masks(db_file=DB_FILE):
+    """Masques stockés dans substance.hazard_mask (base migrée), sinon recalculés depuis les codes GHS"""
+    engine = create_engine(f'sqlite:///{db_file}')
+    columns = {c['name'] for c in inspect(engine).get_columns('substance')}
+    if 'hazard_mask' not in columns:
+        return HazardMasks.from_codes(load_ghs_codes(db_file))
+
+    df = pd.read_sql("SELECT cas_number, hazard_mask FROM substance WHERE hazard_mask IS NOT NULL", engine)
+    hazard = pd.read_sql("SELECT id, code FROM hazard_code", engine)
+    codes = [None] * int(hazard['id'].max() if len(hazard) else 0)
+    for i, c in zip(hazard['id'], hazard['code']):
+        codes[i - 1] = c
+    width = max(1, (len(codes) + 63) // 64)
+    masks = np.zeros((len(df), width), dtype=np.uint64)
+    for row, blob in enumerate(df['hazard_mask']):
+        words = np.frombuffer(blob, dtype='<u8')
+        masks[row, :len(words)] = words
+    # Substances dont le CAS se réduit à la même clé (champ listant plusieurs CAS) : codes réunis
+    keys = cas_key(df['cas_number']).to_numpy()
+    keep = keys != INVALID
+    unique, rows = np.unique(keys[keep], return_inverse=True)
+    merged = np.zeros((len(unique), width), dtype=np.uint64)
+    np.bitwise_or.at(merged, rows, masks[keep])
+    return HazardMasks(unique, merged, codes)
+
+
+def volumes_matching(df, masks, any_of=None, all_of=None, cas_col='CAS'):
+    """Lignes de `df` dont la substance porte un des codes `any_of` et tous les codes `all_of`"""
+    keep = np.ones(len(df), dtype=bool)
+    if any_of: keep &= masks.any_of(any_of, df[cas_col])
+    if all_of: keep &= masks.all_of(all_of, df[cas_col])
+    return df[keep]
+
+
+if __name__ == "__main__":
+    import sys
+    from aggregates import load_partitions, available_years
+
+    # python hazards.py H350 H360 [--tous] : communes achetant une (ou, avec --tous, chaque) substance portant ces codes
+    codes = [a for a in sys.argv[1:] if not a.startswith('--')]
+    annee = available_years()[0]
+    detail = load_partitions(annee=annee)
+    masks = load_hazard_masks()
+    sel = volumes_matching(detail, masks, **({'all_of': codes} if '--tous' in sys.argv else {'any_of': codes}))
+    top = sel.groupby(['INSEE', 'Commune'], as_index=False)['Volume'].sum().nlargest(20, 'Volume')
+    print(f"{annee} : {sel['INSEE'].nunique()} communes, {sel['Volume'].sum():.0f} kg ({' '.join(codes)})")
+    print(top.to_string(index=False))
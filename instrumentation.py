@@ -0,0 +1,345 @@
+"""
+Instrumentation des pipelines : pertes de données, temps, mémoire et appels HTTP.
+
+Chaque étape déclare ses entrées, ses sorties et ses pertes par motif, en lignes et en kg :
+    st = stage('apportion')
+    st.record_in(len(df), df['qty'].sum())
+    st.drop('cp_inconnu', n, kg)
+    st.record_out(len(df_out), df_out['Volume'].sum())
+Une ligne conservée mais appauvrie (ex. géométrie absente) se déclare avec st.degrade(motif, n, kg).
+Les compteurs s'alimentent par blocs (une somme par bloc, pas d'appel par ligne). Le rapport de
+l'exécution regroupe toutes les étapes ; le kg "non expliqué" (entrées - sorties - pertes déclarées)
+signale une perte que personne ne compte.
+
+Le même rapport trace aussi le temps et la mémoire :
+    with timed('lecture_csv'): ...     (ou @timed(...), ou for x in timed_iter(...)) durée, temps CPU, RSS avant / après et pic de RSS, par étape
+    http_session()                      session requests qui compte les appels HTTP et leurs latences par hôte
+    instrumented('big_one', main)       point d'entrée : rapport neuf, profilage optionnel, sauvegarde finale
+Profilage : PHYTO_PROFILE=cprofile (ou pyinstrument) ajoute les fonctions les plus coûteuses au rapport
+et écrit le profil complet à côté.
+
+save_report() écrit le rapport JSON dans REPORT_DIR/<nom>.json et l'ajoute à REPORT_DIR/historique.jsonl
+(une ligne par exécution, pour suivre les régressions du build nocturne).
+"""
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+from sketches import TDigest
+
+# --- CONFIGURATION ---
+REPORT_DIR = 'datacreation/rapports'
+HISTORY_FILE = 'historique.jsonl'
+PROFILE = os.environ.get('PHYTO_PROFILE', '')  # '', 'cprofile' ou 'pyinstrument'
+PROFILE_TOP = 25
+
+
+def _proc_status(field):
+    """Champ mémoire de /proc/self/status en octets (None hors Linux)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss():
+    """Mémoire résidente actuelle du processus, en octets"""
+    return _proc_status('VmRSS') or peak_rss()
+
+
+def peak_rss():
+    """Pic de mémoire résidente du processus, en octets"""
+    # VmHWM est propre au processus courant ; ru_maxrss hérite du pic du parent à travers exec()
+    return _proc_status('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage:
+    """Compteurs d'une étape : lignes et kg en entrée, en sortie et perdus par motif"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = self.rows_out = 0
+        self.kg_in = self.kg_out = 0.0
+        self.drops = {}  # {motif: [lignes, kg]}
+        self.degraded = {}  # {motif: [lignes, kg]}, lignes conservées mais incomplètes
+
+    def record_in(self, rows, kg=0.0):
+        self.rows_in += int(rows)
+        self.kg_in += float(kg)
+
+    def record_out(self, rows, kg=0.0):
+        self.rows_out += int(rows)
+        self.kg_out += float(kg)
+
+    def drop(self, reason, rows, kg=0.0):
+        self._add(self.drops, reason, rows, kg)
+
+    def degrade(self, reason, rows, kg=0.0):
+        self._add(self.degraded, reason, rows, kg)
+
+    @staticmethod
+    def _add(counter, reason, rows, kg):
+        if not rows: return
+        d = counter.setdefault(reason, [0, 0.0])
+        d[0] += int(rows)
+        d[1] += float(kg)
+
+    def to_dict(self):
+        kg_dropped = sum(kg for _, kg in self.drops.values())
+        return {
+            'lignes_entree': self.rows_in, 'kg_entree': round(self.kg_in, 3),
+            'lignes_sortie': self.rows_out, 'kg_sortie': round(self.kg_out, 3),
+            'pertes': {r: {'lignes': n, 'kg': round(kg, 3)} for r, (n, kg) in sorted(self.drops.items())},
+            'degradations': {r: {'lignes': n, 'kg': round(kg, 3)} for r, (n, kg) in sorted(self.degraded.items())},
+            'kg_non_explique': round(self.kg_in - self.kg_out - kg_dropped, 3),
+        }
+
+
+class Timer:
+    """Temps et mémoire cumulés d'une étape (plusieurs passages possibles)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = self.cpu = 0.0
+        self.rss_start = self.rss_end = self.peak = None
+
+    def to_dict(self):
+        mb = lambda b: round(b / 1e6, 1) if b is not None else None
+        return {'appels': self.calls, 'duree_s': round(self.wall, 3), 'cpu_s': round(self.cpu, 3),
+                'rss_debut_mo': mb(self.rss_start), 'rss_fin_mo': mb(self.rss_end), 'pic_rss_mo': mb(self.peak)}
+
+
+class HttpStats:
+    """Appels HTTP vers un hôte : nombre, erreurs, codes de retour et latences (t-digest)"""
+
+    def __init__(self):
+        self.calls = self.errors = 0
+        self.total = 0.0
+        self.status = {}
+        self.latency = TDigest(delta=100)
+
+    def record(self, seconds, status=None, error=None):
+        self.calls += 1
+        key = str(status) if status is not None else type(error).__name__
+        self.status[key] = self.status.get(key, 0) + 1
+        if error is not None or (status is not None and status >= 400): self.errors += 1
+        self.total += seconds
+        self.latency.add([seconds])
+
+    def to_dict(self):
+        p50, p95 = self.latency.quantile([0.5, 0.95]) if self.calls else (None, None)
+        ms = lambda s: round(float(s) * 1000, 1) if s is not None else None
+        return {'appels': self.calls, 'erreurs': self.errors, 'codes': self.status,
+                'latence_p50_ms': ms(p50), 'latence_p95_ms': ms(p95),
+                'latence_max_ms': ms(self.latency.max) if self.calls else None,
+                'duree_totale_s': round(self.total, 3)}
+
+
+class RunReport:
+    """Rapport d'une exécution : étapes dans l'ordre de leur première utilisation"""
+
+    def __init__(self, name=None):
+        self.name = name or os.path.splitext(os.path.basename(sys.argv[0] or 'run'))[0] or 'run'
+        self.started = time.time()
+        self.stages = {}
+        self.timers = {}
+        self.http = {}
+        self.status = None
+        self.profile = None
+
+    def timer(self, name):
+        if name not in self.timers:
+            self.timers[name] = Timer(name)
+        return self.timers[name]
+
+    def http_host(self, host):
+        if host not in self.http:
+            self.http[host] = HttpStats()
+        return self.http[host]
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+        return self.stages[name]
+
+    def to_dict(self):
+        return {
+            'run': self.name,
+            'debut': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'duree_s': round(time.time() - self.started, 3),
+            'statut': self.status,
+            'pic_rss_mo': round(peak_rss() / 1e6, 1),
+            'etapes': {name: s.to_dict() for name, s in self.stages.items()},
+            'temps': {name: t.to_dict() for name, t in self.timers.items()},
+            'http': {host: h.to_dict() for host, h in self.http.items()},
+            'profil': self.profile,
+        }
+
+    def summary(self):
+        """Résumé lisible : une ligne par étape et par motif de perte"""
+        lines = []
+        for name, s in self.stages.items():
+            d = s.to_dict()
+            share = 1 - d['kg_sortie'] / d['kg_entree'] if d['kg_entree'] else 0.0
+            lines.append(f" {name}: {d['lignes_entree']} -> {d['lignes_sortie']} lignes, "
+                         f"{d['kg_entree']:.0f} -> {d['kg_sortie']:.0f} kg ({share:.1%} perdus)")
+            for reason, p in d['pertes'].items():
+                lines.append(f"    - {reason}: {p['lignes']} lignes, {p['kg']:.0f} kg")
+            for reason, p in d['degradations'].items():
+                lines.append(f"    ~ {reason}: {p['lignes']} lignes, {p['kg']:.0f} kg (conservées)")
+        for name, t in self.timers.items():
+            d = t.to_dict()
+            lines.append(f" ⏱ {name}: {d['duree_s']:.2f} s ({d['cpu_s']:.2f} s CPU), pic RSS {d['pic_rss_mo']} Mo")
+        for host, h in self.http.items():
+            d = h.to_dict()
+            lines.append(f" 🌐 {host}: {d['appels']} appels, {d['erreurs']} erreurs, p95 {d['latence_p95_ms']} ms")
+        return "\n".join(lines)
+
+
+REPORT = RunReport()
+
+
+def stage(name):
+    """Compteurs de l'étape `name` dans le rapport de l'exécution courante"""
+    return REPORT.stage(name)
+
+
+def reset(name=None):
+    """Repart d'un rapport vide (nouvelle exécution dans le même processus)"""
+    global REPORT
+    REPORT = RunReport(name)
+    return REPORT
+
+
+@contextmanager
+def timed(name):
+    """Chronomètre une étape : durée, temps CPU, RSS avant / après et pic de RSS"""
+    t = REPORT.timer(name)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    if t.rss_start is None: t.rss_start = rss()
+    try:
+        yield t
+    finally:
+        t.calls += 1
+        t.wall += time.perf_counter() - start_wall
+        t.cpu += time.process_time() - start_cpu
+        t.rss_end, t.peak = rss(), peak_rss()
+
+
+def timed_iter(iterable, name):
+    """Chronomètre toute une boucle for (lecture + corps de boucle) sans la réindenter"""
+    with timed(name):
+        yield from iterable
+
+
+class InstrumentedSession(requests.Session):
+    """Session requests qui trace chaque appel (hôte, code de retour ou exception, latence complète)"""
+
+    def request(self, method, url, *args, **kwargs):
+        stats = REPORT.http_host(urlsplit(url).netloc)
+        start = time.perf_counter()
+        try:
+            r = super().request(method, url, *args, **kwargs)
+        except Exception as e:
+            stats.record(time.perf_counter() - start, error=e)
+            raise
+        stats.record(time.perf_counter() - start, status=r.status_code)
+        return r
+
+
+def http_session():
+    return InstrumentedSession()
+
+
+def http_get(url, **kwargs):
+    """requests.get tracé (session partagée)"""
+    global _SESSION
+    if _SESSION is None: _SESSION = http_session()
+    return _SESSION.get(url, **kwargs)
+
+
+_SESSION = None
+
+
+def _start_profiler(kind):
+    if kind == 'cprofile':
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        return prof
+    if kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("⚠️ pyinstrument absent (pip install pyinstrument) : profilage désactivé.")
+            return None
+        prof = Profiler()
+        prof.start()
+        return prof
+    return None
+
+
+def _stop_profiler(prof, kind, report_dir):
+    """Arrête le profileur, écrit le profil complet et renvoie son résumé pour le rapport"""
+    os.makedirs(report_dir, exist_ok=True)
+    if kind == 'cprofile':
+        import pstats
+        prof.disable()
+        path = os.path.join(report_dir, f"{REPORT.name}.prof")
+        prof.dump_stats(path)
+        stats = pstats.Stats(prof).stats
+        top = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:PROFILE_TOP]
+        return {'outil': kind, 'fichier': path, 'fonctions': [
+            {'fonction': f"{os.path.basename(file)}:{line}({func})", 'appels': nc,
+             'propre_s': round(tt, 4), 'cumul_s': round(ct, 4)}
+            for (file, line, func), (cc, nc, tt, ct, _) in top]}
+    prof.stop()
+    path = os.path.join(report_dir, f"{REPORT.name}.html")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(prof.output_html())
+    return {'outil': kind, 'fichier': path}
+
+
+def instrumented(name, func, *args, profile=PROFILE, report_dir=REPORT_DIR, **kwargs):
+    """Exécute func dans un rapport neuf (chronométré, profilé si demandé) et sauvegarde la trace, même en cas d'erreur"""
+    reset(name)
+    prof = _start_profiler(profile)
+    try:
+        with timed('total'):
+            result = func(*args, **kwargs)
+        REPORT.status = 'échec' if result is False else 'ok'  # Sortie anticipée du script sur une erreur
+        return result
+    except BaseException as e:
+        REPORT.status = f"erreur : {type(e).__name__}: {e}"
+        raise
+    finally:
+        if prof is not None:
+            REPORT.profile = _stop_profiler(prof, profile, report_dir)
+        save_report(report_dir=report_dir)
+
+
+def save_report(name=None, report_dir=REPORT_DIR):
+    """Écrit le rapport de l'exécution courante en JSON (et l'ajoute à l'historique), puis affiche son résumé"""
+    if name: REPORT.name = name
+    os.makedirs(report_dir, exist_ok=True)
+    trace = REPORT.to_dict()
+    path = os.path.join(report_dir, f"{REPORT.name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(trace, f, indent=1, ensure_ascii=False)
+    with open(os.path.join(report_dir, HISTORY_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(trace, ensure_ascii=False) + '\n')
+    print("Bilan de l'exécution :")
+    print(REPORT.summary())
+    print(f" -> Rapport écrit dans {path}")
+    return path
@@ -4,14 +4,20 @@ from sqlalchemy.orm import Session
 import os
 
 # Importation des modules locaux
-from models import init_db, Substance, Toxicite
+from cas import INVALID, cas_key, cas_key_one, cas_text
+from models import init_db, sync_hazards, Substance, Toxicite
 from connectors.pubchem import PubChemConnector
 from connectors.efsa import EfsaConnector
+from connectors.ghs_bulk import GhsBulkImporter
+from instrumentation import instrumented, timed, timed_iter
+from substances import DB_FILE
 
 # --- CONFIGURATION FICHIERS ---
 INPUT_FILE = "substance_active_Windows-1252.csv"
 EFSA_CHAR = "SubstanceCharacterisation_KJ_2023.xlsx"
 EFSA_REF = "ReferenceValues_KJ_2023.xlsx"
+CLP_ANNEX_VI = "annex_vi_clp_table.xlsx"  # Classification harmonisée UE (ECHA), facultatif
+PUBCHEM_GHS = "pubchem_ghs"  # Pages d'annotations PubChem "GHS Classification", facultatif
 
 # --- DÉTECTION DES CHEMINS ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,6 +26,8 @@ DATA_DIR = os.path.join(CURRENT_DIR, 'data')
 INPUT_PATH = os.path.join(DATA_DIR, INPUT_FILE)
 EFSA_CHAR_PATH = os.path.join(DATA_DIR, EFSA_CHAR)
 EFSA_REF_PATH = os.path.join(DATA_DIR, EFSA_REF)
+CLP_PATH = os.path.join(DATA_DIR, CLP_ANNEX_VI)
+PUBCHEM_GHS_DIR = os.path.join(DATA_DIR, PUBCHEM_GHS)
 
 # Configuration Logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
@@ -31,21 +39,27 @@ def run():
 
     if not os.path.exists(INPUT_PATH):
         logger.error(f"Fichier INTROUVABLE: {INPUT_PATH}")
-        return
+        return False
 
     # 1. Initialisation Base de Données
-    db = init_db('sqlite:///phyto_data.db')
+    db = init_db(f'sqlite:///{DB_FILE}')
     session = Session(db)
 
     # --- MÉMOIRE ANTI-DOUBLONS ---
     # On charge tous les CAS déjà présents dans la base pour ne pas les refaire
-    existing_cas = set(row[0] for row in session.query(Substance.cas_number).all())
+    # Comparaison sur la clé CAS canonique (cas.py) : '0050-00-0' et '50-00-0' sont la même substance
+    existing = [row[0] for row in session.query(Substance.cas_number).all()]
+    existing_cas = {k if k != INVALID else c.strip() for c, k in zip(existing, cas_key(existing))}
     logger.info(f"Substances déjà en base : {len(existing_cas)}")
 
     # 2. Initialisation Connecteurs
     pubchem = PubChemConnector()
     efsa = EfsaConnector(EFSA_CHAR_PATH, EFSA_REF_PATH)
-    efsa.load_data()
+    with timed('chargement_efsa'):
+        efsa.load_data()
+    ghs_bulk = GhsBulkImporter(CLP_PATH, PUBCHEM_GHS_DIR)
+    with timed('chargement_ghs_locaux'):
+        ghs_bulk.load_data()
 
     # 3. Lecture CSV E-Phy
     logger.info(f"Lecture fichier E-Phy...")
@@ -53,26 +67,29 @@ def run():
         df = pd.read_csv(INPUT_PATH, sep=';', encoding='cp1252', on_bad_lines='skip', dtype=str)
     except Exception as e:
         logger.critical(f"Erreur lecture CSV: {e}")
-        return
+        return False
 
     count = 0
     # 4. Traitement
-    for idx, row in df.iterrows():
+    for idx, row in timed_iter(df.iterrows(), 'enrichissement_substances'):
         cas_raw = row.get('Numero CAS')
         nom = row.get('Nom substance active', 'Inconnu')
 
         if pd.isna(cas_raw) or str(cas_raw).strip() in ['nan', 'NC', '', 'None']:
             continue
 
-        cas = str(cas_raw).strip()
+        # CAS stocké sous forme canonique ; un CAS illisible est gardé tel quel
+        key = cas_key_one(cas_raw)
+        cas = cas_text([key])[0] if key != INVALID else str(cas_raw).strip()
+        if key == INVALID: key = cas
 
         # --- DOUBLE VÉRIFICATION ---
         # 1. Est-ce qu'on l'a déjà fait avant ? (Base de données)
-        if cas in existing_cas:
+        if key in existing_cas:
             continue
 
         # 2. Ajout immédiat à la liste "fait" pour éviter les doublons DANS le fichier CSV lui-même
-        existing_cas.add(cas)
+        existing_cas.add(key)
 
         logger.info(f"Traitement [{count}]: {nom} (CAS: {cas})")
 
@@ -84,10 +101,13 @@ def run():
             subst.cid_pubchem = pc['cid']
             subst.masse_molaire = pc['weight']
             subst.formule = pc['formula']
-            # GHS
-            ghs_codes = pubchem.get_ghs_classification(pc['cid'])
-            for code in ghs_codes:
-                subst.toxicites.append(Toxicite(source_db="PubChem", categorie="GHS", parametre="Hazard", valeur=code))
+
+        # GHS : classifications locales d'abord, appel PubChem par composé seulement pour les restantes
+        ghs = ghs_bulk.get_ghs_codes(cas, pc['cid'] if pc else None)
+        if ghs is None and pc:
+            ghs = [("PubChem", code) for code in pubchem.get_ghs_classification(pc['cid'])]
+        for source, code in ghs or []:
+            subst.toxicites.append(Toxicite(source_db=source, categorie="GHS", parametre="Hazard", valeur=code))
 
         # EFSA
         tox_values = efsa.get_tox_values(cas)
@@ -113,8 +133,16 @@ def run():
                 session.rollback()
 
     session.commit()
+
+    # Classifications locales également reportées sur les substances déjà en base
+    logger.info(f"Mentions GHS locales ajoutées aux substances existantes : {ghs_bulk.import_into_db(db)}")
+
+    # Dimension des dangers (hazard_code / substance_hazard) alignée sur les nouvelles lignes GHS
+    sync_hazards(db)
     logger.info("Terminé avec succès.")
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    import sys
+    # Code de sortie non nul en cas d'échec : pipeline.py ne marque pas l'étape comme réussie
+    sys.exit(1 if instrumented('main', run) is False else 0)
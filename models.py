@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Float, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
+# Version du schéma, stockée dans PRAGMA user_version
+# (0 = sans index ni hazard_code, 2 = hazard_code sans masques de bits par substance)
+SCHEMA_VERSION = 3
+
 
 class Substance(Base):
     __tablename__ = 'substance'
@@ -14,12 +18,20 @@ class Substance(Base):
     cid_pubchem = Column(Integer, nullable=True)
     masse_molaire = Column(Float, nullable=True)
     formule = Column(String, nullable=True)
+    # Codes GHS en masque de bits (bit = hazard_code.id - 1), mots uint64 petit-boutistes, cf. hazards.py
+    hazard_mask = Column(LargeBinary, nullable=True)
 
     toxicites = relationship("Toxicite", back_populates="substance", cascade="all, delete-orphan")
+    dangers = relationship("HazardCode", secondary="substance_hazard", viewonly=True)
 
 
 class Toxicite(Base):
     __tablename__ = 'toxicite'
+    __table_args__ = (
+        # Jointure substance -> toxicité (export) et filtres WHERE categorie = 'GHS' (lecteurs du risque)
+        Index('ix_toxicite_substance_categorie', 'substance_id', 'categorie', 'parametre'),
+        Index('ix_toxicite_categorie_substance', 'categorie', 'substance_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     substance_id = Column(Integer, ForeignKey('substance.id'))
@@ -32,7 +44,110 @@ class Toxicite(Base):
     substance = relationship("Substance", back_populates="toxicites")
 
 
-def init_db(db_path='sqlite:///phyto_data.db'):
-    engine = create_engine(db_path)
+class HazardCode(Base):
+    """Dimension des mentions de danger GHS (un code par ligne, clé entière)"""
+    __tablename__ = 'hazard_code'
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String, unique=True, index=True, nullable=False)
+    description = Column(String, nullable=True)  # Libellé complet (export)
+    libelle = Column(String, nullable=True)  # Libellé court (tableaux, tooltips)
+    severite = Column(Integer, nullable=False, default=1)
+
+
+class SubstanceHazard(Base):
+    """Mentions GHS d'une substance, codes combinés ("H300+H310") éclatés : jointure entière substance -> danger"""
+    __tablename__ = 'substance_hazard'
+    __table_args__ = (Index('ix_substance_hazard_hazard', 'hazard_id', 'substance_id'),)
+
+    substance_id = Column(Integer, ForeignKey('substance.id'), primary_key=True)
+    hazard_id = Column(Integer, ForeignKey('hazard_code.id'), primary_key=True)
+
+
+def has_hazard_tables(engine):
+    """Vrai si la base a été migrée (tables hazard_code et substance_hazard présentes)"""
+    tables = set(inspect(engine).get_table_names())
+    return {'hazard_code', 'substance_hazard'} <= tables
+
+
+def sync_hazards(engine):
+    """
+    Reconstruit substance_hazard et les masques de bits des substances à partir des lignes GHS de toxicite
+    (source de vérité, écrite par main.py) et complète hazard_code avec les codes rencontrés. Idempotent.
+    """
+    import numpy as np
+    import pandas as pd
+    from substances import GHS_DESC, GHS_MAP, SEVERITE_MAP
+
+    with engine.begin() as con:
+        ghs = pd.read_sql(text("SELECT substance_id, valeur FROM toxicite WHERE categorie = 'GHS'"), con)
+        ghs['code'] = ghs['valeur'].astype(str).str.split('+')
+        ghs = ghs.explode('code')
+        ghs['code'] = ghs['code'].str.strip()
+        ghs = ghs[ghs['code'] != '']
+
+        known = set(pd.read_sql(text("SELECT code FROM hazard_code"), con)['code'])
+        catalog = (set(GHS_MAP) | set(GHS_DESC) | set(SEVERITE_MAP) | set(ghs['code'])) - known
+        if catalog:
+            con.execute(HazardCode.__table__.insert(), [
+                {'code': c, 'description': GHS_MAP.get(c), 'libelle': GHS_DESC.get(c), 'severite': SEVERITE_MAP.get(c, 1)}
+                for c in sorted(catalog)])
+
+        ids = pd.read_sql(text("SELECT id AS hazard_id, code FROM hazard_code"), con)
+        links = ghs.merge(ids, on='code')[['substance_id', 'hazard_id']].drop_duplicates()
+        con.execute(SubstanceHazard.__table__.delete())
+        if len(links):
+            con.execute(SubstanceHazard.__table__.insert(), links.astype(int).to_dict('records'))
+
+        # Masque de bits de chaque substance (largeur commune : assez de mots pour le plus grand id)
+        subst_ids = pd.read_sql(text("SELECT id FROM substance ORDER BY id"), con)['id'].to_numpy()
+        masks = np.zeros((len(subst_ids), (int(ids['hazard_id'].max()) + 63) // 64), dtype='<u8')
+        bits = links['hazard_id'].to_numpy(dtype=np.int64) - 1
+        rows = np.searchsorted(subst_ids, links['substance_id'].to_numpy())
+        np.bitwise_or.at(masks, (rows, bits // 64), np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+        con.execute(text("UPDATE substance SET hazard_mask = :mask WHERE id = :id"),
+                    [{'id': int(i), 'mask': m.tobytes()} for i, m in zip(subst_ids, masks)])
+    return len(links)
+
+
+def _add_missing_columns(engine):
+    """ALTER TABLE ... ADD COLUMN pour les colonnes du modèle absentes d'une table existante"""
+    insp = inspect(engine)
+    with engine.begin() as con:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    con.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"))
+
+
+def migrate(engine):
+    """
+    Met à niveau une base existante : tables et colonnes manquantes, index de toxicite, dimension hazard_code
+    et masques de bits. create_all ne crée ni les colonnes ni les index des tables déjà présentes.
+    """
     Base.metadata.create_all(engine)
-    return engine
\ No newline at end of file
+    _add_missing_columns(engine)
+    for index in Toxicite.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+    with engine.connect() as con:
+        version = con.execute(text("PRAGMA user_version")).scalar()
+    if version < SCHEMA_VERSION:
+        n = sync_hazards(engine)
+        with engine.begin() as con:
+            con.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        print(f"Base migrée vers le schéma v{SCHEMA_VERSION} ({n} liens substance -> danger).")
+    return engine
+
+
+def init_db(db_path='sqlite:///datacreation/phyto_data.db'):
+    engine = create_engine(db_path)
+    return migrate(engine)
+
+
+if __name__ == "__main__":
+    import sys
+    # python models.py [chemin/vers/phyto_data.db]
+    db_file = sys.argv[1] if len(sys.argv) > 1 else 'datacreation/phyto_data.db'
+    init_db(f'sqlite:///{db_file}')
@@ -0,0 +1,245 @@
+"""
+Mode hors mémoire (out-of-core) partagé par les pipelines.
+
+Deux outils, tous deux bornés par un budget mémoire configurable (PHYTO_MEMORY_BUDGET, ex. '2GB') :
+  - DuckDB avec memory_limit + temp_directory : les agrégations qui dépassent le budget débordent
+    sur disque au lieu de faire tomber le worker ;
+  - lecture du CSV en lots d'enregistrements Arrow (taille de bloc dérivée du budget) pour les
+    traitements Python ligne à ligne.
+Les sorties volumineuses s'écrivent de même par lots (TableWriter, CSV ou Parquet).
+
+Démonstration : python outofcore.py --demo [budget]
+génère un CSV synthétique de 10x le budget et l'agrège en mesurant le pic de RSS.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import duckdb
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from cas import cas_map
+from instrumentation import peak_rss, timed
+
+# --- CONFIGURATION ---
+MEMORY_BUDGET = os.environ.get('PHYTO_MEMORY_BUDGET', '4GB')
+SPILL_DIR = os.environ.get('PHYTO_SPILL_DIR', 'datacreation/spill')
+CSV_SEP = ';'
+CSV_ENCODING = 'latin-1'
+THREAD_MEMORY = 256 << 20  # Mémoire par thread DuckDB : le nombre de threads découle du budget
+
+UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30, 'TB': 1 << 40}
+
+
+def parse_size(size):
+    """'512MB' / '2GB' / nombre d'octets -> octets"""
+    if isinstance(size, (int, float)): return int(size)
+    s = str(size).strip().upper().replace('IB', 'B')
+    for unit, mult in UNITS.items():
+        if s.endswith(unit):
+            return int(float(s[:-len(unit)]) * mult)
+    return int(float(s))
+
+
+def duckdb_connect(database=':memory:', budget=MEMORY_BUDGET, spill_dir=SPILL_DIR, read_only=False):
+    """Connexion DuckDB bornée au budget mémoire, avec débordement sur disque dans spill_dir"""
+    os.makedirs(spill_dir, exist_ok=True)
+    limit = parse_size(budget)
+    con = duckdb.connect(database, read_only=read_only, config={
+        'memory_limit': f"{limit * 2 // 5 // (1 << 20)}MB",  # Le reste : allocations hors gestionnaire de tampons
+        'threads': max(1, min(os.cpu_count() or 1, limit // THREAD_MEMORY)),
+        'temp_directory': spill_dir,
+        'preserve_insertion_order': 'false',  # Permet le streaming des gros résultats
+    })
+    con.execute("SET enable_progress_bar = false")
+    return con
+
+
+def block_size(budget=MEMORY_BUDGET):
+    """
+    Taille de bloc de lecture du CSV : 1/256 du budget, entre 256 Ko et 16 Mo.
+    Le lecteur Arrow garde plusieurs dizaines de blocs en vol (lecture anticipée + conversion) : le bloc
+    doit rester petit devant le budget.
+    """
+    return max(256 << 10, min(16 << 20, parse_size(budget) // 256))
+
+
+def iter_csv_batches(csv_path, columns=None, budget=MEMORY_BUDGET, sep=CSV_SEP, encoding=CSV_ENCODING):
+    """
+    Lots d'enregistrements Arrow (colonnes texte) lus en continu depuis le CSV.
+    Le bloc de lecture est dérivé du budget : la mémoire ne dépend pas de la taille du fichier.
+    """
+    block = block_size(budget)
+    header = pacsv.open_csv(csv_path, read_options=pacsv.ReadOptions(encoding=encoding, block_size=1 << 20),
+                            parse_options=pacsv.ParseOptions(delimiter=sep)).schema.names
+    columns = columns or header
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(encoding=encoding, block_size=block),
+        parse_options=pacsv.ParseOptions(delimiter=sep, invalid_row_handler=lambda row: 'skip'),
+        convert_options=pacsv.ConvertOptions(include_columns=columns,
+                                             column_types={c: pa.string() for c in columns}),
+    )
+    for batch in reader:
+        yield batch
+
+
+def iter_csv_chunks(csv_path, columns=None, budget=MEMORY_BUDGET, sep=CSV_SEP, encoding=CSV_ENCODING):
+    """Même lecture en continu, sous forme de DataFrames pandas (colonnes texte)"""
+    for batch in iter_csv_batches(csv_path, columns, budget, sep, encoding):
+        yield batch.to_pandas()
+
+
+class TableWriter:
+    """
+    Écriture incrémentale d'une table, lot par lot : CSV (en-tête au premier lot) ou Parquet zstd selon
+    l'extension. Seul le lot courant est en mémoire ; le fichier n'apparaît sous son nom qu'à la fermeture
+    sans erreur (écriture dans un .tmp puis renommage).
+
+        with TableWriter('sortie.csv') as out:
+            for df in lots: out.write(df)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.parquet = path.endswith('.parquet')
+        self.writer = None
+        self.rows = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write(self, df):
+        if self.parquet:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.tmp, table.schema, compression='zstd')
+            self.writer.write_table(table.cast(self.writer.schema))
+        else:
+            df.to_csv(self.tmp, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None: self.writer.close()
+        if not os.path.exists(self.tmp): return self.rows  # Aucun lot : pas de fichier
+        os.replace(self.tmp, self.path)
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            if self.writer is not None: self.writer.close()
+            if os.path.exists(self.tmp): os.remove(self.tmp)
+
+
+def rows_sql(csv_path, cols, budget=MEMORY_BUDGET):
+    """Lignes normalisées (Annee, CP, CAS, qty) du CSV brut, sans agrégation : lecture en flux continu"""
+    return f"""
+    SELECT
+        CAST(TRY_CAST("{cols['year']}" AS DOUBLE) AS INTEGER) AS Annee,
+        lpad(split_part(replace(trim("{cols['cp']}"), ' ', ''), '.', 1), 5, '0') AS CP,
+        trim("{cols['cas']}") AS CAS,
+        TRY_CAST(replace(replace("{cols['qty']}", ',', '.'), ' ', '') AS DOUBLE) AS qty
+    FROM read_csv('{csv_path}', delim='{CSV_SEP}', header=true, all_varchar=true,
+                  encoding='{CSV_ENCODING}', ignore_errors=true, buffer_size={block_size(budget)})
+    WHERE TRY_CAST(replace(replace("{cols['qty']}", ',', '.'), ' ', '') AS DOUBLE) > 0
+      AND TRY_CAST("{cols['year']}" AS DOUBLE) IS NOT NULL
+    """
+
+
+def register_cas_map(con, source, column='CAS'):
+    """
+    Déclare la vue cas_map (brut, canon, cle) des CAS distincts de la requête `source`, normalisés par cas.py :
+    le travail est fait une fois par CAS brut distinct puis appliqué aux achats par jointure.
+    """
+    brut = con.execute(f'SELECT DISTINCT "{column}" FROM ({source})').df().iloc[:, 0]
+    con.register('cas_map', cas_map(brut))
+    return con
+
+
+def purchases_sql(csv_path, cols, budget=MEMORY_BUDGET):
+    """Requête d'agrégation (Annee, CP, CAS brut, qty) du CSV brut, avec les normalisations habituelles"""
+    return f"SELECT Annee, CP, CAS, SUM(qty) AS qty FROM ({rows_sql(csv_path, cols, budget)}) GROUP BY ALL"
+
+
+@timed('agregation_csv')
+def spill_purchases(csv_path, cols, out_parquet, budget=MEMORY_BUDGET, spill_dir=SPILL_DIR):
+    """
+    Agrège le CSV et écrit le résultat en Parquet trié par (Annee, département, CP, CAS).
+    Les lignes normalisées sont d'abord posées sur disque, puis agrégées une année à la fois :
+    la table de hachage ne dépasse jamais une année de clés (CP, CAS), quelle que soit la taille du fichier.
+    """
+    con = duckdb_connect(budget=budget, spill_dir=spill_dir)
+    rows = os.path.join(spill_dir, f"lignes_{os.getpid()}.parquet")
+    try:
+        con.execute(f"COPY ({rows_sql(csv_path, cols, budget)}) TO '{rows}' (FORMAT parquet)")
+        years = [y for (y,) in con.execute(f"SELECT DISTINCT Annee FROM read_parquet('{rows}') ORDER BY 1").fetchall()]
+
+        register_cas_map(con, f"SELECT CAS FROM read_parquet('{rows}')")  # CAS canoniques (cas.py)
+
+        query = f"""
+        SELECT r.Annee, r.CP, m.canon AS CAS, SUM(r.qty) AS qty, substr(r.CP, 1, 2) AS part
+        FROM read_parquet('{rows}') r JOIN cas_map m ON r.CAS IS NOT DISTINCT FROM m.brut
+        WHERE r.Annee = ?
+        GROUP BY ALL ORDER BY part, CP, CAS
+        """
+        schema = con.execute(query, [None]).to_arrow_reader(1).schema
+        with pq.ParquetWriter(out_parquet, schema, compression='zstd') as writer:
+            for annee in years:
+                for batch in con.execute(query, [annee]).to_arrow_reader(50000):
+                    writer.write_batch(batch)
+    finally:
+        con.close()
+        if os.path.exists(rows): os.remove(rows)
+    return out_parquet
+
+
+def _measure(csv_path, cols, out_parquet, budget, queue):
+    """Exécuté dans un processus neuf : le pic de RSS ne mesure que l'agrégation"""
+    baseline = peak_rss()
+    spill_purchases(csv_path, cols, out_parquet, budget=budget)
+    n_batches = sum(1 for _ in iter_csv_batches(csv_path, budget=budget))
+    queue.put((peak_rss() - baseline, n_batches))
+
+
+def demo(budget='256MB'):
+    """Agrège un CSV synthétique de 10x le budget et vérifie que le pic de RSS reste dans le budget"""
+    import multiprocessing as mp
+    from synthetic import write_bnvd_csv
+    from duckstore import detect_columns
+
+    limit = parse_size(budget)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'bnvd_synthetique.csv')
+        print(f"Génération d'un CSV synthétique de {10 * limit / 1e6:.0f} Mo...")
+        write_bnvd_csv(csv_path, target_bytes=10 * limit)
+        size = os.path.getsize(csv_path)
+        cols = detect_columns(csv_path)
+
+        ctx = mp.get_context('spawn')
+        queue = ctx.Queue()
+        t0 = time.time()
+        proc = ctx.Process(target=_measure, args=(csv_path, cols, os.path.join(tmp, 'achats.parquet'), budget, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            print(f"❌ Échec de l'agrégation (code {proc.exitcode}).")
+            return False
+        used, n_batches = queue.get()
+
+    print(f"Fichier : {size / 1e6:.0f} Mo, {n_batches} lots Arrow, {time.time() - t0:.1f} s")
+    print(f"Mémoire de travail (pic RSS - base) : {used / 1e6:.0f} Mo pour un budget de {limit / 1e6:.0f} Mo")
+    print("✅ Dans le budget." if used <= limit else "❌ Budget dépassé.")
+    return used <= limit
+
+
+if __name__ == "__main__":
+    if '--demo' in sys.argv:
+        args = [a for a in sys.argv[1:] if a != '--demo']
+        sys.exit(0 if demo(*args[:1]) else 1)
@@ -0,0 +1,106 @@
+"""
+Écriture Parquet organisée pour la lecture : tri explicite, groupes de lignes calibrés, zstd, dictionnaires
+et statistiques min/max, partitionnement Hive facultatif.
+
+Les lecteurs (DuckDB, pyarrow, Kepler) sautent alors les groupes de lignes hors filtre grâce aux
+statistiques : une requête sur une année ou un département ne lit que les groupes concernés.
+
+    write_sorted(df, 'sortie.parquet', sort_by=['Annee', 'Dept', 'CodePostal'])
+    write_sorted(df, 'sortie.parquet', sort_by=[...], partition_by=['Annee'])   # dossier Annee=2023/...
+    python parquet_layout.py sortie.parquet                                     # groupes de lignes et bornes
+"""
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# --- CONFIGURATION ---
+ROW_GROUP_ROWS = 64_000  # Assez petit pour filtrer finement, assez grand pour garder la compression efficace
+COMPRESSION = 'zstd'
+COMPRESSION_LEVEL = 6
+
+
+def _remove(path):
+    if os.path.isdir(path): shutil.rmtree(path)
+    elif os.path.exists(path): os.remove(path)
+
+
+def _dictionary_columns(schema):
+    """Colonnes texte : codes, noms de commune et CAS se répètent, le dictionnaire les stocke une fois"""
+    return [f.name for f in schema if pa.types.is_string(f.type) or pa.types.is_large_string(f.type)]
+
+
+def write_sorted(df, path, sort_by, partition_by=None, row_group_size=ROW_GROUP_ROWS,
+                 compression=COMPRESSION, compression_level=COMPRESSION_LEVEL):
+    """
+    Écrit `df` trié sur `sort_by` ; avec `partition_by`, un dossier Hive (col=valeur/part-0.parquet) au lieu
+    d'un fichier. Écriture dans un chemin temporaire puis renommage : un lecteur ne voit jamais un fichier partiel.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False) if isinstance(df, pd.DataFrame) else df
+    table = table.sort_by([(c, 'ascending') for c in sort_by])
+    tmp = f"{path}.tmp"
+    _remove(tmp)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    partition_by = list(partition_by or [])
+    # Colonnes présentes dans les fichiers (celles de partition sont dans les noms de dossiers)
+    stored = [c for c in table.column_names if c not in partition_by]
+    sorting = [pq.SortingColumn(stored.index(c)) for c in sort_by if c in stored] or None
+    dictionary = [c for c in _dictionary_columns(table.schema) if c in stored]
+
+    if partition_by:
+        fmt = ds.ParquetFileFormat()
+        options = fmt.make_write_options(compression=compression, compression_level=compression_level,
+                                         use_dictionary=dictionary, write_statistics=True, sorting_columns=sorting)
+        ds.write_dataset(table, tmp, format=fmt, file_options=options, partitioning=partition_by,
+                         partitioning_flavor='hive', basename_template='part-{i}.parquet',
+                         max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 1024),
+                         preserve_order=True)
+    else:
+        pq.write_table(table, tmp, row_group_size=row_group_size, compression=compression,
+                       compression_level=compression_level, use_dictionary=dictionary,
+                       write_statistics=True, sorting_columns=sorting)
+    _remove(path)
+    os.replace(tmp, path)
+    return path
+
+
+def layout(path):
+    """Un enregistrement par (fichier, groupe de lignes, colonne) : lignes, taille compressée, bornes min/max"""
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(d, f) for d, _, names in os.walk(path) for f in names if f.endswith('.parquet'))
+    rows = []
+    for file in files:
+        meta = pq.ParquetFile(file).metadata
+        for g in range(meta.num_row_groups):
+            rg = meta.row_group(g)
+            for c in range(rg.num_columns):
+                col = rg.column(c)
+                stats = col.statistics if col.is_stats_set else None
+                rows.append({'Fichier': os.path.relpath(file, path) if file != path else os.path.basename(file),
+                             'Groupe': g, 'Colonne': col.path_in_schema, 'Lignes': rg.num_rows,
+                             'Octets': col.total_compressed_size, 'Compression': col.compression,
+                             'Dictionnaire': 'PLAIN_DICTIONARY' in col.encodings or 'RLE_DICTIONARY' in col.encodings,
+                             'Min': stats.min if stats is not None and stats.has_min_max else None,
+                             'Max': stats.max if stats is not None and stats.has_min_max else None})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    # python parquet_layout.py fichier.parquet|dossier [colonne ...] : groupes de lignes et bornes des colonnes
+    if len(sys.argv) < 2:
+        print("Usage : python parquet_layout.py fichier.parquet [colonne ...]")
+        sys.exit(1)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Erreur : {sys.argv[1]} introuvable.")
+        sys.exit(1)
+    df = layout(sys.argv[1])
+    if len(sys.argv) > 2:
+        df = df[df['Colonne'].isin(sys.argv[2:])]
+    pd.set_option('display.width', 200)
+    print(df.to_string(index=False))
+    print(f"\n{df.groupby(['Fichier', 'Groupe']).ngroups} groupes de lignes, {df['Octets'].sum() / 1e6:.2f} Mo compressés")
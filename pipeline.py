@@ -0,0 +1,273 @@
+"""
+Exécution de la chaîne de traitement complète, étape par étape, sans recalcul inutile.
+
+Chaque étape est un script existant (lancé dans son propre processus, avec son rapport d'exécution) qui
+déclare ses fichiers d'entrée et de sortie ; les dépendances entre étapes s'en déduisent (une sortie de A
+lue par B => B après A). La clé d'une étape est une empreinte SHA-256 du contenu de ses entrées et du code
+de son script et des modules locaux qu'il importe : une étape n'est relancée que si sa clé a changé depuis
+sa dernière exécution réussie, ou si une de ses sorties manque. Les étapes indépendantes tournent en parallèle.
+Une étape échoue si son script sort avec un code non nul ou si une de ses sorties manque après l'exécution.
+
+    python pipeline.py                      # toutes les étapes périmées
+    python pipeline.py export geometry      # ces étapes (et leurs amonts périmés)
+    python pipeline.py --dry-run            # ce qui serait relancé, sans rien exécuter
+    python pipeline.py --force aggregate    # relance même à jour
+"""
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# --- CONFIGURATION ---
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = 'datacreation/pipeline_state.json'  # Clés des dernières exécutions réussies + cache des empreintes
+LOG_DIR = 'datacreation/rapports/pipeline'  # Sortie console de chaque étape
+JOBS = 2
+BLOCK = 1 << 20
+
+
+class Stage:
+    """Étape : script lancé tel quel, fichiers (ou dossiers) lus et écrits"""
+
+    def __init__(self, name, script, inputs, outputs, args=()):
+        self.name, self.script, self.args = name, script, list(args)
+        # Chemins relatifs à la racine : la clé ne dépend pas de l'emplacement du dépôt
+        self.inputs = [os.path.relpath(p, ROOT) if os.path.isabs(p) else p for p in inputs]
+        self.outputs = [os.path.relpath(p, ROOT) if os.path.isabs(p) else p for p in outputs]
+        self.deps = set()
+
+    def __repr__(self):
+        return f"Stage({self.name})"
+
+
+def declare_stages():
+    """Étapes de la chaîne, avec les chemins déclarés par les scripts eux-mêmes"""
+    import add_geometry
+    import aggregates
+    import big_one
+    import carto_api_hubeau
+    import export
+    import hazard_cube
+    import main
+    import optimizedone
+    from apportionment import SAU_FILE
+    from substances import DB_FILE
+
+    tables = [os.path.join(aggregates.AGG_DIR, f"{t}.parquet") for t in aggregates.TABLES]
+    rankings = os.path.join(aggregates.AGG_DIR, aggregates.RANKINGS_FILE)
+    stages = [
+        Stage('enrich', 'main.py', [main.INPUT_PATH, main.EFSA_CHAR_PATH, main.EFSA_REF_PATH, main.CLP_PATH,
+                                    main.PUBCHEM_GHS_DIR], [DB_FILE]),
+        Stage('ingest', 'optimizedone.py', [optimizedone.INPUT_CSV, DB_FILE], [optimizedone.OUTPUT_FILE]),
+        Stage('aggregate', 'aggregates.py', [aggregates.INPUT_CSV, SAU_FILE], tables + [rankings]),
+        Stage('cube', 'hazard_cube.py', tables + [DB_FILE],
+              [hazard_cube.cube_path(level) for level in hazard_cube.GEO_LEVELS]),
+        Stage('trends', 'trends.py', tables,
+              [os.path.join(aggregates.AGG_DIR, f) for f in ('tendances.parquet', 'tendances_resume.parquet')]),
+        Stage('geolocate', 'big_one.py', [big_one.INPUT_CSV, DB_FILE], [big_one.OUTPUT_CSV]),
+        Stage('riskmap', 'carto_api_hubeau.py', [carto_api_hubeau.INPUT_CSV, DB_FILE], [carto_api_hubeau.OUTPUT_CSV]),
+        Stage('geometry', 'add_geometry.py', [add_geometry.INPUT_DATA], [add_geometry.OUTPUT_FILE]),
+        Stage('export', 'export.py', [DB_FILE], [export.OUTPUT_FILE]),
+    ]
+    link(stages)
+    return {s.name: s for s in stages}
+
+
+def link(stages):
+    """Dépendances déduites des chemins : B dépend de A si B lit une sortie de A"""
+    producers = {os.path.normpath(p): s.name for s in stages for p in s.outputs}
+    for s in stages:
+        s.deps = {producers[p] for p in map(os.path.normpath, s.inputs) if p in producers} - {s.name}
+    order, seen = [], set()
+
+    def visit(name, path=()):
+        if name in path: raise ValueError(f"Cycle dans la chaîne : {' -> '.join(path + (name,))}")
+        if name in seen: return
+        for d in sorted(by_name[name].deps): visit(d, path + (name,))
+        seen.add(name)
+        order.append(name)
+
+    by_name = {s.name: s for s in stages}
+    for s in stages: visit(s.name)
+    return order
+
+
+# --- EMPREINTES ---
+
+class Hasher:
+    """Empreintes de contenu, mises en cache par (taille, date de modification) : un fichier inchangé n'est pas relu"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def file(self, path):
+        st = os.stat(path)
+        sig = [st.st_size, st.st_mtime_ns]
+        hit = self.cache.get(path)
+        if hit and hit[:2] == sig: return hit[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK), b''):
+                h.update(block)
+        self.cache[path] = sig + [h.hexdigest()]
+        return h.hexdigest()
+
+    def path(self, path):
+        """Fichier, dossier (tous ses fichiers) ou chemin absent"""
+        if os.path.isdir(path):
+            files = sorted(f for f in glob.glob(os.path.join(path, '**', '*'), recursive=True) if os.path.isfile(f))
+            return hashlib.sha256(''.join(f"{os.path.relpath(f, path)}:{self.file(f)};" for f in files).encode()).hexdigest()
+        return self.file(path) if os.path.exists(path) else 'absent'
+
+
+def code_files(script, root=ROOT):
+    """Le script et les modules locaux qu'il importe, transitivement (analyse des import, sans exécution)"""
+    todo, found = [os.path.join(root, script)], set()
+    while todo:
+        path = todo.pop()
+        if path in found or not os.path.exists(path): continue
+        found.add(path)
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            names = [a.name for a in node.names] if isinstance(node, ast.Import) else \
+                [node.module] if isinstance(node, ast.ImportFrom) and node.module and not node.level else []
+            for name in names:
+                base = os.path.join(root, *name.split('.'))
+                todo += [p for p in (base + '.py', os.path.join(base, '__init__.py')) if os.path.exists(p)]
+    return sorted(found)
+
+
+def stage_key(stage, hasher):
+    h = hashlib.sha256()
+    for path in code_files(stage.script):
+        h.update(f"code {os.path.relpath(path, ROOT)} {hasher.file(path)}\n".encode())
+    for path in stage.inputs:
+        h.update(f"in {path} {hasher.path(path)}\n".encode())
+    h.update(f"args {stage.args}\n".encode())
+    return h.hexdigest()
+
+
+# --- EXÉCUTION ---
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path): return {'stages': {}, 'hashes': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def with_upstream(stages, names):
+    """Étapes demandées et toutes leurs étapes amont"""
+    out, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in out:
+            out.add(name)
+            todo += stages[name].deps
+    return out
+
+
+def is_fresh(stage, key, state):
+    return state['stages'].get(stage.name) == key and all(os.path.exists(p) for p in stage.outputs)
+
+
+def run_stage(stage, log_dir=LOG_DIR):
+    """Lance le script de l'étape ; sa sortie console va dans LOG_DIR/<étape>.log"""
+    os.makedirs(log_dir, exist_ok=True)
+    t0 = time.time()
+    with open(os.path.join(log_dir, f"{stage.name}.log"), 'w', encoding='utf-8') as log:
+        rc = subprocess.run([sys.executable, stage.script] + stage.args, cwd=ROOT, stdout=log,
+                            stderr=subprocess.STDOUT).returncode
+    return rc, time.time() - t0
+
+
+def run(names=None, force=False, dry_run=False, jobs=JOBS):
+    stages = declare_stages()
+    selected = with_upstream(stages, names or list(stages))
+    order = [n for n in link(list(stages.values())) if n in selected]
+    state = load_state()
+    hasher = Hasher(state['hashes'])
+    print(f"--- PIPELINE : {len(order)} étapes ({', '.join(order)}) ---")
+
+    if dry_run:
+        stale = set()
+        for name in order:
+            s = stages[name]
+            if force or s.deps & stale or not is_fresh(s, stage_key(s, hasher), state):
+                stale.add(name)
+            print(f" {'à relancer' if name in stale else 'à jour    '}  {name}")
+        save_state(state)  # Empreintes calculées : gardées en cache
+        return stale
+
+    done, failed, keys, running = set(), set(), {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while len(done) + len(failed) < len(order):
+            for name in order:
+                s = stages[name]
+                if name in done or name in failed or name in running.values(): continue
+                if s.deps & failed:
+                    failed.add(name)
+                    print(f" ⏭️  {name} : amont en échec")
+                    continue
+                if not s.deps <= (done | (set(stages) - selected)): continue
+                # Clé calculée quand les amonts sont terminés : leurs sorties font partie des entrées
+                keys[name] = stage_key(s, hasher)
+                if not force and is_fresh(s, keys[name], state):
+                    done.add(name)
+                    print(f" ✔️  {name} : à jour")
+                    continue
+                print(f" ▶️  {name} ({s.script})...")
+                running[pool.submit(run_stage, s)] = name
+
+            if not running: continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                rc, dt = future.result()
+                # Code 0 mais sortie absente : le script s'est arrêté sans produire (échec non signalé)
+                missing = [p for p in stages[name].outputs if not os.path.exists(p)] if rc == 0 else []
+                if rc == 0 and not missing:
+                    done.add(name)
+                    state['stages'][name] = keys[name]
+                    print(f" ✅ {name} : {dt:.1f} s")
+                else:
+                    failed.add(name)
+                    why = f"sorties absentes : {', '.join(missing)}" if missing else f"code {rc}"
+                    print(f" ❌ {name} : {why} (voir {os.path.join(LOG_DIR, name + '.log')})")
+                save_state(state)
+    save_state(state)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chaîne de traitement avec reprise sur empreintes")
+    parser.add_argument('stages', nargs='*', help="Étapes à mettre à jour (défaut : toutes)")
+    parser.add_argument('--force', action='store_true', help="Relance les étapes même à jour")
+    parser.add_argument('--dry-run', action='store_true', help="Affiche les étapes périmées sans les lancer")
+    parser.add_argument('--jobs', type=int, default=JOBS, help="Étapes lancées en parallèle")
+    parser.add_argument('--list', action='store_true', help="Liste les étapes, leurs entrées et sorties")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    if args.list:
+        for s in declare_stages().values():
+            print(f"{s.name} ({s.script}) <- {', '.join(sorted(s.deps)) or '-'}")
+            print(f"    entrées : {', '.join(s.inputs)}\n    sorties : {', '.join(s.outputs)}")
+        sys.exit(0)
+    unknown = set(args.stages) - set(declare_stages())
+    if unknown:
+        parser.error(f"étapes inconnues : {', '.join(sorted(unknown))}")
+    sys.exit(1 if run(args.stages, args.force, args.dry_run, args.jobs) and not args.dry_run else 0)
@@ -0,0 +1,129 @@
+"""
+Moteur de scores de risque à profils de pondération multiples.
+
+Un profil associe un poids à des codes de danger GHS :
+    poids            : {code H: poids}
+    defaut_code      : poids d'un code GHS absent de la table
+    defaut_substance : poids d'une substance sans aucun code GHS connu (ou absente de la base)
+    codes_combines   : 'tous' (défaut) ou 'premier' : pour une mention combinée ("H300+H310"),
+                       seul le premier code compte (règle historique des profils severite et kepler)
+Le poids d'une substance est le maximum des poids de ses codes. Tous les profils sont
+évalués en même temps : une colonne de poids par profil, une colonne de score par profil,
+et une seule lecture des achats quel que soit le nombre de profils.
+
+Des profils personnalisés peuvent être déclarés en YAML (même structure, un bloc par profil) :
+    mon_profil:
+      poids: {H350: 100, H360: 100, H410: 3}
+      defaut_code: 0
+      defaut_substance: 0
+Les noms de profils (repris dans les colonnes Score_<profil> et le SQL) sont limités à [A-Za-z0-9_].
+"""
+import os
+import re
+
+import pandas as pd
+
+from cas import INVALID, align_on_cas, cas_key
+from substances import SEVERITE_MAP
+
+# --- CONFIGURATION ---
+PROFILES_FILE = 'profils_risque.yaml'
+PROFILE_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+COMBINED_RULES = ('tous', 'premier')
+
+CMR = {
+    'H340': 100, 'H350': 100, 'H360': 100, 'H360D': 100, 'H360F': 100, 'H360FD': 100,
+    'H341': 30, 'H351': 30, 'H361': 30, 'H361d': 30, 'H361f': 30, 'H361fd': 30,
+}
+
+PROFILES = {
+    # Table historique de carto_api_hubeau.py (substance inconnue = 0)
+    'severite': {'poids': SEVERITE_MAP, 'defaut_code': 1, 'defaut_substance': 0, 'codes_combines': 'premier'},
+    # Table historique de optimizedone.py (substance inconnue = 1)
+    'kepler': {
+        'poids': {'H300': 100, 'H310': 100, 'H330': 100, 'H350': 50, 'H340': 50, 'H360': 50, 'H410': 5},
+        'defaut_code': 1, 'defaut_substance': 1, 'codes_combines': 'premier',
+    },
+    'cmr': {'poids': CMR, 'defaut_code': 0, 'defaut_substance': 0},
+    'aigu': {
+        'poids': {'H300': 100, 'H310': 100, 'H330': 100, 'H301': 10, 'H311': 10, 'H331': 10,
+                  'H302': 1, 'H312': 1, 'H332': 1},
+        'defaut_code': 0, 'defaut_substance': 0,
+    },
+    'ecotox': {
+        'poids': {'H400': 10, 'H410': 10, 'H411': 5, 'H412': 2, 'H413': 1},
+        'defaut_code': 0, 'defaut_substance': 0,
+    },
+}
+
+
+def load_profiles(path=PROFILES_FILE, names=None):
+    """
+    Profils intégrés + profils YAML éventuels (qui peuvent les remplacer), filtrés sur `names`.
+    Noms et valeurs sont validés ici : ils finissent dans des noms de colonnes et dans le SQL (sql_score_columns).
+    """
+    profiles = dict(PROFILES)
+    if path and os.path.exists(path):
+        import yaml
+        with open(path, encoding='utf-8') as f:
+            for name, spec in (yaml.safe_load(f) or {}).items():
+                spec = spec or {}
+                try:
+                    profiles[name] = {
+                        'poids': {str(k): float(v) for k, v in (spec.get('poids') or {}).items()},
+                        'defaut_code': float(spec.get('defaut_code', 0)),
+                        'defaut_substance': float(spec.get('defaut_substance', 0)),
+                        'codes_combines': spec.get('codes_combines', 'tous'),
+                    }
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"{path} : profil '{name}', poids non numérique ({e})")
+    for name, p in profiles.items():
+        if not PROFILE_NAME.match(str(name)):
+            raise ValueError(f"Nom de profil invalide : {name!r} (lettres, chiffres et _ uniquement)")
+        if p.get('codes_combines', 'tous') not in COMBINED_RULES:
+            raise ValueError(f"Profil '{name}' : codes_combines doit valoir {' ou '.join(COMBINED_RULES)}")
+    if names:
+        unknown = [n for n in names if n not in profiles]
+        if unknown:
+            raise ValueError(f"Profils inconnus : {', '.join(unknown)} (disponibles : {', '.join(profiles)})")
+        profiles = {n: profiles[n] for n in names}
+    return profiles
+
+
+def weight_table(ghs, profiles):
+    """
+    Poids par substance et par profil : DataFrame indexé par clé CAS entière (CAS_Key, cf. cas.py),
+    une colonne par profil. `ghs` est la table longue (CAS, Code, Premier) de substances.load_ghs_codes ;
+    les profils 'premier' ignorent les codes qui ne sont jamais en tête d'une mention combinée.
+    """
+    if 'Premier' not in ghs:
+        ghs = ghs.assign(Premier=True)
+    codes = ghs.groupby(['CAS', 'Code'], as_index=False)['Premier'].any()
+    weights = pd.DataFrame({
+        name: codes['Code'].map(p['poids']).fillna(p['defaut_code']).astype(float)
+              .where(codes['Premier'] | (p.get('codes_combines', 'tous') == 'tous'))
+        for name, p in profiles.items()
+    })
+    weights['CAS_Key'] = cas_key(codes['CAS']).to_numpy()
+    return weights[weights['CAS_Key'] != INVALID].groupby('CAS_Key').max()
+
+
+def substance_defaults(profiles):
+    """{profil: poids d'une substance absente de la table de poids}"""
+    return {name: float(p['defaut_substance']) for name, p in profiles.items()}
+
+
+def score_columns(df, qty_col, cas_col, weights, defaults):
+    """Ajoute une colonne Score_<profil> (quantité x poids) par profil, en une seule jointure sur les clés CAS"""
+    w = align_on_cas(df[cas_col], weights)
+    for name, default in defaults.items():
+        df[f"Score_{name}"] = df[qty_col] * w[name].fillna(default).values
+    return df
+
+
+def sql_score_columns(profiles, qty='a.qty', alias='w'):
+    """Expressions SQL SUM(...) d'un score par profil, pour une table de poids jointe sous `alias`"""
+    return ",\n        ".join(
+        f'SUM({qty} * COALESCE({alias}."{name}", {float(p["defaut_substance"])})) AS "Score_{name}"'
+        for name, p in profiles.items()
+    )
@@ -0,0 +1,103 @@
+"""
+Résumés probabilistes en mémoire constante, mis à jour par lots NumPy.
+
+  - HyperLogLog : nombre approximatif de valeurs distinctes (2^p registres d'un octet, erreur ~1.04/sqrt(2^p)) ;
+  - TDigest : quantiles approximatifs (au plus ~delta centroïdes, précis aux extrémités de la distribution).
+
+Les deux se fusionnent (merge) : un résumé par fichier ou par processus peut être combiné ensuite.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _bit_length(x):
+    """Nombre de bits significatifs de chaque entier non signé (exact, sans passer par les flottants)"""
+    x = x.copy()
+    n = np.zeros(len(x), dtype=np.uint8)
+    for s in (32, 16, 8, 4, 2, 1):
+        m = x >= (np.uint64(1) << np.uint64(s))
+        n[m] += s
+        x[m] >>= np.uint64(s)
+    return n + (x > 0)
+
+
+class HyperLogLog:
+    """Estimateur du nombre de valeurs distinctes"""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add(self, values):
+        """Ajoute un lot de valeurs (tableau ou Series, les valeurs nulles sont ignorées)"""
+        values = pd.Series(values).dropna()
+        if values.empty: return
+        h = pd.util.hash_array(values.astype(str).values)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest).astype(np.int64) + 1  # Position du premier bit à 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(float)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # Petites cardinalités : comptage linéaire
+        return int(round(estimate))
+
+
+class TDigest:
+    """Quantiles approximatifs par centroïdes (t-digest à fusion, fonction d'échelle arcsinus)"""
+
+    def __init__(self, delta=200):
+        self.delta = delta
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min, self.max = np.inf, -np.inf
+
+    def add(self, values):
+        """Ajoute un lot de valeurs numériques (NaN ignorés) puis recompresse les centroïdes"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values): return
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other):
+        if len(other.means):
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]),
+                           np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _compress(self, means, weights):
+        # Regroupe les points consécutifs tombant dans la même unité de l'échelle k(q) = delta * asin(2q - 1) / pi :
+        # petits centroïdes aux extrémités, gros au centre
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cum = np.cumsum(weights)
+        q = (cum - weights / 2) / cum[-1]
+        bucket = np.floor(self.delta * (np.arcsin(2 * q - 1) / np.pi + 0.5)).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def quantile(self, q):
+        """Quantile(s) approximatif(s), interpolé(s) entre les centres des centroïdes"""
+        if not len(self.means): return np.nan
+        cum = np.cumsum(self.weights)
+        centers = (cum - self.weights / 2) / cum[-1]
+        xp = np.r_[0.0, centers, 1.0]
+        fp = np.r_[self.min, self.means, self.max]
+        return np.interp(q, xp, fp)
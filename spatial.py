@@ -0,0 +1,160 @@
+"""
+Index spatial des communes et départements (STRtree shapely 2).
+
+Les polygones sont indexés une fois ; les requêtes sont vectorisées sur des tableaux de points :
+    idx = SpatialIndex.from_features(geo_communes['features'])
+    insee = idx.locate(lon, lat)          # un code par point, None hors de toute commune
+    codes = idx.in_bbox(2.2, 48.8, 2.5, 48.9)
+
+Les géométries sont sauvegardées en WKB (Parquet) : recharger l'index évite de reconvertir les GeoJSON,
+l'arbre lui-même se reconstruit en quelques millisecondes. Une clé (version du format + empreinte des
+référentiels) est écrite à côté : l'index est reconstruit quand les référentiels ou le format changent.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+# --- CONFIGURATION ---
+INDEX_DIR = 'datacreation/index_spatial'
+LEVELS = ('communes', 'departements')
+INDEX_VERSION = 1  # À incrémenter quand le format des fichiers d'index change
+KEY_FILE = 'cle.json'
+
+
+class SpatialIndex:
+    """Polygones identifiés par un code (INSEE ou département), interrogés par lots de points ou de rectangles"""
+
+    def __init__(self, codes, geometries):
+        self.codes = np.asarray(codes, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)  # Accélère les prédicats répétés sur les mêmes polygones
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_features(cls, features, code_field='code'):
+        """Index des features GeoJSON (sans géométrie : ignorées)"""
+        features = [f for f in features if f.get('geometry')]
+        geoms = np.array([shape(f['geometry']) for f in features], dtype=object)
+        return cls([f['properties'][code_field] for f in features], geoms)
+
+    @classmethod
+    def from_geo_references(cls, dept_index, commune_index):
+        """{'communes': index, 'departements': index} depuis aggregates.load_geo_references"""
+        return {
+            'communes': cls.from_features([c['geom'] for c in commune_index.values() if c.get('geom')]),
+            'departements': cls.from_features(list(dept_index.values())),
+        }
+
+    def locate(self, lon, lat):
+        """Code du polygone contenant chaque point (None si aucun) ; un point sur une frontière prend le premier"""
+        x, y = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        # Candidats par emprise (arbre), puis test exact vectorisé sur les polygones préparés
+        pts, polys = self.tree.query(shapely.points(x, y))
+        inside = shapely.intersects_xy(self.geometries[polys], x[pts], y[pts])
+        pts, polys = pts[inside], polys[inside]
+        out = np.full(len(x), None, dtype=object)
+        first = np.unique(pts, return_index=True)[1]
+        out[pts[first]] = self.codes[polys[first]]
+        return out
+
+    def in_bbox(self, minx, miny, maxx, maxy):
+        """Codes des polygones qui touchent le rectangle"""
+        hits = self.tree.query(shapely.box(minx, miny, maxx, maxy), predicate='intersects')
+        return self.codes[np.sort(hits)]
+
+    def in_bboxes(self, boxes):
+        """Codes touchés par chaque rectangle d'un tableau (n, 4) : table longue (Rectangle, Code)"""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        rect, polys = self.tree.query(shapely.box(*boxes.T), predicate='intersects')
+        return pd.DataFrame({'Rectangle': rect, 'Code': self.codes[polys]})
+
+    def bounds(self, codes=None):
+        """Emprise (minx, miny, maxx, maxy) de l'ensemble des polygones, ou des codes demandés"""
+        geoms = self.geometries if codes is None else self.geometries[np.isin(self.codes, list(codes))]
+        b = shapely.bounds(geoms)
+        return b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max()
+
+    def centroids(self):
+        """Centroïde de chaque polygone : DataFrame (Code, Lon, Lat)"""
+        c = shapely.centroid(self.geometries)
+        return pd.DataFrame({'Code': self.codes, 'Lon': shapely.get_x(c), 'Lat': shapely.get_y(c)})
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pd.DataFrame({'code': self.codes, 'wkb': shapely.to_wkb(self.geometries)}).to_parquet(path, index=False)
+
+    @classmethod
+    def load(cls, path):
+        df = pd.read_parquet(path)
+        return cls(df['code'].to_numpy(dtype=object), shapely.from_wkb(df['wkb'].to_numpy()))
+
+
+def index_path(level, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f"{level}.parquet")
+
+
+def reference_key(dept_index, commune_index):
+    """Empreinte des polygones indexés (codes et géométries GeoJSON) et de la version du format"""
+    h = hashlib.sha256(f"version {INDEX_VERSION};".encode())
+    levels = {'communes': [c['geom'] for c in commune_index.values() if c.get('geom')],
+              'departements': list(dept_index.values())}
+    for level in LEVELS:
+        features = [f for f in levels[level] if f.get('geometry')]  # Mêmes features que from_features
+        for f in sorted(features, key=lambda f: f['properties']['code']):
+            h.update(json.dumps([level, f['properties']['code'], f['geometry']], sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def load_indexes(index_dir=INDEX_DIR, geo_references=None):
+    """
+    Index communes et départements : relus du disque si leur clé correspond aux référentiels géo
+    (geo_references = (dept_index, commune_index), téléchargés sinon), reconstruits et sauvegardés dans le cas contraire.
+    """
+    if geo_references is None:
+        from aggregates import load_geo_references
+        geo_references = load_geo_references()[:2]
+    dept_index, commune_index = geo_references
+    key = {'version': INDEX_VERSION, 'referentiels': reference_key(dept_index, commune_index)}
+
+    key_path = os.path.join(index_dir, KEY_FILE)
+    saved = None
+    if os.path.exists(key_path):
+        with open(key_path, encoding='utf-8') as f:
+            saved = json.load(f)
+    if saved == key and all(os.path.exists(index_path(level, index_dir)) for level in LEVELS):
+        return {level: SpatialIndex.load(index_path(level, index_dir)) for level in LEVELS}
+
+    indexes = SpatialIndex.from_geo_references(dept_index, commune_index)
+    for level, idx in indexes.items():
+        idx.save(index_path(level, index_dir))
+    with open(key_path, 'w', encoding='utf-8') as f:  # Écrite en dernier : un index incomplet sera reconstruit
+        json.dump(key, f, indent=1)
+    return indexes
+
+
+def locate_points(df, indexes, lon_col='Lon', lat_col='Lat'):
+    """Ajoute INSEE et Dept (None hors du territoire) à une table de points"""
+    lon, lat = df[lon_col].to_numpy(dtype=float), df[lat_col].to_numpy(dtype=float)
+    return df.assign(INSEE=indexes['communes'].locate(lon, lat), Dept=indexes['departements'].locate(lon, lat))
+
+
+if __name__ == "__main__":
+    import sys
+    # python spatial.py points.csv [sortie.csv] : rattache des points (colonnes Lat / Lon) aux communes
+    if len(sys.argv) < 2:
+        print("Usage : python spatial.py points.csv [sortie.csv]")
+        sys.exit(1)
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else source.replace('.csv', '_communes.csv')
+    points = pd.read_csv(source)
+    located = locate_points(points, load_indexes())
+    located.to_csv(output, index=False)
+    print(f"✅ {located['INSEE'].notna().sum()} / {len(located)} points rattachés à une commune -> {output}")
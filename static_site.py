@@ -0,0 +1,273 @@
+"""
+Export d'un site statique (carte nationale + table des 5000 premières communes) à partir des agrégats.
+
+Aucun serveur Python n'est nécessaire pour le consulter : le rendu, le filtrage et le tri sont faits
+dans le navigateur. La couche nationale (départements + table) est embarquée dans index.html ;
+les communes d'un département sont des fichiers binaires chargés à la demande (dept/XX.bin),
+ce qui suppose un hébergement HTTP (CDN, `python -m http.server`, ...).
+
+Format binaire d'une couche (little-endian) :
+    en-tête  : 'PHY1', n_entites u32, n_points u32, n_anneaux u32, bbox 4 x f64   (48 octets)
+    volumes  : f32[n_entites]
+    anneaux  : u32[n_entites]   (nombre d'anneaux par entité)
+    longueurs: u32[n_anneaux]   (nombre de points par anneau)
+    points   : u16[2 * n_points] (x, y quantifiés sur la bbox de la couche)
+"""
+import base64
+import json
+import os
+import struct
+
+import numpy as np
+
+from aggregates import load_aggregates, load_geo_references
+
+# --- CONFIGURATION ---
+OUTPUT_DIR = 'datacreation/site'
+TOP_COMMUNES = 5000
+QUANT = 65535  # Grille de quantification (u16)
+
+
+def _rings(geometry):
+    """Liste à plat des anneaux (extérieurs et trous) d'un Polygon / MultiPolygon"""
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for poly in geometry['coordinates'] for ring in poly]
+    return []
+
+
+def pack_layer(geometries, volumes):
+    """Encode une couche (géométries quantifiées + volumes) dans le format binaire décrit plus haut"""
+    ring_counts, ring_lengths, coords = [], [], []
+    for geometry in geometries:
+        rings = _rings(geometry)
+        ring_counts.append(len(rings))
+        for ring in rings:
+            ring_lengths.append(len(ring))
+            coords.append(np.asarray(ring, dtype=np.float64)[:, :2])
+
+    xy = np.concatenate(coords) if coords else np.zeros((0, 2))
+    lo = xy.min(axis=0) if len(xy) else np.zeros(2)
+    hi = xy.max(axis=0) if len(xy) else np.ones(2)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    q = np.round((xy - lo) / span * QUANT).astype('<u2')
+
+    header = struct.pack('<4sIII4d', b'PHY1', len(ring_counts), len(xy), len(ring_lengths), lo[0], lo[1], hi[0], hi[1])
+    return b''.join([
+        header,
+        np.asarray(volumes, dtype='<f4').tobytes(),
+        np.asarray(ring_counts, dtype='<u4').tobytes(),
+        np.asarray(ring_lengths, dtype='<u4').tobytes(),
+        q.tobytes(),
+    ])
+
+
+def _js_literal(obj):
+    """JSON inséré dans un bloc <script> : '</' échappé pour qu'un nom ne puisse pas fermer le bloc"""
+    return json.dumps(obj, ensure_ascii=False).replace('</', '<\\/')
+
+
+def export_site(output_dir=OUTPUT_DIR, annee=None):
+    """Écrit index.html (couche nationale embarquée) et un couple dept/XX.bin + dept/XX.json par département"""
+    tables = load_aggregates()
+    dept_index, commune_index, _ = load_geo_references()
+
+    df_depts, df_communes = tables['departements'], tables['communes']
+    annee = int(annee or df_depts['Annee'].max())
+    df_depts = df_depts[df_depts['Annee'] == annee]
+    df_communes = df_communes[df_communes['Annee'] == annee]
+
+    os.makedirs(os.path.join(output_dir, 'dept'), exist_ok=True)
+
+    # 1. Couche nationale (départements)
+    vol_dept = df_depts.set_index('Dept')['Volume']
+    codes = sorted(c for c in dept_index if dept_index[c].get('geometry'))
+    national_bin = pack_layer([dept_index[c]['geometry'] for c in codes], vol_dept.reindex(codes).fillna(0).values)
+    national_meta = {
+        'annee': annee,
+        'codes': codes,
+        'noms': [dept_index[c]['properties']['nom'] for c in codes],
+    }
+
+    # 2. Couches départementales (communes), chargées à la demande
+    for dept, grp in df_communes.groupby('Dept'):
+        grp = grp[grp['INSEE'].isin(commune_index.keys())]
+        if grp.empty: continue
+        geoms = [commune_index[i]['geom']['geometry'] for i in grp['INSEE']]
+        with open(os.path.join(output_dir, 'dept', f"{dept}.bin"), 'wb') as f:
+            f.write(pack_layer(geoms, grp['Volume'].values))
+        with open(os.path.join(output_dir, 'dept', f"{dept}.json"), 'w', encoding='utf-8') as f:
+            json.dump({'insee': grp['INSEE'].tolist(), 'noms': grp['Commune'].tolist()}, f, ensure_ascii=False)
+
+    # 3. Table des communes (top N), filtrée / triée côté client
+    top = df_communes.nlargest(TOP_COMMUNES, 'Volume')[['INSEE', 'Commune', 'Dept', 'Volume']]
+    top = top.assign(Volume=top['Volume'].round(1))
+
+    html = HTML_TEMPLATE.replace('__ANNEE__', str(annee))
+    html = html.replace('__NATIONAL_BIN__', base64.b64encode(national_bin).decode('ascii'))
+    html = html.replace('__NATIONAL_META__', _js_literal(national_meta))
+    html = html.replace('__TABLE__', _js_literal(top.values.tolist()))
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    print(f"✅ Site statique écrit dans {output_dir} ({len(codes)} départements, {len(top)} communes en table).")
+
+
+HTML_TEMPLATE = r"""<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Observatoire National des Pesticides __ANNEE__</title>
+<style>
+  body { font-family: sans-serif; margin: 0; display: flex; height: 100vh; }
+  #carte { flex: 2; position: relative; }
+  #carte svg { width: 100%; height: 100%; }
+  #carte path { stroke: #fff; stroke-width: 0.3; vector-effect: non-scaling-stroke; fill-rule: evenodd; cursor: pointer; }
+  #carte path:hover { stroke: #000; }
+  #panneau { flex: 1; overflow: auto; padding: 10px; border-left: 1px solid #ddd; }
+  #retour { position: absolute; top: 10px; left: 10px; display: none; }
+  #info { position: absolute; bottom: 10px; left: 10px; background: #fffc; padding: 4px 8px; }
+  table { border-collapse: collapse; width: 100%; font-size: 13px; }
+  th { cursor: pointer; background: #eee; position: sticky; top: 0; }
+  td, th { padding: 3px 6px; border-bottom: 1px solid #eee; text-align: left; }
+  td.num { text-align: right; }
+</style>
+</head>
+<body>
+<div id="carte"><button id="retour">⬅️ Retour à la carte de France</button><svg id="svg"></svg><div id="info"></div></div>
+<div id="panneau">
+  <h2>Pesticides __ANNEE__ : top communes</h2>
+  <input id="recherche" placeholder="Rechercher (commune, INSEE, département)" style="width: 100%">
+  <p id="compte"></p>
+  <table><thead><tr><th data-k="0">INSEE</th><th data-k="1">Commune</th><th data-k="2">Dept</th><th data-k="3">Volume (kg)</th></tr></thead>
+  <tbody id="lignes"></tbody></table>
+</div>
+<script>
+const NATIONAL_BIN = "__NATIONAL_BIN__";
+const NATIONAL_META = __NATIONAL_META__;
+const TABLE = __TABLE__;
+const COULEURS = ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#fc4e2a', '#e31a1c', '#b10026'];
+const MAX_LIGNES = 300;
+
+function decode(buf) {
+  const dv = new DataView(buf);
+  const n = dv.getUint32(4, true), np = dv.getUint32(8, true), nr = dv.getUint32(12, true);
+  const bbox = [0, 1, 2, 3].map(i => dv.getFloat64(16 + 8 * i, true));
+  let o = 48;
+  const vol = new Float32Array(buf, o, n); o += 4 * n;
+  const rc = new Uint32Array(buf, o, n); o += 4 * n;
+  const rl = new Uint32Array(buf, o, nr); o += 4 * nr;
+  const q = new Uint16Array(buf, o, 2 * np);
+  return { n, vol, rc, rl, q, bbox };
+}
+
+function chemins(layer) {
+  // Projection équirectangulaire corrigée de la latitude moyenne de la France
+  const [x0, y0, x1, y1] = layer.bbox, k = Math.cos(46.5 * Math.PI / 180);
+  const sx = (x1 - x0) / 65535 * k, sy = (y1 - y0) / 65535;
+  const out = []; let r = 0, p = 0;
+  for (let i = 0; i < layer.n; i++) {
+    let d = '';
+    for (let j = 0; j < layer.rc[i]; j++, r++) {
+      for (let m = 0; m < layer.rl[r]; m++, p++) {
+        d += (m ? 'L' : 'M') + (layer.q[2 * p] * sx).toFixed(4) + ',' + ((65535 - layer.q[2 * p + 1]) * sy).toFixed(4);
+      }
+      d += 'Z';
+    }
+    out.push(d);
+  }
+  return { out, w: 65535 * sx, h: 65535 * sy };
+}
+
+function classes(vol) {
+  const s = Array.from(vol).filter(v => v > 0).sort((a, b) => a - b);
+  return COULEURS.slice(1).map((_, i) => s[Math.floor((i + 1) * s.length / COULEURS.length)] || 0);
+}
+
+function dessiner(layer, noms, onClick) {
+  const svg = document.getElementById('svg'), { out, w, h } = chemins(layer), seuils = classes(layer.vol);
+  svg.setAttribute('viewBox', `0 0 ${w} ${h}`);
+  svg.innerHTML = '';
+  out.forEach((d, i) => {
+    const path = document.createElementNS('http://www.w3.org/2000/svg', 'path');
+    const c = seuils.filter(s => layer.vol[i] > s).length;
+    path.setAttribute('d', d);
+    path.setAttribute('fill', layer.vol[i] > 0 ? COULEURS[c] : '#eee');
+    path.onmouseenter = () => { document.getElementById('info').textContent = `${noms[i]} : ${Math.round(layer.vol[i]).toLocaleString('fr')} kg`; };
+    if (onClick) path.onclick = () => onClick(i);
+    svg.appendChild(path);
+  });
+}
+
+function vueNationale() {
+  const raw = Uint8Array.from(atob(NATIONAL_BIN), c => c.charCodeAt(0)).buffer;
+  document.getElementById('retour').style.display = 'none';
+  dessiner(decode(raw), NATIONAL_META.noms, i => vueDepartement(NATIONAL_META.codes[i]));
+}
+
+function charger(url, lire) {
+  return fetch(url).then(r => {
+    if (!r.ok) throw new Error(`${url} : HTTP ${r.status}`);
+    return lire(r);
+  });
+}
+
+async function vueDepartement(code) {
+  const info = document.getElementById('info');
+  info.textContent = `Chargement du département ${code}...`;
+  let bin, meta;
+  try {
+    [bin, meta] = await Promise.all([
+      charger(`dept/${code}.bin`, r => r.arrayBuffer()),
+      charger(`dept/${code}.json`, r => r.json()),
+    ]);
+  } catch (e) {
+    // Fichier absent ou réseau coupé : la carte de France reste affichée, avec le motif
+    info.textContent = `Département ${code} indisponible (${e.message}).`;
+    return;
+  }
+  info.textContent = '';
+  document.getElementById('retour').style.display = 'block';
+  dessiner(decode(bin), meta.noms, null);
+  document.getElementById('recherche').value = code;
+  afficherTable();
+}
+
+let tri = { k: 3, sens: -1 };
+function afficherTable() {
+  // Comparaison sans casse : '2a' trouve la Corse-du-Sud (codes INSEE et département 2A / 2B)
+  const f = document.getElementById('recherche').value.trim().toLowerCase();
+  const lignes = TABLE.filter(r => !f || r[0].toLowerCase().startsWith(f) || r[2].toLowerCase() === f
+                                      || r[1].toLowerCase().includes(f))
+    .sort((a, b) => (a[tri.k] > b[tri.k] ? 1 : a[tri.k] < b[tri.k] ? -1 : 0) * tri.sens);
+  document.getElementById('compte').textContent = `${lignes.length} communes`;
+  // Lignes construites en textContent : les noms de communes ne sont jamais interprétés comme du HTML
+  document.getElementById('lignes').replaceChildren(...lignes.slice(0, MAX_LIGNES).map(r => {
+    const tr = document.createElement('tr');
+    [r[0], r[1], r[2], r[3].toLocaleString('fr')].forEach((v, k) => {
+      const td = tr.insertCell();
+      td.textContent = v;
+      if (k === 3) td.className = 'num';
+    });
+    return tr;
+  }));
+}
+
+document.querySelectorAll('th').forEach(th => th.onclick = () => {
+  const k = +th.dataset.k;
+  tri = { k, sens: tri.k === k ? -tri.sens : (k === 3 ? -1 : 1) };
+  afficherTable();
+});
+document.getElementById('recherche').oninput = afficherTable;
+document.getElementById('retour').onclick = () => { document.getElementById('recherche').value = ''; afficherTable(); vueNationale(); };
+vueNationale();
+afficherTable();
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    export_site()
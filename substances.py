@@ -0,0 +1,146 @@
+import pandas as pd
+from sqlalchemy import create_engine
+
+from cas import canonical_cas
+
+# --- CONFIGURATION ---
+DB_FILE = 'datacreation/phyto_data.db'
+
+# --- DICTIONNAIRE DE TRADUCTION (CODES H -> FRANÇAIS) ---
+GHS_MAP = {
+    # Toxicité aiguë
+    'H300': 'Mortel en cas d\'ingestion',
+    'H301': 'Toxique en cas d\'ingestion',
+    'H302': 'Nocif en cas d\'ingestion',
+    'H304': 'Peut être mortel en cas d\'ingestion et de pénétration dans les voies respiratoires',
+    'H310': 'Mortel par contact cutané',
+    'H311': 'Toxique par contact cutané',
+    'H312': 'Nocif par contact cutané',
+    'H330': 'Mortel par inhalation',
+    'H331': 'Toxique par inhalation',
+    'H332': 'Nocif par inhalation',
+
+    # Corrosion / Irritation
+    'H314': 'Provoque des brûlures de la peau et des lésions oculaires graves',
+    'H315': 'Provoque une irritation cutanée',
+    'H317': 'Peut provoquer une allergie cutanée',
+    'H318': 'Provoque des lésions oculaires graves',
+    'H319': 'Provoque une sévère irritation des yeux',
+
+    # Cancérogénicité / Mutagénicité / Reprotoxicité (CMR)
+    'H340': 'Peut induire des anomalies génétiques',
+    'H341': 'Susceptible d\'induire des anomalies génétiques',
+    'H350': 'Peut provoquer le cancer',
+    'H351': 'Susceptible de provoquer le cancer',
+    'H360': 'Peut nuire à la fertilité ou au fœtus',
+    'H360D': 'Peut nuire au fœtus',
+    'H360F': 'Peut nuire à la fertilité',
+    'H361': 'Susceptible de nuire à la fertilité ou au fœtus',
+    'H361d': 'Susceptible de nuire au fœtus',
+
+    # Organes cibles
+    'H370': 'Risque avéré d\'effets graves pour les organes',
+    'H371': 'Risque présumé d\'effets graves pour les organes',
+    'H372': 'Risque avéré d\'effets graves pour les organes (exposition répétée)',
+    'H373': 'Risque présumé d\'effets graves pour les organes (exposition répétée)',
+
+    # Environnement (Écotoxicité)
+    'H400': 'Très toxique pour les organismes aquatiques',
+    'H410': 'Très toxique pour les organismes aquatiques, entraîne des effets néfastes à long terme',
+    'H411': 'Toxique pour les organismes aquatiques, entraîne des effets néfastes à long terme',
+    'H412': 'Nocif pour les organismes aquatiques, entraîne des effets néfastes à long terme',
+    'H413': 'Peut être nocif à long terme pour les organismes aquatiques',
+
+    # Abeilles / Ozone (EUH codes)
+    'EUH401': 'Respectez les instructions d\'utilisation pour éviter les risques pour la santé humaine et l\'environnement',
+}
+
+# Libellés courts des principaux codes de danger (affichage tableaux / tooltips)
+GHS_DESC = {
+    'H350': 'Cancer', 'H351': 'Cancer suspecté',
+    'H360': 'Reprotoxique', 'H361': 'Reprotoxique suspecté',
+    'H340': 'Mutagène', 'H341': 'Mutagène suspecté',
+    'H300': 'Mortel', 'H330': 'Mortel (Inhalation)', 'H310': 'Mortel (Peau)',
+    'H370': 'Dommages organes', 'H372': 'Dommages organes (long terme)',
+    'H400': 'Ecotoxique', 'H410': 'Ecotoxique (long terme)',
+    'H318': 'Lésions oculaires', 'H314': 'Brûlures'
+}
+
+# Sévérité
+SEVERITE_MAP = {
+    'H300': 100, 'H310': 100, 'H330': 100,
+    'H350': 50, 'H340': 50, 'H360': 50,
+    'H351': 10, 'H361': 10,
+    'H301': 5, 'H311': 5, 'H331': 5,
+    'H372': 5, 'H410': 5,
+    'H314': 2, 'H318': 2,
+}
+
+
+def flag_first_codes(ghs, first):
+    """
+    Colonne Premier : le code est en tête d'au moins une mention de la substance ("H300+H310" -> H300,
+    mention simple comprise). `first` est la table (CAS brut, Code) des premiers codes.
+    """
+    first = first.assign(CAS=canonical_cas(first['CAS']), Premier=True).drop_duplicates()
+    ghs = ghs.merge(first, on=['CAS', 'Code'], how='left')
+    return ghs.assign(Premier=ghs['Premier'].notna())
+
+
+def load_ghs_codes(db_file=DB_FILE):
+    """
+    Table longue (CAS, Code, Premier) : une ligne par mention de danger GHS d'une substance,
+    Premier indiquant un code en tête de mention (règle historique des profils de scoring.py)
+    """
+    from models import has_hazard_tables
+
+    engine = create_engine(f'sqlite:///{db_file}')
+    first = pd.read_sql(
+        "SELECT DISTINCT s.cas_number AS CAS, trim(CASE WHEN instr(t.valeur, '+') > 0 "
+        "THEN substr(t.valeur, 1, instr(t.valeur, '+') - 1) ELSE t.valeur END) AS Code "
+        "FROM substance s JOIN toxicite t ON s.id = t.substance_id WHERE t.categorie = 'GHS'",
+        engine)
+    if has_hazard_tables(engine):
+        # Base migrée (models.py) : jointure indexée sur clés entières, codes déjà éclatés
+        df = pd.read_sql(
+            "SELECT s.cas_number AS CAS, h.code AS Code FROM substance_hazard sh "
+            "JOIN substance s ON s.id = sh.substance_id JOIN hazard_code h ON h.id = sh.hazard_id",
+            engine)
+        df['CAS'] = canonical_cas(df['CAS'])
+        return flag_first_codes(df.drop_duplicates(), first).reset_index(drop=True)
+
+    df = pd.read_sql(
+        "SELECT s.cas_number AS CAS, t.valeur AS Code FROM substance s "
+        "JOIN toxicite t ON s.id = t.substance_id WHERE t.categorie = 'GHS'",
+        engine)
+
+    # Les codes combinés ("H300+H310") donnent une ligne par code
+    df['CAS'] = canonical_cas(df['CAS'])
+    df['Code'] = df['Code'].astype(str).str.split('+')
+    df = df.explode('Code')
+    df['Code'] = df['Code'].str.strip()
+    return flag_first_codes(df[df['Code'] != ''].drop_duplicates(), first).reset_index(drop=True)
+
+
+def load_substance_dimension(db_file=DB_FILE):
+    """
+    Dimension substances indexée par CAS canonique (cas.py) : Nom, Danger (libellés GHS) et Score
+    (sévérité maximale des codes, 1 si seuls des codes non pondérés, 0 si aucun).
+    """
+    engine = create_engine(f'sqlite:///{db_file}')
+    df_subst = pd.read_sql("SELECT cas_number AS CAS, nom_ephy AS Nom FROM substance", engine)
+    df_subst['CAS'] = canonical_cas(df_subst['CAS'])
+    df_subst = df_subst.drop_duplicates('CAS').set_index('CAS')
+
+    ghs = load_ghs_codes(db_file)
+    ghs['Libelle'] = ghs['Code'].map(GHS_DESC)
+    ghs['Score'] = ghs['Code'].map(SEVERITE_MAP).fillna(1)
+
+    libelles = ghs.dropna(subset=['Libelle']).drop_duplicates(['CAS', 'Libelle']).sort_values('Libelle')
+    df_subst['Danger'] = libelles.groupby('CAS')['Libelle'].agg(', '.join)
+    df_subst['Score'] = ghs.groupby('CAS')['Score'].max()
+
+    df_subst['Nom'] = df_subst['Nom'].fillna('CAS ' + df_subst.index.to_series())
+    df_subst['Danger'] = df_subst['Danger'].fillna('NON CLASSE')
+    df_subst['Score'] = df_subst['Score'].fillna(0).astype(int)
+    return df_subst[['Nom', 'Danger', 'Score']]
@@ -0,0 +1,178 @@
+"""
+Générateurs de données synthétiques : achats BNVD par code postal, référentiel E-Phy, fichiers EFSA,
+référentiel géographique CP -> communes et base toxicologique enrichie.
+
+Sert à mesurer les pipelines hors ligne, à n'importe quelle échelle, sans le CSV national ni les API.
+Les numéros CAS générés ont une clé de contrôle valide ; à graine égale, les mêmes CAS et codes postaux
+sont partagés par tous les générateurs.
+"""
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURATION ---
+BLOCK_ROWS = 500000
+YEARS = list(range(2015, 2025))
+BNVD_COLUMNS = ['annee', 'code_postal_acheteur', 'substance', 'cas', 'quantite_substance', 'classification']
+GHS_CODES = ['H300', 'H301', 'H302', 'H310', 'H317', 'H318', 'H330', 'H340', 'H341', 'H350', 'H351',
+             'H360', 'H361', 'H372', 'H373', 'H400', 'H410', 'H411', 'H412']
+EFSA_ASSESSMENTS = ['ADI', 'ARfD', 'AOEL', 'AAOEL', 'NOAEL']
+
+
+def cas_check_digit(body):
+    """Clé de contrôle CAS : somme pondérée (1, 2, 3... depuis la droite) des chiffres, modulo 10"""
+    digits = [int(d) for d in body if d.isdigit()][::-1]
+    return sum((i + 1) * d for i, d in enumerate(digits)) % 10
+
+
+def make_cas(n, seed=0):
+    """n numéros CAS distincts et valides (ex. '1071-83-6')"""
+    rng = np.random.default_rng(seed)
+    out = set()
+    while len(out) < n:
+        head, mid = rng.integers(50, 999999), rng.integers(0, 100)
+        body = f"{head}{mid:02d}"
+        out.add(f"{head}-{mid:02d}-{cas_check_digit(body)}")
+    return sorted(out)
+
+
+def make_postal_codes(n, seed=0):
+    """n codes postaux plausibles (départements 01 à 95)"""
+    rng = np.random.default_rng(seed)
+    depts = rng.integers(1, 96, n)
+    return sorted({f"{d:02d}{c:03d}" for d, c in zip(depts, rng.integers(0, 1000, n))})
+
+
+def write_bnvd_csv(path, n_rows=None, target_bytes=None, years=YEARS, n_cp=6000, n_cas=500, seed=0,
+                   block_rows=BLOCK_ROWS):
+    """
+    Écrit un CSV BNVD synthétique (';', décimales à virgule, latin-1) de n_rows lignes,
+    ou jusqu'à atteindre target_bytes. Écriture par blocs : mémoire constante quelle que soit la taille.
+    """
+    rng = np.random.default_rng(seed)
+    cps = np.array(make_postal_codes(n_cp, seed))
+    cas = np.array(make_cas(n_cas, seed))
+    names = np.array([substance_name(i) for i in range(len(cas))])
+    classes = np.array(['T', 'T+, CMR', 'N Organique', 'Autre'])
+    # Distribution de Zipf : quelques substances dominent les volumes, comme dans les données réelles
+    popularity = 1 / np.arange(1, len(cas) + 1)
+    popularity /= popularity.sum()
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    written = 0
+    with open(path, 'w', encoding='latin-1', newline='') as f:
+        f.write(';'.join(BNVD_COLUMNS) + '\n')
+        while True:
+            rows = block_rows if n_rows is None else min(block_rows, n_rows - written)
+            if rows <= 0: break
+            i_cas = rng.choice(len(cas), rows, p=popularity)
+            block = pd.DataFrame({
+                'annee': rng.choice(years, rows),
+                'code_postal_acheteur': rng.choice(cps, rows),
+                'substance': names[i_cas],
+                'cas': cas[i_cas],
+                'quantite_substance': np.round(rng.lognormal(2, 1.5, rows), 3),
+                'classification': rng.choice(classes, rows),
+            })
+            block.to_csv(f, sep=';', decimal=',', header=False, index=False)
+            written += rows
+            if target_bytes is not None and f.tell() >= target_bytes: break
+    return written
+
+
+def substance_name(i):
+    return f"SUBSTANCE_{i}"
+
+
+def ghs_codes_for(cas, seed=0):
+    """Mentions GHS déterministes d'une substance (0 à 4 codes, dont parfois un code combiné)"""
+    rng = np.random.default_rng([seed, zlib.crc32(cas.encode())])
+    codes = list(rng.choice(GHS_CODES, rng.integers(0, 5), replace=False))
+    if len(codes) >= 2 and rng.random() < 0.2:
+        codes = [f"{codes[0]}+{codes[1]}"] + codes[2:]
+    return codes
+
+
+def write_ephy_csv(path, n_cas=500, seed=0):
+    """Référentiel E-Phy des substances actives (format de main.py : ';', Windows-1252), avec des CAS manquants"""
+    cas = make_cas(n_cas, seed)
+    df = pd.DataFrame({'Nom substance active': [substance_name(i) for i in range(len(cas))], 'Numero CAS': cas})
+    df.loc[df.index % 50 == 49, 'Numero CAS'] = 'NC'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    df.to_csv(path, sep=';', encoding='cp1252', index=False)
+    return path
+
+
+def write_efsa_xlsx(char_path, ref_path, n_cas=500, seed=0):
+    """Fichiers EFSA OpenFoodTox : caractérisation (CAS, nom) et valeurs de référence par substance"""
+    rng = np.random.default_rng(seed)
+    cas = make_cas(n_cas, seed)
+    names = [substance_name(i) for i in range(len(cas))]
+    pd.DataFrame({'casNumber': cas, 'substance': names}).to_excel(char_path, index=False)
+
+    n_refs = rng.integers(0, 4, len(cas))
+    ref = pd.DataFrame({
+        'substance': np.repeat(names, n_refs),
+        'assessment': rng.choice(EFSA_ASSESSMENTS, n_refs.sum()),
+        'value': np.round(rng.lognormal(-3, 2, n_refs.sum()), 4),
+        'unit': 'mg/kg bw/day',
+    })
+    ref.to_excel(ref_path, index=False)
+    return char_path, ref_path
+
+
+def make_geo_references(n_cp=6000, seed=0, max_communes=4):
+    """
+    Référentiel géographique au format de aggregates.load_geo_references :
+    (dept_index, commune_index {INSEE: {area, population, nom, dept}}, cp_map {CP: [INSEE...]}).
+    Quelques CP restent sans commune, quelques communes ont une surface nulle.
+    """
+    rng = np.random.default_rng(seed)
+    pop_rng = np.random.default_rng(seed + 1)  # Tirage séparé : surfaces et CP identiques aux versions précédentes
+    commune_index, cp_map = {}, {}
+    for i, cp in enumerate(make_postal_codes(n_cp, seed)):
+        if i % 100 == 99: continue  # CP inconnu du référentiel
+        insees = [f"{cp[:2]}{(int(cp[2:]) * 7 + k) % 1000:03d}" for k in range(rng.integers(1, max_communes + 1))]
+        for insee in insees:
+            commune_index.setdefault(insee, {'area': float(rng.lognormal(2, 1)) if i % 250 else 0.0,
+                                             'nom': f"COMMUNE_{insee}", 'dept': insee[:2]})
+        cp_map[cp] = sorted(set(insees))
+    for info in commune_index.values():
+        info['population'] = float(round(pop_rng.lognormal(7, 1.5)))
+    dept_index = {d: {'nom': f"DEPARTEMENT_{d}", 'geometry': None} for d in {v['dept'] for v in commune_index.values()}}
+    return dept_index, commune_index, cp_map
+
+
+def write_substance_db(db_file, n_cas=500, seed=0):
+    """Base toxicologique enrichie (schéma de models.py) : substances E-Phy + mentions GHS + valeurs EFSA"""
+    import sqlite3
+
+    rng = np.random.default_rng(seed)
+    cas = make_cas(n_cas, seed)
+    os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+    if os.path.exists(db_file): os.remove(db_file)
+    con = sqlite3.connect(db_file)
+    con.executescript("""
+        CREATE TABLE substance (id INTEGER PRIMARY KEY, cas_number VARCHAR UNIQUE NOT NULL, nom_ephy VARCHAR,
+            fonction VARCHAR, cid_pubchem INTEGER, masse_molaire FLOAT, formule VARCHAR);
+        CREATE TABLE toxicite (id INTEGER PRIMARY KEY, substance_id INTEGER REFERENCES substance(id),
+            source_db VARCHAR, categorie VARCHAR, parametre VARCHAR, valeur VARCHAR, unite VARCHAR);
+    """)
+    con.executemany("INSERT INTO substance VALUES (?, ?, ?, 'Substance Active', ?, ?, NULL)",
+                    [(i + 1, c, substance_name(i), 1000 + i, float(rng.uniform(100, 500))) for i, c in enumerate(cas)])
+    tox = []
+    for i, c in enumerate(cas):
+        tox += [(i + 1, 'PubChem', 'GHS', 'Hazard', code, None) for code in ghs_codes_for(c, seed)]
+        tox += [(i + 1, 'EFSA', 'Tox', a, f"{rng.lognormal(-3, 2):.4f}", 'mg/kg bw/day')
+                for a in rng.choice(EFSA_ASSESSMENTS, rng.integers(0, 3), replace=False)]
+    con.executemany("INSERT INTO toxicite (substance_id, source_db, categorie, parametre, valeur, unite) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", tox)
+    con.commit()
+    con.close()
+
+    from models import migrate
+    from sqlalchemy import create_engine
+    migrate(create_engine(f'sqlite:///{db_file}'))  # Index et dimension hazard_code, comme une base réelle migrée
+    return db_file
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from aggregates import build_rankings, read_rankings, save_rankings
+
+
+def test_classements_relus_identiques(tmp_path):
+    communes = pd.DataFrame({
+        'Annee': [2020, 2020, 2020, 2020, 2021],
+        'INSEE': ['01001', '01001', '01002', '2A004', '01001'],
+        'Dept': ['01', '01', '01', '2A', '01'],
+        'CAS': ['50-00-0', '64-17-5', '50-00-0', '64-17-5', '50-00-0'],
+        'Volume': [1.0, 3.0, 2.0, 4.0, 5.0],
+    })
+    save_rankings(communes, str(tmp_path))
+    saved = read_rankings(2020, agg_dir=str(tmp_path), top_n=1)
+    built = build_rankings(communes[communes['Annee'] == 2020], top_n=1)
+    for level in built:
+        pd.testing.assert_frame_equal(saved[level].table, built[level].table, check_dtype=False)
+        assert saved[level].summaries == built[level].summaries
+    assert list(saved['depts'].ranking('01')['CAS']) == ['50-00-0', '64-17-5']  # 3 kg puis 3 kg : ordre CAS
+    assert list(saved['communes'].top('01001')['CAS']) == ['64-17-5']
+    assert read_rankings(1999, agg_dir=str(tmp_path)) is None
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from aggregates import save_aggregates
+from api import create_app
+
+
+@pytest.fixture
+def client(tmp_path):
+    communes = pd.DataFrame({'Annee': [2020, 2021, 2021], 'Dept': ['01', '01', '2A'],
+                             'INSEE': ['01001', '01001', '2A004'], 'Commune': ['A', 'A', 'Ajaccio'],
+                             'Volume': [1.0, 2.0, 3.0]})
+    cs = communes.assign(CAS='50-00-0')[['Annee', 'INSEE', 'Dept', 'CAS', 'Volume']]
+    save_aggregates({
+        'national': pd.DataFrame({'Annee': [2020, 2021], 'Volume': [1.0, 5.0], 'Nb_Communes': [1, 2],
+                                  'Nb_Substances': [1, 1]}),
+        'departements': communes.groupby(['Annee', 'Dept'], as_index=False)['Volume'].sum(),
+        'communes': communes,
+        'communes_substances': cs,
+        'substances': cs.groupby(['Annee', 'CAS'], as_index=False)['Volume'].sum().assign(Nb_Communes=1),
+    }, str(tmp_path))
+    return TestClient(create_app(str(tmp_path)))
+
+
+def test_national_toutes_annees(client):
+    r = client.get('/national')
+    assert r.status_code == 200
+    assert [row['Annee'] for row in r.json()['data']] == [2020, 2021]
+
+
+def test_national_une_annee(client):
+    r = client.get('/national', params={'annee': 2020})
+    assert r.status_code == 200
+    assert r.json()['data'] == [{'Annee': 2020, 'Volume': 1.0, 'Nb_Communes': 1, 'Nb_Substances': 1}]
+
+
+def test_national_annee_inconnue(client):
+    assert client.get('/national', params={'annee': 1999}).status_code == 404
+
+
+def test_communes_du_departement(client):
+    r = client.get('/departements/2A/communes')
+    assert r.status_code == 200
+    assert [row['INSEE'] for row in r.json()['data']] == ['2A004']
+    assert client.get('/departements/99/communes').status_code == 404
@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pipeline
+
+
+@pytest.mark.parametrize('script', ['big_one.py', 'carto_api_hubeau.py'])
+def test_base_absente_etape_en_echec(tmp_path, script):
+    # Répertoire de travail vide : DB_FILE (chemin relatif) n'existe pas. Une sortie d'un run précédent
+    # resterait présente : seul le code de sortie empêche pipeline.py d'enregistrer la clé de l'étape
+    env = dict(os.environ, PYTHONPATH=pipeline.ROOT)
+    proc = subprocess.run([sys.executable, os.path.join(pipeline.ROOT, script)], cwd=tmp_path, env=env,
+                          capture_output=True, text=True)
+    assert proc.returncode != 0, proc.stdout + proc.stderr
+    assert 'introuvable' in proc.stdout
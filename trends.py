@@ -0,0 +1,125 @@
+"""
+Dynamiques temporelles des volumes : variations annuelles, moyennes glissantes, CAGR et plus fortes variations.
+
+Chaque niveau (commune, département, substance) est mis sous forme de matrice dense clés x années,
+puis toutes les métriques sont calculées en une passe NumPy (pas de boucle par clé ni par année).
+Résultats écrits à côté des agrégats : tendances.parquet (une ligne par clé et par année) et
+tendances_resume.parquet (une ligne par clé, avec le rang des hausses / baisses de la dernière année).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregates import AGG_DIR, load_aggregates
+
+# --- CONFIGURATION ---
+ROLLING_WINDOW = 3  # Années de la moyenne glissante
+TOP_MOVERS = 20
+
+# Niveau -> (table d'agrégats, colonne clé)
+LEVELS = {
+    'commune': ('communes', 'INSEE'),
+    'departement': ('departements', 'Dept'),
+    'substance': ('substances', 'CAS'),
+}
+
+
+def year_matrix(df, key):
+    """Matrice (clés x années consécutives) des volumes, années manquantes à 0"""
+    wide = df.pivot_table(index=key, columns='Annee', values='Volume', aggfunc='sum', fill_value=0)
+    years = np.arange(wide.columns.min(), wide.columns.max() + 1)
+    wide = wide.reindex(columns=years, fill_value=0)
+    return wide.index.values, years, wide.values.astype(float)
+
+
+def compute_trends(df, key, window=ROLLING_WINDOW):
+    """Métriques annuelles (long) et résumé par clé (CAGR, dernière variation) pour un niveau"""
+    keys, years, v = year_matrix(df, key)
+    n_keys, n_years = v.shape
+
+    # Variations d'une année sur l'autre (la première année n'a pas de référence)
+    prev = np.full_like(v, np.nan)
+    prev[:, 1:] = v[:, :-1]
+    delta = v - prev
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_pct = np.where(prev > 0, delta / prev * 100, np.nan)
+
+    # Moyenne glissante par somme cumulée (fenêtre tronquée en début de série)
+    csum = np.cumsum(np.pad(v, ((0, 0), (1, 0))), axis=1)
+    lo = np.maximum(np.arange(n_years) + 1 - window, 0)
+    rolling = (csum[:, 1:] - csum[:, lo]) / (np.arange(n_years) + 1 - lo)
+
+    long = pd.DataFrame({
+        'Cle': np.repeat(keys, n_years),
+        'Annee': np.tile(years, n_keys),
+        'Volume': v.ravel(),
+        'Volume_Prec': prev.ravel(),
+        'Delta': delta.ravel(),
+        'Delta_Pct': delta_pct.ravel(),
+        'Moyenne_Glissante': rolling.ravel(),
+    })
+
+    # CAGR entre la première année non nulle et la dernière année
+    active = v > 0
+    first = np.where(active.any(axis=1), active.argmax(axis=1), n_years - 1)
+    v_first = v[np.arange(n_keys), first]
+    v_last = v[:, -1]
+    span = (n_years - 1) - first
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = np.where((span > 0) & (v_first > 0) & (v_last > 0),
+                        (v_last / v_first) ** (1 / np.maximum(span, 1)) - 1, np.nan)
+
+    last_delta = delta[:, -1] if n_years > 1 else np.full(n_keys, np.nan)
+    resume = pd.DataFrame({
+        'Cle': keys,
+        'Annee_Debut': years[first],
+        'Annee_Fin': years[-1],
+        'Volume_Debut': v_first,
+        'Volume_Fin': v_last,
+        'CAGR': cagr,
+        'Delta_Dernier': last_delta,
+    })
+    resume['Rang_Hausse'] = resume['Delta_Dernier'].rank(ascending=False, method='first')
+    resume['Rang_Baisse'] = resume['Delta_Dernier'].rank(ascending=True, method='first')
+    return long, resume
+
+
+def build_trends(tables, window=ROLLING_WINDOW):
+    """Calcule tous les niveaux : (tendances, tendances_resume), avec une colonne Niveau"""
+    longs, resumes = [], []
+    for niveau, (table, key) in LEVELS.items():
+        df = tables[table]
+        if df.empty: continue
+        long, resume = compute_trends(df, key, window)
+        longs.append(long.assign(Niveau=niveau))
+        resumes.append(resume.assign(Niveau=niveau))
+
+    tendances = pd.concat(longs, ignore_index=True)[
+        ['Niveau', 'Cle', 'Annee', 'Volume', 'Volume_Prec', 'Delta', 'Delta_Pct', 'Moyenne_Glissante']]
+    resume = pd.concat(resumes, ignore_index=True)
+    return tendances, resume[['Niveau'] + [c for c in resume.columns if c != 'Niveau']]
+
+
+def top_movers(resume, niveau, n=TOP_MOVERS, sens='hausse'):
+    """Les n plus fortes hausses (ou baisses) de volume sur la dernière année pour un niveau"""
+    rang = 'Rang_Hausse' if sens == 'hausse' else 'Rang_Baisse'
+    df = resume[(resume['Niveau'] == niveau) & resume['Delta_Dernier'].notna()]
+    return df.nsmallest(n, rang)
+
+
+def run(agg_dir=AGG_DIR):
+    print("--- CALCUL DES TENDANCES ---")
+    tables = load_aggregates(agg_dir)
+    tendances, resume = build_trends(tables)
+
+    tendances.sort_values(['Niveau', 'Cle', 'Annee']).to_parquet(os.path.join(agg_dir, 'tendances.parquet'), index=False)
+    resume.sort_values(['Niveau', 'Cle']).to_parquet(os.path.join(agg_dir, 'tendances_resume.parquet'), index=False)
+    print(f"✅ {len(tendances)} lignes de tendances, {len(resume)} séries résumées.")
+
+    print("Plus fortes hausses (départements) :")
+    print(top_movers(resume, 'departement', 5)[['Cle', 'Volume_Fin', 'Delta_Dernier', 'CAGR']].to_string(index=False))
+
+
+if __name__ == "__main__":
+    run()